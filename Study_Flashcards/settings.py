@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
+from importlib.util import find_spec
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -44,6 +46,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "study_tools.middleware.RequestMetricsMiddleware",
+    "study_tools.middleware.CompressionMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -76,22 +80,172 @@ WSGI_APPLICATION = "Study_Flashcards.wsgi.application"
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
+# DATABASE_ENGINE selects 'mysql' or 'sqlite' (DATABASE_NAME is then a file). Read replicas
+# are listed in DATABASE_REPLICAS, comma separated: hosts for MySQL, files for SQLite. The
+# replicas share the other settings of the primary and serve the study set and flashcard reads.
+
+DATABASE_ENGINES = {
+    'mysql': 'django.db.backends.mysql',
+    'sqlite': 'django.db.backends.sqlite3',
+}
+
+DATABASE_ENGINE = os.environ.get('DATABASE_ENGINE', 'mysql')
+
+
+def database(host=None, name=None):
+    config = {
+        'ENGINE': DATABASE_ENGINES[DATABASE_ENGINE],
+        'NAME': name or os.environ.get('DATABASE_NAME', 'study_tool_db' if DATABASE_ENGINE == 'mysql' else str(BASE_DIR / 'db.sqlite3')),
+        # Connections are kept for CONN_MAX_AGE seconds rather than opened per request,
+        # and checked before reuse so a connection dropped by the server is replaced
+        'CONN_MAX_AGE': int(os.environ.get('CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+    }
+    if DATABASE_ENGINE == 'mysql':
+        config.update({
+            'USER': os.environ.get('DATABASE_USER', 'root'),
+            'PASSWORD': os.environ.get('DATABASE_PASSWORD', ''),
+            'HOST': host or os.environ.get('DATABASE_HOST', '127.0.0.1'),
+            'PORT': os.environ.get('DATABASE_PORT', '3306'),
+            'OPTIONS': {
+                'init_command': "SET sql_mode='STRICT_TRANS_TABLES'"
+            },
+        })
+    return config
+
 
 DATABASES = {
+    'default': database(),
+}
+
+DATABASE_REPLICAS = []
+
+for index, location in enumerate(filter(None, os.environ.get('DATABASE_REPLICAS', '').split(',')), 1):
+    alias = 'replica{}'.format(index)
+    DATABASES[alias] = database(
+        host=location if DATABASE_ENGINE == 'mysql' else None,
+        name=location if DATABASE_ENGINE == 'sqlite' else None,
+    )
+    # Tests read and write the primary through every alias
+    DATABASES[alias]['TEST'] = {'MIRROR': 'default'}
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['study_tools.routers.ReplicaRouter']
+
+# Users are pinned to the primary for this long after their data changes, so they read
+# their own writes. Keep it above the replication lag.
+REPLICA_LAG_SECONDS = int(os.environ.get('REPLICA_LAG_SECONDS', 5))
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# CACHE_BACKEND selects 'locmem', 'file' (CACHE_LOCATION is a directory) or
+# 'redis' (CACHE_LOCATION is a redis:// URL). The API response cache uses it.
+
+CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+}
+
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'locmem')
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.mysql',
-        'NAME': 'study_tool_db',
-        'USER': 'root',
-        'PASSWORD': '',
-        'HOST': '127.0.0.1',
-        'PORT': '3306',
-        'OPTIONS': {
-            'init_command': "SET sql_mode='STRICT_TRANS_TABLES'"
-        }
-    }
+        'BACKEND': CACHE_BACKENDS[CACHE_BACKEND],
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    },
+    # Token -> user lookups of CachedTokenAuthentication, which only uses them with a
+    # backend shared by all processes (file or redis), not with per-process locmem. Past
+    # MAX_ENTRIES the file backend deletes a random third of its entries; give
+    # Redis a maxmemory eviction policy instead.
+    'tokens': {
+        'BACKEND': CACHE_BACKENDS[CACHE_BACKEND],
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'tokens'),
+        'KEY_PREFIX': 'tokens',
+        'OPTIONS': {} if CACHE_BACKEND == 'redis' else {
+            'MAX_ENTRIES': int(os.environ.get('TOKEN_CACHE_MAX_ENTRIES', 10000)),
+        },
+    },
+}
+
+RESPONSE_CACHE_ALIAS = 'default'
+RESPONSE_CACHE_TIMEOUT = int(os.environ.get('RESPONSE_CACHE_TIMEOUT', 300))
+
+TOKEN_CACHE_ALIAS = 'tokens'
+TOKEN_CACHE_TIMEOUT = int(os.environ.get('TOKEN_CACHE_TIMEOUT', 300))
+
+# Throttle buckets need a cache shared by all processes: Redis updates them atomically,
+# locmem buckets are per process and the file backend's incr() is not atomic
+THROTTLE_CACHE_ALIAS = 'default'
+
+
+# Request metrics
+# Every request is logged as a JSON line on the 'study_tools.requests' logger; set
+# REQUEST_LOG_LEVEL=INFO to see all of them rather than only those slower than REQUEST_SLOW_MS.
+
+REQUEST_SLOW_MS = int(os.environ.get('REQUEST_SLOW_MS', 500))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'study_tools.requests': {
+            'handlers': ['console'],
+            'level': os.environ.get('REQUEST_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+    },
 }
 
 
+# Delta sync
+# Each sync re-sends the changes of its last SYNC_OVERLAP_SECONDS to catch rows from
+# transactions that were still open. Clients that have not synced for longer than
+# SYNC_TOMBSTONE_DAYS get a full sync, since older tombstones are purged.
+
+SYNC_OVERLAP_SECONDS = int(os.environ.get('SYNC_OVERLAP_SECONDS', 30))
+SYNC_TOMBSTONE_DAYS = int(os.environ.get('SYNC_TOMBSTONE_DAYS', 90))
+
+
+# Response compression
+# Responses of at least COMPRESSION_MIN_BYTES are sent with brotli or gzip, whichever the
+# client accepts (brotli needs the brotli package). Smaller ones are not worth the CPU.
+
+COMPRESSION_ENABLED = os.environ.get('COMPRESSION_ENABLED', '1') == '1'
+COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', 1024))
+
+
+# Background jobs
+# Queued in the database and run by `manage.py run_jobs`. Deleting a study set of at least
+# JOB_DELETE_MIN_CARDS cards, or importing a file of at least JOB_IMPORT_MIN_BYTES, returns
+# 202 Accepted with a job to poll at /api/jobs/<id>/. Jobs work in chunks of JOB_CHUNK_SIZE
+# rows; a running job that has not reported for JOB_LEASE_SECONDS is queued again, at most
+# JOB_MAX_ATTEMPTS times. Uploads and exports are kept in JOB_FILES_DIR.
+
+JOB_FILES_DIR = os.environ.get('JOB_FILES_DIR', str(BASE_DIR / 'job_files'))
+JOB_CHUNK_SIZE = int(os.environ.get('JOB_CHUNK_SIZE', 2000))
+JOB_DELETE_MIN_CARDS = int(os.environ.get('JOB_DELETE_MIN_CARDS', 5000))
+JOB_IMPORT_MIN_BYTES = int(os.environ.get('JOB_IMPORT_MIN_BYTES', 1024 * 1024))
+JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', 300))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+JOB_RETENTION_DAYS = int(os.environ.get('JOB_RETENTION_DAYS', 7))
+
+
+# Review statistics
+# Review events are rolled up into per-card and per-set stats by a background job. Events
+# of the last REVIEW_ROLLUP_DELAY_SECONDS wait for the next rollup, so ones from transactions
+# still open are not missed. Rolled up events are kept for REVIEW_EVENT_RETENTION_DAYS.
+
+REVIEW_ROLLUP_DELAY_SECONDS = int(os.environ.get('REVIEW_ROLLUP_DELAY_SECONDS', 5))
+REVIEW_EVENT_RETENTION_DAYS = int(os.environ.get('REVIEW_EVENT_RETENTION_DAYS', 90))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -136,9 +290,33 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'study_tools.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
        'rest_framework.permissions.IsAuthenticated',
     ],
+    # orjson-backed JSON, and MessagePack for clients sending/accepting application/msgpack
+    'DEFAULT_RENDERER_CLASSES': [
+        'study_tools.renderers.FastJSONRenderer',
+        *(['study_tools.renderers.MessagePackRenderer'] if find_spec('msgpack') else []),
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'study_tools.renderers.FastJSONParser',
+        *(['study_tools.renderers.MessagePackParser'] if find_spec('msgpack') else []),
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+    'DEFAULT_PAGINATION_CLASS': 'study_tools.pagination.CreationCursorPagination',
+    'PAGE_SIZE': 50,
+    # Token buckets per user (or IP) and scope, kept in THROTTLE_CACHE_ALIAS; an empty rate
+    # turns a scope's throttling off
+    'DEFAULT_THROTTLE_CLASSES': [
+        'study_tools.throttling.TokenBucketThrottle',
+    ],
+    'DEFAULT_THROTTLE_RATES': {
+        'read': os.environ.get('THROTTLE_READ_RATE', '1200/min'),
+        'write': os.environ.get('THROTTLE_WRITE_RATE', '300/min'),
+        'auth': os.environ.get('THROTTLE_AUTH_RATE', '20/min'),
+    },
 }
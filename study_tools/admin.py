@@ -1,5 +1,186 @@
-from django.contrib import admin
+from django import forms
+from django.conf import settings
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Max
+from django.template.response import TemplateResponse
+from django.urls import reverse
+from django.utils.functional import cached_property
+from django.utils.html import format_html
+from .bulk import delete_cards, iter_id_chunks, move_cards
+from .jobs import enqueue_study_set_delete
 from .models import FlashCard, StudySet
+from .search import ranked_search
 
-# Register your models here.
-admin.site.register([FlashCard, StudySet])
\ No newline at end of file
+# Filtered changelists count at most this many rows, the same cap as "Show all"
+COUNT_LIMIT = 10000
+
+
+def estimate_rows(model, using):
+    """
+    Estimates the number of rows of the model's table from the database's statistics
+    (MySQL) or its highest id (SQLite and others), without scanning the table.
+    """
+    connection = connections[using]
+    if connection.vendor == 'mysql':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s',
+                [model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        if row and row[0]:
+            return row[0]
+    return model._default_manager.using(using).aggregate(last_id=Max('id'))['last_id'] or 0
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Changelist paginator for tables too big to COUNT(*) on every page view. Unfiltered
+    lists use the table's estimated size; filtered ones count up to COUNT_LIMIT rows.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            return estimate_rows(queryset.model, queryset.db)
+        return queryset.order_by()[:COUNT_LIMIT].count()
+
+
+class IndexedSearchMixin:
+    """
+    Searches by id when the term is a number, and otherwise through the full-text indexes of
+    study_tools.search, rather than with the admin's unindexed LIKE '%term%' scans.
+    """
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        if search_term.isdigit():
+            return queryset.filter(id=search_term), False
+        return ranked_search(queryset, search_term), False
+
+
+class ChunkedAdminMixin:
+    """
+    Changelist defaults for big tables: newest first by primary key, estimated counts, no
+    full count of filtered results, and a delete confirmation that does not list every
+    cascaded row.
+    """
+    ordering = ('-id',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+
+    def get_deleted_objects(self, objs, request):
+        objs = list(objs)
+        model_count = {self.model._meta.verbose_name_plural: len(objs)}
+        model_count.update(self.get_cascade_counts(objs))
+        perms_needed = set()
+        if not self.has_delete_permission(request):
+            perms_needed.add(self.model._meta.verbose_name)
+        return [str(obj) for obj in objs[:COUNT_LIMIT]], model_count, perms_needed, []
+
+    def get_cascade_counts(self, objs):
+        return {}
+
+
+class IsCloneFilter(admin.SimpleListFilter):
+    title = 'clone'
+    parameter_name = 'is_clone'
+
+    def lookups(self, request, model_admin):
+        return [('yes', 'Yes'), ('no', 'No')]
+
+    def queryset(self, request, queryset):
+        if self.value() in ('yes', 'no'):
+            return queryset.filter(source__isnull=self.value() == 'no')
+        return queryset
+
+
+@admin.register(StudySet)
+class StudySetAdmin(IndexedSearchMixin, ChunkedAdminMixin, admin.ModelAdmin):
+    list_display = ('id', 'title', 'user', 'card_count', 'is_public', 'source', 'last_modified', 'flashcards_link')
+    list_filter = ('is_public', IsCloneFilter)
+    search_fields = ('title',)
+    autocomplete_fields = ('user',)
+    readonly_fields = ('source', 'card_count', 'last_modified', 'version', 'updated_at', 'pending_deletion')
+
+    # StudySet.__str__ includes the user, also in autocomplete results
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('user')
+
+    @admin.display(description='flashcards')
+    def flashcards_link(self, study_set):
+        url = '{}?study_set__id__exact={}'.format(reverse('admin:study_tools_flashcard_changelist'), study_set.id)
+        return format_html('<a href="{}">{}</a>', url, study_set.card_count)
+
+    def get_cascade_counts(self, objs):
+        return {FlashCard._meta.verbose_name_plural: sum(study_set.card_count for study_set in objs if study_set.source_id is None)}
+
+    # Large StudySets are deleted in chunks by a background job, like through the API
+    def delete_model(self, request, obj):
+        if obj.card_count >= settings.JOB_DELETE_MIN_CARDS:
+            enqueue_study_set_delete(obj)
+            self.message_user(request, '"{}" is large and will be deleted by a background job.'.format(obj), messages.WARNING)
+        else:
+            obj.delete()
+
+    def delete_queryset(self, request, queryset):
+        queued = 0
+        for study_set in queryset:
+            if study_set.card_count >= settings.JOB_DELETE_MIN_CARDS:
+                enqueue_study_set_delete(study_set)
+                queued += 1
+            else:
+                study_set.delete()
+        if queued:
+            self.message_user(request, '{} large study sets will be deleted by a background job.'.format(queued), messages.WARNING)
+
+
+class MoveCardsForm(forms.Form):
+    target = forms.ModelChoiceField(queryset=StudySet.objects.all(), widget=forms.NumberInput, label='Target study set id')
+
+
+@admin.register(FlashCard)
+class FlashCardAdmin(IndexedSearchMixin, ChunkedAdminMixin, admin.ModelAdmin):
+    list_display = ('id', 'term', 'definition', 'study_set', 'date_of_creation', 'updated_at')
+    # FlashCard.__str__ and the study_set column include the StudySet and its user
+    list_select_related = ('study_set__user',)
+    search_fields = ('term', 'definition')
+    raw_id_fields = ('study_set',)
+    readonly_fields = ('date_of_creation', 'updated_at')
+    actions = ['move_to_study_set']
+
+    # Deletes in chunks of JOB_CHUNK_SIZE, each keeping counters and tombstones current
+    def delete_queryset(self, request, queryset):
+        for ids in iter_id_chunks(queryset, settings.JOB_CHUNK_SIZE):
+            delete_cards(ids)
+
+    # Asks for the target StudySet, then moves the selected cards in chunks of JOB_CHUNK_SIZE
+    @admin.action(description='Move selected flashcards to another study set')
+    def move_to_study_set(self, request, queryset):
+        form = MoveCardsForm(request.POST if 'apply' in request.POST else None)
+        if form.is_valid():
+            target = form.cleaned_data['target']
+            selected = moved = 0
+            for ids in iter_id_chunks(queryset, settings.JOB_CHUNK_SIZE):
+                selected += len(ids)
+                moved += len(move_cards(ids, target))
+            self.message_user(request, 'Moved {} flashcards to "{}".'.format(moved, target), messages.SUCCESS)
+            if moved < selected:
+                self.message_user(request, '{} flashcards were already in the study set or have a term it holds.'.format(selected - moved), messages.WARNING)
+            return None
+        return TemplateResponse(request, 'admin/study_tools/flashcard/move_to_study_set.html', {
+            **self.admin_site.each_context(request),
+            'title': 'Move flashcards to another study set',
+            'opts': self.model._meta,
+            'form': form,
+            'queryset': queryset,
+            'selected': request.POST.getlist(admin.helpers.ACTION_CHECKBOX_NAME),
+            'select_across': request.POST.get('select_across', '0'),
+            'action_checkbox_name': admin.helpers.ACTION_CHECKBOX_NAME,
+        })
@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class StudyToolsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "study_tools"
+
+    def ready(self):
+        from . import checks, signals  # noqa: F401
+        from .search import install_fts5
+        post_migrate.connect(install_fts5, sender=self)
@@ -0,0 +1,144 @@
+import math
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, HttpResponseNotAllowed
+from rest_framework.exceptions import Throttled
+from rest_framework.request import Request
+from rest_framework.status import HTTP_304_NOT_MODIFIED, HTTP_401_UNAUTHORIZED, HTTP_404_NOT_FOUND, HTTP_429_TOO_MANY_REQUESTS
+from .authentication import CachedTokenAuthentication, aauthenticate
+from .middleware import etag_matches
+from .renderers import FastJSONRenderer
+from .conditional import afirst_value, astudy_sets_state, make_etag
+from .models import StudySet
+from .response_cache import aget_generations, get_cache, get_timeout, response_key, stats
+from .views import StudySetViewSet, FlashCardViewSet
+
+# Async versions of the hot read endpoints for ASGI deployments. They return the same
+# payloads as the DRF viewsets and reuse their querysets, serializers and pagination,
+# so ownership filtering is identical, but authentication, the response cache and the
+# ETag lookup are awaited instead of holding a worker thread for the whole request.
+
+
+def json_response(data=None, status=200, etag=None):
+    response = HttpResponse(
+        FastJSONRenderer().render(data) if data is not None else b'',
+        status=status, content_type='application/json',
+    )
+    if etag is not None:
+        response['ETag'] = etag
+    return response
+
+
+async def check_throttles(request, view):
+    """
+    Runs the view's throttles like DRF's check_throttles(), awaiting those that have an
+    aallow_request(), and returns a 429 response when any refuses the request.
+    """
+    waits = []
+    for throttle in view.get_throttles():
+        allow_request = getattr(throttle, 'aallow_request', None) or sync_to_async(throttle.allow_request)
+        if not await allow_request(request, view):
+            waits.append(throttle.wait())
+    if not waits:
+        return None
+    wait = max((wait for wait in waits if wait is not None), default=None)
+    response = json_response({'detail': Throttled(wait).detail}, HTTP_429_TOO_MANY_REQUESTS)
+    if wait is not None:
+        response['Retry-After'] = '%d' % math.ceil(wait)
+    return response
+
+
+async def read(request, viewset_class, action, kwargs, generation_keys, etag_state, build):
+    """
+    Authenticates and throttles the request and answers it from the response cache, with
+    304 when the client's ETag is current, or by building the payload with viewset_class.
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    user = await aauthenticate(request)
+    if user is None:
+        response = json_response({'detail': 'Authentication credentials were not provided.'}, HTTP_401_UNAUTHORIZED)
+        response['WWW-Authenticate'] = CachedTokenAuthentication.keyword
+        return response
+
+    drf_request = Request(request, authenticators=())
+    drf_request.user = user
+    view = viewset_class(request=drf_request, action=action, kwargs=kwargs, args=(), format_kwarg=None)
+    throttled = await check_throttles(drf_request, view)
+    if throttled is not None:
+        return throttled
+
+    name = 'Async{}.{}'.format(viewset_class.__name__, action)
+    generations = await aget_generations(generation_keys(view, drf_request))
+    key = response_key(name, user.id, request.get_full_path(), FastJSONRenderer.media_type, generations)
+    cached = await get_cache().aget(key)
+    stats.record(name, cached is not None)
+    if cached is not None:
+        data, etag = cached
+    else:
+        state = await etag_state(user)
+        etag = make_etag(user.id, state, request.get_full_path(), FastJSONRenderer.media_type) if state is not None else None
+        if etag_matches(etag, request):
+            return json_response(status=HTTP_304_NOT_MODIFIED, etag=etag)
+        data = await build(view)
+        if data is None:
+            return json_response({'detail': 'Not found.'}, HTTP_404_NOT_FOUND)
+        await get_cache().aset(key, (data, etag), get_timeout())
+
+    if etag_matches(etag, request):
+        return json_response(status=HTTP_304_NOT_MODIFIED, etag=etag)
+    return json_response(data, etag=etag)
+
+
+def build_page(view):
+    page = view.paginate_queryset(view.get_queryset())
+    return view.get_paginated_response(view.get_serializer(page, many=True).data).data
+
+
+async def paginated_list(view):
+    # DRF's paginator runs its query synchronously, and so do the clone lookups of the
+    # querysets and the cards of clones loaded while serializing, so they share one thread hop
+    return await sync_to_async(build_page)(view)
+
+
+async def study_set_list(request):
+    return await read(
+        request, StudySetViewSet, 'list', {},
+        generation_keys=lambda view, drf_request: view.get_cache_generations(drf_request),
+        etag_state=astudy_sets_state,
+        build=paginated_list,
+    )
+
+
+async def study_set_detail(request, pk):
+    # Serializing a clone loads its inherited cards synchronously, so the lookup and the
+    # serializer share one thread hop
+    @sync_to_async
+    def build(view):
+        study_set = view.get_queryset().filter(pk=pk).first()
+        if study_set is None:
+            return None
+        view.check_object_permissions(view.request, study_set)
+        return view.get_serializer(study_set).data
+
+    return await read(
+        request, StudySetViewSet, 'retrieve', {'pk': pk},
+        generation_keys=lambda view, drf_request: view.get_cache_generations(drf_request),
+        etag_state=lambda user: afirst_value(StudySet.objects.live(), 'version', id=pk, user=user),
+        build=build,
+    )
+
+
+async def flashcard_list(request):
+    study_set_id = request.GET.get('study_set')
+
+    async def etag_state(user):
+        if study_set_id:
+            return await afirst_value(StudySet.objects.live(), 'version', id=study_set_id, user=user)
+        return await astudy_sets_state(user)
+
+    return await read(
+        request, FlashCardViewSet, 'list', {},
+        generation_keys=lambda view, drf_request: view.get_cache_generations(drf_request),
+        etag_state=etag_state,
+        build=paginated_list,
+    )
@@ -0,0 +1,92 @@
+import hashlib
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.authentication import TokenAuthentication, get_authorization_header
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from .response_cache import is_shared
+
+
+# Stored in place of a user when a token is invalidated, so a lookup that was
+# already in flight cannot cache the token again until the entry expires
+REVOKED = 'revoked'
+
+
+def get_token_cache():
+    """
+    Returns the cache of token -> user lookups, or None when it is not shared by all
+    processes: a token deleted through one process would keep working in the others.
+    """
+    cache = caches[getattr(settings, 'TOKEN_CACHE_ALIAS', 'tokens')]
+    return cache if is_shared(cache) else None
+
+
+def get_token_timeout():
+    return getattr(settings, 'TOKEN_CACHE_TIMEOUT', 300)
+
+
+def token_cache_key(key):
+    return 'token:{}'.format(hashlib.sha256(key.encode()).hexdigest())
+
+
+def invalidate_tokens(keys):
+    """
+    Drops cached lookups of the given token keys.
+    """
+    cache = get_token_cache()
+    if cache is not None:
+        cache.set_many({token_cache_key(key): REVOKED for key in keys}, get_token_timeout())
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication that keeps the token's user in a shared cache for
+    TOKEN_CACHE_TIMEOUT seconds, so a cached token costs no query at all. It is invalidated
+    when the token is deleted or its user is saved, which covers logout, password changes,
+    deactivation and permission changes; users changed with a queryset update() keep their
+    cached row until it expires.
+    """
+
+    def authenticate_credentials(self, key):
+        cache = get_token_cache()
+        if cache is None:
+            return super().authenticate_credentials(key)
+        cache_key = token_cache_key(key)
+        cached = cache.get(cache_key)
+        if cached is not None and cached != REVOKED:
+            if not cached.is_active:
+                raise AuthenticationFailed('User inactive or deleted.')
+            return cached, Token(key=key, user=cached)
+
+        user, token = super().authenticate_credentials(key)
+        if cached is None:
+            cache.add(cache_key, user, get_token_timeout())
+        return user, token
+
+
+async def aauthenticate(request):
+    """
+    Async equivalent of CachedTokenAuthentication for plain Django async views.
+    Returns the user of the request's token, or None when it is missing or invalid.
+    """
+    auth = get_authorization_header(request).split()
+    if len(auth) != 2 or auth[0].lower() != CachedTokenAuthentication.keyword.lower().encode():
+        return None
+    try:
+        key = auth[1].decode()
+    except UnicodeError:
+        return None
+
+    cache = get_token_cache()
+    cached = None
+    if cache is not None:
+        cached = await cache.aget(token_cache_key(key))
+    if cached is not None and cached != REVOKED:
+        return cached if cached.is_active else None
+
+    token = await Token.objects.select_related('user').filter(key=key).afirst()
+    if token is None or not token.user.is_active:
+        return None
+    if cache is not None and cached is None:
+        await cache.aadd(token_cache_key(key), token.user, get_token_timeout())
+    return token.user
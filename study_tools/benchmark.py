@@ -0,0 +1,308 @@
+import asyncio
+import io
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connection
+from django.test.utils import override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from . import response_cache
+from .models import StudySet, FlashCard
+
+
+SERVER_TIMING = re.compile(r'desc="(\d+) queries"')
+
+
+def percentile(values, percent):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not values:
+        return None
+    index = max(0, min(len(values) - 1, round(percent / 100 * len(values) + 0.5) - 1))
+    return values[index]
+
+
+def summarize(timings, queries, elapsed):
+    timings = sorted(timings)
+    return {
+        'requests': len(timings),
+        'p50_ms': percentile(timings, 50),
+        'p95_ms': percentile(timings, 95),
+        'p99_ms': percentile(timings, 99),
+        'mean_ms': sum(timings) / len(timings) if timings else None,
+        'throughput_rps': len(timings) / elapsed if elapsed else None,
+        'avg_queries': sum(queries) / len(queries) if queries else None,
+    }
+
+
+class EndpointBenchmark:
+    """
+    Runs the main study set and flashcard endpoints in-process through the full
+    middleware, authentication and serialization stack, as the given users.
+
+    Latencies come from the client and query counts from RequestMetricsMiddleware's
+    Server-Timing header. With cold=True the response cache is cleared before every read.
+    """
+
+    def __init__(self, users, requests=100, cold=False):
+        self.users = users
+        self.requests = requests
+        self.cold = cold
+        self.study_sets = {
+            user.id: list(StudySet.objects.filter(user=user).values_list('id', flat=True)) for user in users
+        }
+        self.picks = 0
+        self.last_response = None
+        self.clients = []
+        for user in users:
+            token, _ = Token.objects.get_or_create(user=user)
+            client = APIClient(SERVER_NAME='localhost')
+            client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+            self.clients.append((client, user))
+
+    def run(self):
+        with override_settings(ALLOWED_HOSTS=['localhost']):
+            results = {
+                'studysets-list': self.measure(self.read_requests(lambda user: '/api/studysets/')),
+                'studysets-detail': self.measure(self.read_requests(lambda user: '/api/studysets/{}/'.format(self.pick_study_set(user)))),
+                'flashcards-list-filtered': self.measure(self.read_requests(lambda user: '/api/flashcards/?study_set={}'.format(self.pick_study_set(user)))),
+                'flashcards-list': self.measure(self.read_requests(lambda user: '/api/flashcards/')),
+            }
+            created = []
+            results['flashcards-create'] = self.measure(self.create_requests(created))
+            results['flashcards-update'] = self.measure(
+                (client.patch, '/api/flashcards/{}/'.format(card_id), {'definition': 'Updated definition'}) for client, card_id in created
+            )
+            results['flashcards-delete'] = self.measure(
+                (client.delete, '/api/flashcards/{}/'.format(card_id), None) for client, card_id in created
+            )
+        return {
+            'database': connection.vendor,
+            'users': len(self.users),
+            'study_sets': StudySet.objects.filter(user__in=self.users).count(),
+            'flashcards': FlashCard.objects.filter(study_set__user__in=self.users).count(),
+            'requests_per_endpoint': self.requests,
+            'cold_cache': self.cold,
+            'endpoints': results,
+        }
+
+    # Cycles through the user's StudySets
+    def pick_study_set(self, user):
+        ids = self.study_sets[user.id]
+        self.picks += 1
+        return ids[self.picks % len(ids)] if ids else 0
+
+    def read_requests(self, url_for):
+        for i in range(self.requests):
+            client, user = self.clients[i % len(self.clients)]
+            yield client.get, url_for(user), None
+
+    def create_requests(self, created):
+        for i in range(self.requests):
+            client, user = self.clients[i % len(self.clients)]
+            data = {'study_set': self.pick_study_set(user), 'term': 'benchmark term {}'.format(i), 'definition': 'Benchmark definition'}
+            yield client.post, '/api/flashcards/', data
+            if self.last_response.status_code == 201:
+                created.append((client, self.last_response.data['id']))
+
+    def measure(self, requests):
+        timings, queries = [], []
+        elapsed = 0.0
+        for send, url, data in requests:
+            if self.cold:
+                response_cache.get_cache().clear()
+            start = time.perf_counter()
+            self.last_response = send(url, data) if data is not None else send(url)
+            duration = time.perf_counter() - start
+            elapsed += duration
+            timings.append(duration * 1000)
+            match = SERVER_TIMING.search(self.last_response.get('Server-Timing', ''))
+            if match:
+                queries.append(int(match.group(1)))
+        return summarize(timings, queries, elapsed)
+
+
+# Sync and async paths of the endpoints compared by ConcurrencyBenchmark
+CONCURRENCY_ENDPOINTS = {
+    'studysets-list': ('/api/studysets/', '/api/async/studysets/'),
+    'studysets-detail': ('/api/studysets/{study_set}/', '/api/async/studysets/{study_set}/'),
+    'flashcards-list': ('/api/flashcards/', '/api/async/flashcards/'),
+    'flashcards-list-filtered': ('/api/flashcards/?study_set={study_set}', '/api/async/flashcards/?study_set={study_set}'),
+}
+
+
+class ThreadSampler:
+    """
+    Records the highest number of live threads while it runs.
+    """
+
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.peak = threading.active_count()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+
+    def sample(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, threading.active_count())
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+
+class ConcurrencyBenchmark:
+    """
+    Sends requests to one endpoint with the given concurrency from clients that take
+    client_delay_ms to read each response, in three deployments:
+
+    - wsgi: the DRF view behind WSGIHandler with a pool of `threads` workers, where a
+      worker stays busy until the slow client has read the response
+    - asgi-sync: the DRF view behind ASGIHandler
+    - asgi-async: the async view behind ASGIHandler
+
+    Everything runs in-process, so the numbers compare the deployments rather than
+    predict production throughput.
+    """
+
+    def __init__(self, users, endpoint='studysets-list', requests=200, concurrency=50, client_delay_ms=50, threads=8, cold=False):
+        self.endpoint = endpoint
+        self.requests = requests
+        self.concurrency = concurrency
+        self.client_delay = client_delay_ms / 1000
+        self.threads = threads
+        self.cold = cold
+        self.clients = []
+        for user in users:
+            token, _ = Token.objects.get_or_create(user=user)
+            study_set = StudySet.objects.filter(user=user).values_list('id', flat=True).first() or 0
+            self.clients.append(('Token ' + token.key, study_set))
+
+    def run(self):
+        sync_path, async_path = CONCURRENCY_ENDPOINTS[self.endpoint]
+        with override_settings(ALLOWED_HOSTS=['localhost']):
+            modes = {
+                'wsgi': lambda: self.run_wsgi(sync_path),
+                'asgi-sync': lambda: asyncio.run(self.run_asgi(sync_path)),
+                'asgi-async': lambda: asyncio.run(self.run_asgi(async_path)),
+            }
+            results = {}
+            for mode, run in modes.items():
+                if self.cold:
+                    response_cache.get_cache().clear()
+                with ThreadSampler() as sampler:
+                    start = time.perf_counter()
+                    timings, queries, statuses = run()
+                    elapsed = time.perf_counter() - start
+                results[mode] = summarize(timings, queries, elapsed)
+                results[mode]['peak_threads'] = sampler.peak
+                results[mode]['errors'] = sum(1 for status in statuses if status != 200)
+        return {
+            'database': connection.vendor,
+            'endpoint': self.endpoint,
+            'requests': self.requests,
+            'concurrency': self.concurrency,
+            'client_delay_ms': self.client_delay * 1000,
+            'wsgi_threads': self.threads,
+            'cold_cache': self.cold,
+            'modes': results,
+        }
+
+    def request_for(self, i, path):
+        authorization, study_set = self.clients[i % len(self.clients)]
+        path, _, query = path.format(study_set=study_set).partition('?')
+        return authorization, path, query
+
+    def run_wsgi(self, path):
+        handler = WSGIHandler()
+        timings, queries, statuses = [], [], []
+
+        def call(i, start):
+            authorization, path_info, query = self.request_for(i, path)
+            environ = {
+                'REQUEST_METHOD': 'GET', 'PATH_INFO': path_info, 'QUERY_STRING': query,
+                'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+                'HTTP_AUTHORIZATION': authorization, 'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+                'wsgi.url_scheme': 'http', 'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+            }
+            response = {}
+
+            def start_response(status, headers, exc_info=None):
+                response['status'] = int(status.split()[0])
+                response['headers'] = dict(headers)
+
+            body = handler(environ, start_response)
+            try:
+                for _ in body:
+                    pass
+                # The worker is tied up while the response is written to the slow client
+                time.sleep(self.client_delay)
+            finally:
+                body.close()
+                clients.release()
+            timings.append((time.perf_counter() - start) * 1000)
+            self.record(response['headers'], queries)
+            statuses.append(response['status'])
+
+        # At most `concurrency` clients are connected; the ones beyond `threads` wait for a
+        # worker, and that wait counts towards their latency
+        clients = threading.Semaphore(self.concurrency)
+        futures = []
+        with ThreadPoolExecutor(max_workers=self.threads) as pool:
+            for i in range(self.requests):
+                clients.acquire()
+                futures.append(pool.submit(call, i, time.perf_counter()))
+        for future in futures:
+            future.result()
+        return timings, queries, statuses
+
+    async def run_asgi(self, path):
+        handler = ASGIHandler()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        timings, queries, statuses = [], [], []
+
+        async def call(i):
+            authorization, path_info, query = self.request_for(i, path)
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                'scheme': 'http', 'path': path_info, 'raw_path': path_info.encode(), 'query_string': query.encode(),
+                'root_path': '', 'headers': [(b'host', b'localhost'), (b'authorization', authorization.encode())],
+                'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+            }
+            response = {}
+
+            async def receive():
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    response['status'] = message['status']
+                    response['headers'] = {name.decode(): value.decode() for name, value in message['headers']}
+                elif not message.get('more_body'):
+                    # The event loop serves other clients while this one reads slowly
+                    await asyncio.sleep(self.client_delay)
+
+            async with semaphore:
+                start = time.perf_counter()
+                await handler(scope, receive, send)
+                timings.append((time.perf_counter() - start) * 1000)
+            self.record(response['headers'], queries)
+            statuses.append(response['status'])
+
+        await asyncio.gather(*(call(i) for i in range(self.requests)))
+        return timings, queries, statuses
+
+    def record(self, headers, queries):
+        match = SERVER_TIMING.search(headers.get('Server-Timing', ''))
+        if match:
+            queries.append(int(match.group(1)))
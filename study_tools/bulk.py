@@ -0,0 +1,196 @@
+from collections import defaultdict
+from django.db import transaction
+from django.utils import timezone
+from .models import StudySet, FlashCard, CardReview, DetachedCard, Tombstone
+from .serializers import FlashCardSerializer
+from .sharing import detach_cards
+from .stats import move_card_stats
+
+
+CONFLICT_ERROR = 'error'
+CONFLICT_SKIP = 'skip'
+CONFLICT_UPSERT = 'upsert'
+CONFLICT_MODES = (CONFLICT_ERROR, CONFLICT_SKIP, CONFLICT_UPSERT)
+TERM_CONFLICT = 'A flashcard with this term already exists in the study set.'
+
+
+def apply_bulk_cards(study_set, cards, delete_ids=(), on_conflict=CONFLICT_ERROR):
+    """
+    Creates, updates and deletes the FlashCards of one StudySet in a single transaction.
+
+    Items with an 'id' update that card, items without one create a new card.
+    Invalid items and ('study_set', 'term') conflicts are reported per item instead of
+    failing the whole batch; on_conflict decides whether a conflicting new card is
+    reported as an error, skipped, or upserted onto the existing card with that term.
+    In a clone, updating an inherited card gives the clone its own copy of it, and
+    deleting one detaches it from the clone.
+    """
+    result = {'created': [], 'updated': [], 'deleted': 0, 'skipped': [], 'errors': []}
+
+    existing_ids = [item['id'] for item in cards if item.get('id') is not None]
+    visible = FlashCard.objects.visible_to(study_set.user_id, study_set_id=study_set.id)
+    existing = {card.id: card for card in visible.filter(id__in=existing_ids)}
+
+    creates, updates = [], []
+    for index, item in enumerate(cards):
+        card_id = item.get('id')
+        if card_id is None:
+            serializer = FlashCardSerializer(data=item)
+        elif card_id in existing:
+            serializer = FlashCardSerializer(existing[card_id], data=item, partial=True)
+        else:
+            result['errors'].append({'index': index, 'errors': {'id': ['Flashcard not found.']}})
+            continue
+        if not serializer.is_valid():
+            result['errors'].append({'index': index, 'errors': serializer.errors})
+            continue
+        if card_id is None:
+            creates.append((index, FlashCard(study_set=study_set, **serializer.validated_data)))
+        else:
+            card = existing[card_id]
+            for field, value in serializer.validated_data.items():
+                setattr(card, field, value)
+            updates.append((index, card))
+
+    # Cards that already hold one of the batch's terms, inherited ones included, which the
+    # copies of changed inherited cards would clash with. A card may keep its own term,
+    # but terms are never swapped between cards within one batch.
+    delete_ids = [card_id for card_id in delete_ids if card_id not in existing]
+    taken = {
+        card.term: card for card in visible.filter(
+            term__in=[card.term for _, card in creates + updates],
+        ).exclude(id__in=delete_ids)
+    }
+    conflict = {'term': [TERM_CONFLICT]}
+
+    claimed, to_create, to_update = set(), [], []
+    for index, card in updates:
+        if card.term in claimed or (card.term in taken and taken[card.term].id != card.id):
+            result['errors'].append({'index': index, 'errors': conflict})
+            continue
+        claimed.add(card.term)
+        to_update.append(card)
+    for index, card in creates:
+        if card.term not in claimed and card.term not in taken:
+            claimed.add(card.term)
+            to_create.append(card)
+        elif on_conflict == CONFLICT_SKIP:
+            result['skipped'].append(index)
+        elif on_conflict == CONFLICT_UPSERT and card.term not in claimed and taken[card.term].id not in existing:
+            claimed.add(card.term)
+            taken[card.term].definition = card.definition
+            to_update.append(taken[card.term])
+        else:
+            result['errors'].append({'index': index, 'errors': conflict})
+
+    # Inherited cards being changed are replaced by copies, created along with the new cards
+    inherited = {card.id: card for card in to_update if card.study_set_id != study_set.id}
+    to_update = [card for card in to_update if card.study_set_id == study_set.id]
+    copies = [FlashCard(study_set=study_set, term=card.term, definition=card.definition) for card in inherited.values()]
+    detaching = list(inherited)
+    if delete_ids and study_set.source_id is not None:
+        detaching += visible.filter(id__in=delete_ids, study_set=study_set.source_id).values_list('id', flat=True)
+
+    with transaction.atomic():
+        if detaching:
+            detach_cards(study_set, detaching)
+        deleting_ids = list(FlashCard.objects.filter(study_set=study_set, id__in=delete_ids).values_list('id', flat=True)) if delete_ids else []
+        created = len(to_create) + len(copies)
+        if deleting_ids or to_update or created:
+            # Before the deletion, so clones that had detached the deleted cards are counted right
+            StudySet.objects.filter(id=study_set.id).bump_version(card_delta=created - len(deleting_ids), deleted_cards=deleting_ids)
+        if deleting_ids:
+            deleting = FlashCard.objects.filter(id__in=deleting_ids)
+            Tombstone.objects.record_cards(deleting)
+            # The total would include the CardReviews deleted along with the cards
+            _, deleted = deleting.delete()
+            result['deleted'] = deleted.get(FlashCard._meta.label, 0)
+        if to_update:
+            now = timezone.now()
+            for card in to_update:
+                card.updated_at = now
+            FlashCard.objects.bulk_update(to_update, ['term', 'definition', 'updated_at'])
+        if to_create or copies:
+            FlashCard.objects.bulk_create(to_create + copies)
+            # Not every backend returns primary keys from bulk_create, so read the new rows back
+            new_cards = {
+                card.term: card for card in FlashCard.objects.filter(study_set=study_set, term__in=[card.term for card in to_create + copies])
+            }
+            to_create = [new_cards[card.term] for card in to_create]
+            copies = [new_cards[card.term] for card in copies]
+            # The clone owner's reviews and stats of the inherited cards move to the copies
+            for card_id, copy in zip(inherited, copies):
+                CardReview.objects.filter(user_id=study_set.user_id, flashcard_id=card_id).update(flashcard=copy)
+            move_card_stats(study_set.user_id, {card_id: copy.id for card_id, copy in zip(inherited, copies)})
+
+    result['created'] = FlashCardSerializer(to_create, many=True).data
+    result['updated'] = FlashCardSerializer(to_update + copies, many=True).data
+    return result
+
+
+def iter_id_chunks(queryset, chunk_size):
+    """
+    Yields the ids of queryset in ascending lists of up to chunk_size, walking the primary key
+    so every chunk is read with an index seek however far in it is.
+    """
+    last_id = 0
+    while True:
+        ids = list(queryset.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:chunk_size])
+        if not ids:
+            return
+        yield ids
+        last_id = ids[-1]
+
+
+def delete_cards(flashcard_ids):
+    """
+    Deletes the FlashCards in one transaction, keeping the counters, versions and tombstones
+    of their StudySets and of the clones inheriting them current. Returns how many were deleted.
+    """
+    sources = defaultdict(list)
+    with transaction.atomic():
+        for card_id, study_set_id in FlashCard.objects.filter(id__in=flashcard_ids).values_list('id', 'study_set'):
+            sources[study_set_id].append(card_id)
+        # Before the deletion, so clones that had detached the deleted cards are counted right
+        for study_set_id, card_ids in sources.items():
+            StudySet.objects.filter(id=study_set_id).bump_version(card_delta=-len(card_ids), deleted_cards=card_ids)
+        deleting = FlashCard.objects.filter(id__in=flashcard_ids)
+        Tombstone.objects.record_cards(deleting)
+        _, deleted = deleting.delete()
+    return deleted.get(FlashCard._meta.label, 0)
+
+
+def move_cards(flashcard_ids, target):
+    """
+    Moves the FlashCards into the target StudySet in one transaction and returns the ids of
+    those moved. Cards already in the target, or whose term it already shows, its own cards
+    or those a clone inherits, stay put.
+
+    The counters and versions of both sides, and of their clones, change as if the cards had
+    been deleted and created, and the users who no longer see a card get a tombstone for it.
+    """
+    with transaction.atomic():
+        cards = FlashCard.objects.filter(id__in=flashcard_ids).exclude(study_set=target)
+        rows = list(cards.values_list('id', 'study_set', 'study_set__user', 'term'))
+        visible = FlashCard.objects.visible_to(target.user_id, study_set_id=target.id)
+        taken = set(visible.filter(term__in=[term for *_, term in rows]).values_list('term', flat=True))
+        sources, changing_owner, keeping_owner = defaultdict(list), [], []
+        for card_id, study_set_id, user_id, term in rows:
+            if term in taken:
+                continue
+            taken.add(term)
+            sources[study_set_id].append(card_id)
+            (keeping_owner if user_id == target.user_id else changing_owner).append(card_id)
+        moving = changing_owner + keeping_owner
+        if not moving:
+            return []
+        for study_set_id, card_ids in sources.items():
+            StudySet.objects.filter(id=study_set_id).bump_version(card_delta=-len(card_ids), deleted_cards=card_ids)
+        if changing_owner:
+            Tombstone.objects.record_cards(FlashCard.objects.filter(id__in=changing_owner))
+        if keeping_owner:
+            Tombstone.objects.record_cards(FlashCard.objects.filter(id__in=keeping_owner), owners=False)
+        DetachedCard.objects.filter(flashcard__in=moving).delete()
+        FlashCard.objects.filter(id__in=moving).update(study_set=target, updated_at=timezone.now())
+        StudySet.objects.filter(id=target.id).bump_version(card_delta=len(moving))
+    return moving
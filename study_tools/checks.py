@@ -0,0 +1,20 @@
+from django.core.checks import Error, register
+from .response_cache import get_cache, is_shared
+from .routers import get_replicas
+
+
+@register()
+def check_replica_pin_cache(app_configs, **kwargs):
+    """
+    Reads go to the replicas unless the user is pinned to the primary, and the pins are kept
+    in the response cache, so with a per-process cache other workers miss them and users
+    can read from a replica that has not caught up with their own writes.
+    """
+    if get_replicas() and not is_shared(get_cache()):
+        return [Error(
+            'DATABASE_REPLICAS needs a cache shared by all processes.',
+            hint='Set RESPONSE_CACHE_ALIAS to a file or Redis cache, for example with CACHE_BACKEND=redis.',
+            obj='RESPONSE_CACHE_ALIAS',
+            id='study_tools.E001',
+        )]
+    return []
@@ -0,0 +1,90 @@
+import hashlib
+from django.db.models import Count, Max, Sum
+from django.utils.cache import patch_vary_headers, quote_etag
+from rest_framework.response import Response
+from rest_framework.status import HTTP_200_OK, HTTP_304_NOT_MODIFIED
+from .middleware import etag_matches
+from .models import StudySet
+
+
+def make_etag(*parts):
+    """
+    Builds a strong ETag from the given values.
+    """
+    key = ':'.join(str(part) for part in parts)
+    return quote_etag(hashlib.md5(key.encode()).hexdigest())
+
+
+def study_sets_state(user):
+    """
+    Summarises the versions of all the user's StudySets in one aggregated query.
+    Creating a StudySet raises the max id, deleting one lowers the count and
+    changing one raises the version sum, so any change gives a new tuple.
+    """
+    state = StudySet.objects.live().filter(user=user).aggregate(
+        count=Count('id'), versions=Sum('version'), last_id=Max('id'),
+    )
+    return state['count'], state['versions'], state['last_id']
+
+
+async def astudy_sets_state(user):
+    """
+    Async version of study_sets_state().
+    """
+    state = await StudySet.objects.live().filter(user=user).aaggregate(
+        count=Count('id'), versions=Sum('version'), last_id=Max('id'),
+    )
+    return state['count'], state['versions'], state['last_id']
+
+
+def first_value(queryset, field, **lookups):
+    """
+    Returns field of the first row of queryset matching lookups, or None when
+    there is no such row or a lookup value is not a valid id.
+    """
+    try:
+        return queryset.filter(**lookups).values_list(field, flat=True).first()
+    except ValueError:
+        return None
+
+
+async def afirst_value(queryset, field, **lookups):
+    """
+    Async version of first_value().
+    """
+    try:
+        return await queryset.filter(**lookups).values_list(field, flat=True).afirst()
+    except ValueError:
+        return None
+
+
+class ConditionalGetMixin:
+    """
+    Adds ETags derived from StudySet versions to list and retrieve responses,
+    and answers a matching If-None-Match with 304 before any cards are loaded.
+    Views implement get_etag_state(), returning None when the object does not exist.
+    The ETags also depend on the negotiated media type, since each renders another body.
+    """
+
+    def get_etag(self, request):
+        state = self.get_etag_state(request)
+        if state is None:
+            return None
+        return make_etag(request.user.id, state, request.get_full_path(), request.accepted_media_type)
+
+    def conditional_response(self, view, request, *args, **kwargs):
+        etag = self.get_etag(request)
+        if etag_matches(etag, request):
+            response = Response(status=HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        else:
+            response = view(request, *args, **kwargs)
+            if etag is not None and response.status_code == HTTP_200_OK:
+                response['ETag'] = etag
+        patch_vary_headers(response, ('Accept',))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(super().retrieve, request, *args, **kwargs)
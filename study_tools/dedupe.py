@@ -0,0 +1,226 @@
+import re
+import unicodedata
+import zlib
+from collections import defaultdict
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from .bulk import TERM_CONFLICT, delete_cards
+from .models import StudySet, FlashCard, CardReview
+from .sharing import copy_on_write, detach_cards
+from .stats import move_card_stats
+
+
+# Character shingles of this length are compared between cards
+SHINGLE_SIZE = 3
+# The MinHash signature of NUM_BINS values is cut into BANDS bands of ROWS each; cards
+# sharing any band are candidates, which catches pairs above about (1/BANDS)**(1/ROWS)
+NUM_BINS = 64
+BANDS = 16
+ROWS = NUM_BINS // BANDS
+# Candidates are confirmed by the Jaccard similarity of their shingles
+SIMILARITY_THRESHOLD = 0.6
+MAX_CLUSTERS = 5000
+# Keys compared within one bucket; bigger ones come from bands common to unrelated cards
+MAX_BUCKET = 50
+# Odd 64-bit multiplier that spreads the crc32 of a shingle over the bins
+MIX = 0x9E3779B97F4A7C15
+MASK = (1 << 64) - 1
+VALUE_BITS = 58
+
+
+def normalize(text):
+    """
+    Folds case, compatibility characters, punctuation and runs of whitespace away.
+    """
+    text = unicodedata.normalize('NFKC', text).casefold()
+    return ' '.join(re.findall(r'\w+', text))
+
+
+def shingles(text):
+    """
+    Returns the crc32 hashes of the text's character shingles.
+    """
+    if len(text) <= SHINGLE_SIZE:
+        return {zlib.crc32(text.encode())}
+    return {zlib.crc32(text[i:i + SHINGLE_SIZE].encode()) for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def minhash(hashes):
+    """
+    One-permutation MinHash: each shingle hash is mixed once, its top bits pick one of
+    NUM_BINS bins and the rest compete for that bin's minimum, so the signature costs one
+    pass over the shingles rather than one per bin. Empty bins borrow the value of the next
+    filled bin, offset by the distance, so short texts still get a comparable signature.
+    """
+    signature = [None] * NUM_BINS
+    for x in hashes:
+        x = (x * MIX) & MASK
+        index, value = x >> VALUE_BITS, x & ((1 << VALUE_BITS) - 1)
+        if signature[index] is None or value < signature[index]:
+            signature[index] = value
+    filled = [index for index, value in enumerate(signature) if value is not None]
+    for index in range(NUM_BINS):
+        if signature[index] is None:
+            source = next((i for i in filled if i > index), filled[0])
+            signature[index] = signature[source] + ((source - index) % NUM_BINS << VALUE_BITS)
+    return signature
+
+
+def jaccard(first, second):
+    shared = len(first & second)
+    return shared / (len(first) + len(second) - shared)
+
+
+def find_duplicate_clusters(user, progress=None):
+    """
+    Groups the FlashCards the user sees, in all their StudySets, into clusters of near
+    duplicates and returns the clusters with two or more cards, largest first.
+
+    Cards with the same normalized term and definition share a key and are hashed once.
+    Each key gets a MinHash signature of its shingles, and locality-sensitive hashing of
+    the signature's bands finds candidate pairs without comparing every pair of keys, so
+    the cost grows with the number of cards rather than its square; only the first
+    MAX_BUCKET keys of a bucket are compared with each other. progress(cards) is called
+    every 1000 keys.
+    """
+    keys, cards = {}, defaultdict(list)
+    rows = FlashCard.objects.visible_to(user).order_by('id').values_list('id', 'term', 'definition', 'study_set', 'clone_id')
+    for card_id, term, definition, study_set_id, clone_id in rows.iterator(chunk_size=2000):
+        key = '{} | {}'.format(normalize(term), normalize(definition))
+        keys.setdefault(key, len(keys))
+        cards[keys[key]].append({
+            'id': card_id, 'term': term, 'definition': definition,
+            'study_set': clone_id or study_set_id, 'inherited': clone_id is not None,
+        })
+
+    parents = list(range(len(keys)))
+
+    def find(index):
+        while parents[index] != index:
+            parents[index] = parents[parents[index]]
+            index = parents[index]
+        return index
+
+    key_shingles, buckets, hashed = {}, defaultdict(list), 0
+    for key, index in keys.items():
+        key_shingles[index] = shingles(key)
+        signature = minhash(key_shingles[index])
+        for band in range(BANDS):
+            buckets[band, tuple(signature[band * ROWS:(band + 1) * ROWS])].append(index)
+        hashed += len(cards[index])
+        if progress is not None and index % 1000 == 999:
+            progress(hashed)
+    for indexes in buckets.values():
+        for position, index in enumerate(indexes[:MAX_BUCKET]):
+            for other in indexes[position + 1:MAX_BUCKET]:
+                first, second = find(index), find(other)
+                if first != second and jaccard(key_shingles[index], key_shingles[other]) >= SIMILARITY_THRESHOLD:
+                    parents[second] = first
+
+    clusters = defaultdict(list)
+    for index in range(len(keys)):
+        clusters[find(index)].append(index)
+    result = []
+    for indexes in clusters.values():
+        members = sorted((card for index in indexes for card in cards[index]), key=lambda card: card['id'])
+        if len(members) < 2:
+            continue
+        # The oldest of the user's own cards is suggested, since inherited ones can change under them
+        keep = next((card for card in members if not card['inherited']), members[0])
+        result.append({'keep': keep['id'], 'exact': len(indexes) == 1, 'cards': members})
+    result.sort(key=lambda cluster: (-len(cluster['cards']), cluster['keep']))
+    return result[:MAX_CLUSTERS]
+
+
+def merge_cards(user, merges):
+    """
+    Applies a batch of merges, each keeping the 'keep' card and removing the 'remove' cards,
+    in one transaction. The user's own removed cards are deleted and inherited ones detached
+    from the clone. The kept card takes over the review history and stats of the removed
+    ones, and the 'term' or 'definition' given with the merge. Returns the number of cards
+    removed and a list of per-merge errors.
+
+    A term is only given to one kept card of a StudySet per batch. If a concurrent write
+    takes it first, the merge still removes its cards but reports the term as an error.
+    """
+    card_ids = {merge['keep'] for merge in merges} | {card_id for merge in merges for card_id in merge['remove']}
+    visible = {card.id: card for card in FlashCard.objects.visible_to(user).filter(id__in=card_ids)}
+    errors, valid, claimed, claimed_terms = [], [], set(), set()
+    for index, merge in enumerate(merges):
+        ids = [merge['keep'], *merge['remove']]
+        if any(card_id not in visible for card_id in ids):
+            errors.append({'index': index, 'errors': {'remove': ['Flashcard not found.']}})
+            continue
+        keep = visible[merge['keep']]
+        term = (keep.clone_id or keep.study_set_id, merge.get('term'))
+        if len(set(ids)) < len(ids) or claimed & set(ids):
+            errors.append({'index': index, 'errors': {'remove': ['A flashcard can only be in one merge.']}})
+        elif term in claimed_terms or term_taken(user, keep, merge.get('term'), ids):
+            errors.append({'index': index, 'errors': {'term': [TERM_CONFLICT]}})
+        else:
+            claimed.update(ids)
+            if merge.get('term') and merge['term'] != keep.term:
+                claimed_terms.add(term)
+            valid.append((index, merge))
+
+    removed = 0
+    with transaction.atomic():
+        deleting, detaching = [], defaultdict(list)
+        for _, merge in valid:
+            for card_id in merge['remove']:
+                card = visible[card_id]
+                if card.clone_id is None:
+                    deleting.append(card_id)
+                else:
+                    detaching[card.clone_id].append(card_id)
+            move_history(user, visible[merge['keep']], merge['remove'])
+        for clone in StudySet.objects.filter(id__in=detaching):
+            detach_cards(clone, detaching[clone.id])
+            removed += len(detaching[clone.id])
+        if deleting:
+            removed += delete_cards(deleting)
+        for index, merge in valid:
+            changes = {field: merge[field] for field in ('term', 'definition') if merge.get(field)}
+            if not changes:
+                continue
+            try:
+                # A savepoint, so a term taken meanwhile only fails this change
+                with transaction.atomic():
+                    update_card(visible[merge['keep']], changes)
+            except IntegrityError:
+                errors.append({'index': index, 'errors': {'term': [TERM_CONFLICT]}})
+    return removed, errors
+
+
+def term_taken(user, card, term, merged_ids):
+    """
+    Whether another card of the kept card's StudySet, not one of those merged, has the term.
+    """
+    if not term or term == card.term:
+        return False
+    study_set_id = card.clone_id or card.study_set_id
+    return FlashCard.objects.visible_to(user, study_set_id=study_set_id).filter(term=term).exclude(id__in=merged_ids).exists()
+
+
+def move_history(user, keep, removed_ids):
+    """
+    Gives the kept card the user's most recent review of the merged cards, if it has none,
+    and adds their answer stats to its own.
+    """
+    if not CardReview.objects.filter(user=user, flashcard=keep).exists():
+        latest = CardReview.objects.filter(user=user, flashcard__in=removed_ids).order_by(F('last_reviewed_at').desc(nulls_last=True)).first()
+        if latest is not None:
+            CardReview.objects.filter(id=latest.id).update(flashcard=keep)
+    move_card_stats(user.pk, {card_id: keep.id for card_id in removed_ids})
+
+
+def update_card(card, changes):
+    """
+    Changes the kept card, through copy-on-write if it is inherited.
+    """
+    if card.clone_id is not None:
+        copy_on_write(StudySet.objects.get(id=card.clone_id), card, changes)
+        return
+    for field, value in changes.items():
+        setattr(card, field, value)
+    card.save()
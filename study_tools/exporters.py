@@ -0,0 +1,46 @@
+import csv
+import json
+from .models import StudySet
+
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+EXPORT_FIELDS = ('study_set', 'term', 'definition')
+EXPORT_CHUNK_SIZE = 2000
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/jsonl; charset=utf-8',
+}
+
+
+class Echo:
+    """
+    File-like object whose write() returns the value instead of buffering it,
+    so csv.writer can produce one line at a time.
+    """
+    def write(self, value):
+        return value
+
+
+def export_rows(flashcards, fmt):
+    """
+    Yields the given FlashCards, from FlashCard.objects.visible_to(), as CSV or JSON-lines
+    text, one line at a time. The output uses the same columns as the importer so exports
+    can be imported again; inherited cards are listed under the title of the clone.
+    """
+    rows = flashcards.order_by('study_set', 'id').values_list('study_set', 'clone_id', 'term', 'definition')
+    titles = {}
+
+    def title(study_set_id):
+        if study_set_id not in titles:
+            titles[study_set_id] = StudySet.objects.filter(id=study_set_id).values_list('title', flat=True).first()
+        return titles[study_set_id]
+
+    rows = ((title(clone_id or study_set_id), term, definition) for study_set_id, clone_id, term, definition in rows.iterator(chunk_size=EXPORT_CHUNK_SIZE))
+    if fmt == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(EXPORT_FIELDS)
+        for row in rows:
+            yield writer.writerow(row)
+    else:
+        for row in rows:
+            yield json.dumps(dict(zip(EXPORT_FIELDS, row))) + '\n'
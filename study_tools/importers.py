@@ -0,0 +1,199 @@
+import csv
+import io
+import json
+from collections import Counter, defaultdict
+from django.db import transaction
+from django.utils import timezone
+from .bulk import CONFLICT_ERROR, CONFLICT_SKIP, CONFLICT_UPSERT
+from .models import StudySet, FlashCard, CardReview
+from .serializers import FlashCardSerializer
+from .sharing import detach_cards
+from .stats import move_card_stats
+
+
+IMPORT_FORMATS = ('csv', 'jsonl')
+DEFAULT_CHUNK_SIZE = 1000
+# Only the first errors are kept so a badly broken file cannot exhaust memory
+MAX_REPORTED_ERRORS = 1000
+
+
+def detect_format(filename):
+    """
+    Guesses the import format from a file name, defaulting to CSV.
+    """
+    if filename and filename.lower().endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    return 'csv'
+
+
+class UnreadableFile(Exception):
+    """
+    Raised by iter_rows() when the rest of the file cannot be read.
+    """
+
+
+def iter_rows(stream, fmt):
+    """
+    Yields one dict per row of a binary CSV (with a header row) or JSON-lines stream.
+    Rows are read lazily so the file is never held in memory as a whole. Raises
+    UnreadableFile where the file stops being UTF-8 or valid CSV.
+    """
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    try:
+        if fmt == 'csv':
+            yield from csv.DictReader(text)
+            return
+        for line in text:
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield row if isinstance(row, dict) else {'__invalid__': line}
+    except UnicodeDecodeError:
+        raise UnreadableFile('The file is not valid UTF-8.')
+    except csv.Error as exc:
+        raise UnreadableFile('The file is not valid CSV: {}.'.format(exc))
+
+
+class CardImporter:
+    """
+    Validates rows with FlashCardSerializer and inserts them in chunks of chunk_size.
+
+    Rows go into study_set when one is given, otherwise into the user's StudySet whose
+    title matches the row's 'study_set' column, which is created on first use.
+    """
+
+    def __init__(self, user, study_set=None, chunk_size=DEFAULT_CHUNK_SIZE, on_conflict=CONFLICT_SKIP):
+        self.user = user
+        self.study_set = study_set
+        self.chunk_size = chunk_size
+        self.on_conflict = on_conflict
+        self.study_sets = {}
+        self.report = {'imported': 0, 'updated': 0, 'skipped': 0, 'error_count': 0, 'errors': [], 'study_sets': {}}
+
+    # progress(rows) is called with the number of rows read after every chunk. A file that
+    # cannot be read to the end is imported up to the unreadable row, which is reported.
+    def run(self, rows, progress=None):
+        chunk = []
+        row_number = 0
+        try:
+            for row_number, row in enumerate(rows, start=1):
+                card = self.validate(row_number, row)
+                if card is not None:
+                    chunk.append((row_number, card))
+                if len(chunk) >= self.chunk_size:
+                    self.flush(chunk)
+                    chunk = []
+                    if progress is not None:
+                        progress(row_number)
+        except UnreadableFile as exc:
+            self.add_error(row_number + 1, {'non_field_errors': [str(exc)]})
+        if chunk:
+            self.flush(chunk)
+        if progress is not None:
+            progress(row_number)
+        return self.report
+
+    def add_error(self, row_number, errors):
+        self.report['error_count'] += 1
+        if len(self.report['errors']) < MAX_REPORTED_ERRORS:
+            self.report['errors'].append({'row': row_number, 'errors': errors})
+
+    def validate(self, row_number, row):
+        if '__invalid__' in row:
+            self.add_error(row_number, {'non_field_errors': ['Row is not a JSON object.']})
+            return None
+        serializer = FlashCardSerializer(data=row)
+        if not serializer.is_valid():
+            self.add_error(row_number, serializer.errors)
+            return None
+        title = row.get('study_set')
+        if self.study_set is None and title is not None and not isinstance(title, str):
+            self.add_error(row_number, {'study_set': ['Must be the title of a study set.']})
+            return None
+        study_set = self.get_study_set(title)
+        if study_set is None:
+            self.add_error(row_number, {'study_set': ['This field is required!']})
+            return None
+        return FlashCard(study_set=study_set, **serializer.validated_data)
+
+    def get_study_set(self, title):
+        if self.study_set is not None:
+            return self.study_set
+        title = (title or '').strip()
+        if not title:
+            return None
+        if title not in self.study_sets:
+            study_set = StudySet.objects.live().filter(user=self.user, title=title).order_by('id').first()
+            if study_set is None:
+                study_set = StudySet.objects.create(user=self.user, title=title)
+            self.study_sets[title] = study_set
+            self.report['study_sets'][title] = study_set.id
+        return self.study_sets[title]
+
+    def flush(self, chunk):
+        # Looked up per study set, so a clone's inherited cards count as its own and an
+        # import into a clone cannot duplicate a term it already shows
+        study_sets = {card.study_set_id: card.study_set for _, card in chunk}
+        terms = {card.term for _, card in chunk}
+        existing = {}
+        for study_set_id in study_sets:
+            for card in FlashCard.objects.visible_to(self.user, study_set_id=study_set_id).filter(term__in=terms):
+                existing[study_set_id, card.term] = card
+
+        seen, to_create, to_update, inherited = set(), [], [], {}
+        for row_number, card in chunk:
+            key = (card.study_set_id, card.term)
+            if key in seen:
+                self.conflict(row_number)
+            elif key in existing:
+                if self.on_conflict != CONFLICT_UPSERT:
+                    self.conflict(row_number)
+                elif existing[key].clone_id is not None:
+                    # The source's card is left untouched, the clone gets its own copy instead
+                    inherited[existing[key].id] = card
+                else:
+                    existing[key].definition = card.definition
+                    existing[key].updated_at = timezone.now()
+                    to_update.append(existing[key])
+            else:
+                to_create.append(card)
+            seen.add(key)
+
+        copies = list(inherited.values())
+        created = Counter(card.study_set_id for card in to_create + copies)
+        with transaction.atomic():
+            detached = defaultdict(list)
+            for card_id, copy in inherited.items():
+                detached[copy.study_set_id].append(card_id)
+            for study_set_id, card_ids in detached.items():
+                detach_cards(study_sets[study_set_id], card_ids)
+            FlashCard.objects.bulk_create(to_create + copies)
+            FlashCard.objects.bulk_update(to_update, ['definition', 'updated_at'])
+            if copies:
+                # Not every backend returns primary keys from bulk_create, so read the copies back
+                new_cards = {
+                    (card.study_set_id, card.term): card.id
+                    for card in FlashCard.objects.filter(study_set__in=detached, term__in={card.term for card in copies})
+                }
+                moved = {card_id: new_cards[copy.study_set_id, copy.term] for card_id, copy in inherited.items()}
+                # The clone owner's reviews and stats of the inherited cards move to the copies
+                for card_id, copy_id in moved.items():
+                    CardReview.objects.filter(user_id=self.user.pk, flashcard_id=card_id).update(flashcard_id=copy_id)
+                move_card_stats(self.user.pk, moved)
+            # One UPDATE per distinct number of new cards, usually a single one
+            bumped = defaultdict(set)
+            for card in to_create + to_update + copies:
+                bumped[created[card.study_set_id]].add(card.study_set_id)
+            for card_delta, study_set_ids in bumped.items():
+                StudySet.objects.filter(id__in=study_set_ids).bump_version(card_delta=card_delta)
+        self.report['imported'] += len(to_create)
+        self.report['updated'] += len(to_update) + len(copies)
+
+    def conflict(self, row_number):
+        if self.on_conflict == CONFLICT_ERROR:
+            self.add_error(row_number, {'term': ['A flashcard with this term already exists in the study set.']})
+        else:
+            self.report['skipped'] += 1
@@ -0,0 +1,245 @@
+import logging
+import tempfile
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import close_old_connections, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from . import response_cache
+from .bulk import delete_cards, iter_id_chunks
+from .dedupe import find_duplicate_clusters
+from .exporters import export_rows
+from .importers import CardImporter, iter_rows
+from .models import StudySet, FlashCard, Job, JOB_QUEUED, JOB_RUNNING, JOB_SUCCEEDED, JOB_FAILED
+from .sharing import materialize_clones
+from .stats import purge_review_events, rollup_review_events
+
+
+logger = logging.getLogger(__name__)
+
+JOB_DELETE_STUDY_SET = 'delete_study_set'
+JOB_IMPORT_CARDS = 'import_cards'
+JOB_EXPORT_CARDS = 'export_cards'
+JOB_REPAIR_COUNTERS = 'repair_counters'
+JOB_ROLLUP_REVIEWS = 'rollup_reviews'
+JOB_FIND_DUPLICATES = 'find_duplicates'
+# Queued jobs a worker tries to claim per poll before giving way to the others
+CLAIM_BATCH = 10
+
+
+class JobError(Exception):
+    """
+    Fails the job with the message, without logging a traceback.
+    """
+
+
+def get_chunk_size():
+    return getattr(settings, 'JOB_CHUNK_SIZE', 2000)
+
+
+def get_lease():
+    return timedelta(seconds=getattr(settings, 'JOB_LEASE_SECONDS', 300))
+
+
+def get_max_attempts():
+    return getattr(settings, 'JOB_MAX_ATTEMPTS', 3)
+
+
+def job_files():
+    return FileSystemStorage(location=getattr(settings, 'JOB_FILES_DIR', 'job_files'))
+
+
+def enqueue(kind, user=None, params=None, file=''):
+    return Job.objects.create(kind=kind, user=user, params=params or {}, file=file)
+
+
+def enqueue_once(kind, params=None):
+    """
+    Queues a job without a user unless one of its kind is already waiting to run.
+    """
+    job = Job.objects.filter(kind=kind, status=JOB_QUEUED).first()
+    return job if job is not None else enqueue(kind, params=params)
+
+
+def enqueue_study_set_delete(study_set):
+    """
+    Queues the deletion of the StudySet for its owner, unless one is already queued or running,
+    and hides the StudySet from then on, so it can no longer be changed or cloned.
+    """
+    with transaction.atomic():
+        StudySet.objects.filter(id=study_set.id).update(pending_deletion=True)
+        response_cache.invalidate(user_ids=[study_set.user_id], study_set_ids=[study_set.id])
+        if study_set.source_id is not None:
+            response_cache.invalidate_clones([study_set.user_id])
+        job = Job.objects.filter(
+            kind=JOB_DELETE_STUDY_SET, status__in=[JOB_QUEUED, JOB_RUNNING], params__study_set=study_set.id,
+        ).first()
+        return job if job is not None else enqueue(JOB_DELETE_STUDY_SET, study_set.user, {'study_set': study_set.id})
+
+
+def requeue_stale_jobs():
+    """
+    Queues again the running jobs whose worker stopped reporting, or fails those that
+    already used up JOB_MAX_ATTEMPTS.
+    """
+    stale = Job.objects.filter(status=JOB_RUNNING, heartbeat_at__lt=timezone.now() - get_lease())
+    stale.filter(attempts__lt=get_max_attempts()).update(status=JOB_QUEUED)
+    stale.update(status=JOB_FAILED, error='The worker running the job stopped.', finished_at=timezone.now())
+
+
+def claim_job():
+    """
+    Marks the oldest queued job as running and returns it, or None when the queue is empty.
+
+    A job is claimed with a conditional UPDATE rather than SELECT ... FOR UPDATE SKIP LOCKED,
+    which SQLite lacks: of the workers racing for a job only one changes its status.
+    """
+    for job_id in Job.objects.filter(status=JOB_QUEUED).order_by('id').values_list('id', flat=True)[:CLAIM_BATCH]:
+        now = timezone.now()
+        if Job.objects.filter(id=job_id, status=JOB_QUEUED).update(
+            status=JOB_RUNNING, started_at=now, heartbeat_at=now, attempts=F('attempts') + 1,
+        ):
+            return Job.objects.get(id=job_id)
+    return None
+
+
+def run_job(job):
+    """
+    Runs the handler of the job's kind and stores its result, or its error if it raises.
+    Nothing is stored if the job was requeued meanwhile, since another worker now runs it.
+    """
+    try:
+        result = JOB_HANDLERS[job.kind](job)
+    except JobError as exc:
+        status, result, error = JOB_FAILED, None, str(exc)
+    except Exception as exc:
+        logger.exception('Job %s (%s) failed', job.id, job.kind)
+        status, result, error = JOB_FAILED, None, str(exc) or type(exc).__name__
+    else:
+        status, error = JOB_SUCCEEDED, ''
+    Job.objects.filter(id=job.id, status=JOB_RUNNING, attempts=job.attempts).update(status=status, result=result, error=error, finished_at=timezone.now())
+
+
+def work(stop, poll=1.0, once=False):
+    """
+    Runs queued jobs until stop is set, waiting poll seconds whenever the queue is empty,
+    or, with once, until the queue is empty.
+    """
+    try:
+        while not stop.is_set():
+            close_old_connections()
+            requeue_stale_jobs()
+            job = claim_job()
+            if job is None:
+                if once:
+                    break
+                stop.wait(poll)
+                continue
+            run_job(job)
+    finally:
+        connections.close_all()
+
+
+def delete_study_set(job):
+    """
+    Deletes the StudySet's FlashCards in chunks of JOB_CHUNK_SIZE, one short transaction
+    each, then the StudySet itself. Its clones get their copies of the cards first, with
+    the copied cards reported as progress until the deletion starts.
+    """
+    study_set = StudySet.objects.filter(id=job.params['study_set'], user=job.user_id).first()
+    if study_set is None:
+        return {'deleted': 0}
+    materialize_clones(study_set, job.report)
+    cards = FlashCard.objects.filter(study_set=study_set)
+    total = cards.count()
+    job.report(0, total)
+    deleted = 0
+    for ids in iter_id_chunks(cards, get_chunk_size()):
+        deleted += delete_cards(ids)
+        job.report(deleted)
+    study_set.delete()
+    return {'deleted': deleted}
+
+
+def import_cards(job):
+    """
+    Imports the uploaded file with CardImporter and returns its report.
+    """
+    study_set = None
+    if job.params.get('study_set'):
+        study_set = StudySet.objects.live().filter(id=job.params['study_set'], user=job.user_id).first()
+        if study_set is None:
+            raise JobError('The study set no longer exists.')
+    importer = CardImporter(job.user, study_set, job.params['chunk_size'], job.params['on_conflict'])
+    storage = job_files()
+    try:
+        with storage.open(job.file, 'rb') as stream:
+            return importer.run(iter_rows(stream, job.params['format']), progress=job.report)
+    finally:
+        storage.delete(job.file)
+        Job.objects.filter(id=job.id).update(file='')
+
+
+def export_cards(job):
+    """
+    Writes the FlashCards of one StudySet, or of all the user's, to a file in JOB_FILES_DIR
+    that /api/jobs/<id>/download/ serves.
+    """
+    study_set_id = job.params.get('study_set')
+    if study_set_id is not None and not StudySet.objects.live().filter(id=study_set_id, user=job.user_id).exists():
+        raise JobError('The study set no longer exists.')
+    cards = FlashCard.objects.visible_to(job.user_id, study_set_id=study_set_id)
+    job.report(0, cards.count())
+    fmt = job.params['type']
+    with tempfile.TemporaryFile() as output:
+        for rows, line in enumerate(export_rows(cards, fmt)):
+            output.write(line.encode())
+            if rows and rows % get_chunk_size() == 0:
+                job.report(rows)
+        name = job_files().save('{}.{}'.format(uuid.uuid4().hex, fmt), File(output))
+    Job.objects.filter(id=job.id).update(file=name)
+    job.report(job.total)
+    return {'filename': job.params['filename']}
+
+
+def repair_counters(job):
+    """
+    Recomputes the counters of every StudySet, or of one user's.
+    """
+    study_sets = StudySet.objects.all()
+    if job.params.get('user') is not None:
+        study_sets = study_sets.filter(user=job.params['user'])
+    job.report(0, study_sets.count())
+    checked, repaired = study_sets.repair_counters_in_batches(job.params.get('batch_size', 1000), progress=job.report)
+    return {'checked': checked, 'repaired': repaired}
+
+
+def rollup_reviews(job):
+    """
+    Folds the new review events into the precomputed stats and purges expired events.
+    """
+    rolled_up = rollup_review_events(job.params.get('batch_size', 5000), progress=job.report)
+    return {'rolled_up': rolled_up, 'purged': purge_review_events()}
+
+
+def find_duplicates(job):
+    """
+    Clusters the user's near-duplicate FlashCards for /api/flashcards/duplicates/.
+    """
+    job.report(0, FlashCard.objects.visible_to(job.user_id).count())
+    clusters = find_duplicate_clusters(job.user_id, progress=job.report)
+    job.report(job.total)
+    return {'clusters': clusters}
+
+
+JOB_HANDLERS = {
+    JOB_DELETE_STUDY_SET: delete_study_set,
+    JOB_IMPORT_CARDS: import_cards,
+    JOB_EXPORT_CARDS: export_cards,
+    JOB_REPAIR_COUNTERS: repair_counters,
+    JOB_ROLLUP_REVIEWS: rollup_reviews,
+    JOB_FIND_DUPLICATES: find_duplicates,
+}
@@ -0,0 +1,38 @@
+import json
+from datetime import datetime, timezone
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from study_tools.benchmark import EndpointBenchmark
+from .seed_data import USERNAME_PREFIX
+
+
+class Command(BaseCommand):
+    help = "Benchmarks the study set and flashcard endpoints against data created by seed_data."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help="Requests per endpoint")
+        parser.add_argument('--users', type=int, default=10, help="Number of seeded users to spread the requests over")
+        parser.add_argument('--cold', action='store_true', help="Clear the response cache before every read")
+        parser.add_argument('--output', help="Write the results as JSON to this file")
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['users'] < 1:
+            raise CommandError("--requests and --users must be at least 1.")
+        users = list(User.objects.filter(username__startswith=USERNAME_PREFIX).order_by('id')[:options['users']])
+        if not users:
+            raise CommandError("No seeded users found, run seed_data first.")
+
+        results = EndpointBenchmark(users, options['requests'], options['cold']).run()
+        results['timestamp'] = datetime.now(timezone.utc).isoformat()
+
+        self.stdout.write("{:<26} {:>9} {:>9} {:>9} {:>10} {:>8}".format('endpoint', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s', 'queries'))
+        for endpoint, stats in results['endpoints'].items():
+            if not stats['requests']:
+                continue
+            self.stdout.write("{:<26} {:>9.2f} {:>9.2f} {:>9.2f} {:>10.1f} {:>8.1f}".format(
+                endpoint, stats['p50_ms'], stats['p95_ms'], stats['p99_ms'], stats['throughput_rps'], stats['avg_queries'] or 0,
+            ))
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(self.style.SUCCESS("Results written to {}".format(options['output'])))
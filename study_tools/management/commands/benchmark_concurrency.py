@@ -0,0 +1,48 @@
+import json
+from datetime import datetime, timezone
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from study_tools.benchmark import CONCURRENCY_ENDPOINTS, ConcurrencyBenchmark
+from .seed_data import USERNAME_PREFIX
+
+
+class Command(BaseCommand):
+    help = "Compares the sync (WSGI and ASGI) and async read paths of an endpoint under many concurrent slow clients."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoint', choices=sorted(CONCURRENCY_ENDPOINTS), default='studysets-list')
+        parser.add_argument('--requests', type=int, default=500, help="Requests per deployment")
+        parser.add_argument('--concurrency', type=int, default=100, help="Number of clients connected at once")
+        parser.add_argument('--client-delay', type=int, default=50, help="Milliseconds each client takes to read a response")
+        parser.add_argument('--threads', type=int, default=8, help="Worker threads of the WSGI deployment")
+        parser.add_argument('--users', type=int, default=10, help="Number of seeded users to spread the requests over")
+        parser.add_argument('--cold', action='store_true', help="Clear the response cache before each deployment")
+        parser.add_argument('--output', help="Write the results as JSON to this file")
+
+    def handle(self, *args, **options):
+        for option in ('requests', 'concurrency', 'threads', 'users'):
+            if options[option] < 1:
+                raise CommandError("--{} must be at least 1.".format(option))
+        if options['client_delay'] < 0:
+            raise CommandError("--client-delay cannot be negative.")
+        users = list(User.objects.filter(username__startswith=USERNAME_PREFIX).order_by('id')[:options['users']])
+        if not users:
+            raise CommandError("No seeded users found, run seed_data first.")
+
+        results = ConcurrencyBenchmark(
+            users, options['endpoint'], options['requests'], options['concurrency'],
+            options['client_delay'], options['threads'], options['cold'],
+        ).run()
+        results['timestamp'] = datetime.now(timezone.utc).isoformat()
+
+        self.stdout.write("{} with {} clients reading for {} ms each".format(results['endpoint'], results['concurrency'], results['client_delay_ms']))
+        self.stdout.write("{:<12} {:>9} {:>9} {:>9} {:>10} {:>8} {:>8} {:>7}".format('deployment', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s', 'queries', 'threads', 'errors'))
+        for mode, stats in results['modes'].items():
+            self.stdout.write("{:<12} {:>9.2f} {:>9.2f} {:>9.2f} {:>10.1f} {:>8.1f} {:>8} {:>7}".format(
+                mode, stats['p50_ms'], stats['p95_ms'], stats['p99_ms'], stats['throughput_rps'],
+                stats['avg_queries'] or 0, stats['peak_threads'], stats['errors'],
+            ))
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(self.style.SUCCESS("Results written to {}".format(options['output'])))
@@ -0,0 +1,44 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from study_tools.bulk import CONFLICT_MODES, CONFLICT_SKIP
+from study_tools.importers import CardImporter, DEFAULT_CHUNK_SIZE, IMPORT_FORMATS, detect_format, iter_rows
+from study_tools.models import StudySet
+
+
+class Command(BaseCommand):
+    help = "Streams flashcards from a CSV or JSON-lines file into a user's study sets."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV file with a header row, or a JSON-lines file")
+        parser.add_argument('--user', required=True, help="Username of the owner of the imported study sets")
+        parser.add_argument('--study-set', type=int, help="Import every row into this study set instead of using the study_set column")
+        parser.add_argument('--format', choices=IMPORT_FORMATS, help="File format, guessed from the file extension by default")
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="Rows inserted per transaction")
+        parser.add_argument('--on-conflict', choices=CONFLICT_MODES, default=CONFLICT_SKIP)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError("User '{}' does not exist.".format(options['user']))
+        study_set = None
+        if options['study_set']:
+            study_set = StudySet.objects.filter(id=options['study_set'], user=user).first()
+            if study_set is None:
+                raise CommandError("Study set {} does not belong to '{}'.".format(options['study_set'], user))
+        if options['chunk_size'] < 1:
+            raise CommandError("--chunk-size must be at least 1.")
+
+        importer = CardImporter(user, study_set, options['chunk_size'], options['on_conflict'])
+        fmt = options['format'] or detect_format(options['path'])
+        try:
+            with open(options['path'], 'rb') as stream:
+                report = importer.run(iter_rows(stream, fmt))
+        except OSError as exc:
+            raise CommandError(exc)
+
+        for error in report['errors']:
+            self.stderr.write("Row {}: {}".format(error['row'], error['errors']))
+        self.stdout.write(self.style.SUCCESS(
+            "Imported {imported}, updated {updated}, skipped {skipped}, {error_count} errors.".format(**report)
+        ))
@@ -0,0 +1,18 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from study_tools.models import Job
+
+
+class Command(BaseCommand):
+    help = "Deletes finished background jobs older than JOB_RETENTION_DAYS, and their files."
+
+    def handle(self, *args, **options):
+        finished = Job.objects.filter(finished_at__lt=timezone.now() - timedelta(days=settings.JOB_RETENTION_DAYS))
+        # Deleted one by one so the post_delete signal removes each job's file
+        deleted = 0
+        for job in finished.iterator():
+            job.delete()
+            deleted += 1
+        self.stdout.write(self.style.SUCCESS("Deleted {} jobs.".format(deleted)))
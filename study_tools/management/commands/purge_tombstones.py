@@ -0,0 +1,29 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from study_tools.models import Tombstone
+from study_tools.sync import get_retention
+
+
+class Command(BaseCommand):
+    help = "Deletes sync tombstones older than SYNC_TOMBSTONE_DAYS and those of deleted users."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help="Tombstones deleted per query")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        expired = Tombstone.objects.filter(deleted_at__lt=timezone.now() - get_retention())
+        orphaned = Tombstone.objects.exclude(user__in=User.objects.values('id'))
+
+        deleted = 0
+        for tombstones in (expired, orphaned):
+            # Deleting by id batches keeps each statement, and its locks, small
+            while True:
+                ids = list(tombstones.values_list('id', flat=True)[:options['batch_size']])
+                if not ids:
+                    break
+                deleted += Tombstone.objects.filter(id__in=ids).delete()[0]
+
+        self.stdout.write(self.style.SUCCESS("Deleted {} tombstones.".format(deleted)))
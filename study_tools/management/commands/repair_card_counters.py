@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from study_tools.jobs import JOB_REPAIR_COUNTERS, enqueue
+from study_tools.models import StudySet
+
+
+class Command(BaseCommand):
+    help = "Recomputes the card_count and last_modified of study sets from their flashcards."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Study sets checked per transaction")
+        parser.add_argument('--user', type=int, help="Only repair the study sets of this user id")
+        parser.add_argument('--background', action='store_true', help="Queue the repair for `manage.py run_jobs` instead")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        study_sets = StudySet.objects.all()
+        if options['user'] is not None:
+            study_sets = study_sets.filter(user=options['user'])
+        if options['background']:
+            job = enqueue(JOB_REPAIR_COUNTERS, params={'user': options['user'], 'batch_size': options['batch_size']})
+            self.stdout.write(self.style.SUCCESS("Queued job {}.".format(job.id)))
+            return
+
+        checked, repaired = study_sets.repair_counters_in_batches(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS("Checked {} study sets, repaired {}.".format(checked, repaired)))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand, CommandError
+from study_tools.stats import purge_review_events, rollup_review_events
+
+
+class Command(BaseCommand):
+    help = "Folds new review events into the per-card and per-set stats and purges expired events."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help="Events folded in per transaction")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        rolled_up = rollup_review_events(options['batch_size'])
+        purged = purge_review_events()
+        self.stdout.write(self.style.SUCCESS("Rolled up {} events, purged {}.".format(rolled_up, purged)))
@@ -0,0 +1,32 @@
+import threading
+from django.core.management.base import BaseCommand, CommandError
+from study_tools.jobs import work
+
+
+class Command(BaseCommand):
+    help = "Runs the background jobs queued in the database with a pool of worker threads."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2, help="Jobs run at the same time")
+        parser.add_argument('--poll', type=float, default=1.0, help="Seconds to wait for new jobs when the queue is empty")
+        parser.add_argument('--once', action='store_true', help="Exit once the queue is empty")
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError("--workers must be at least 1.")
+        stop = threading.Event()
+        # Each thread has its own database connection; a single worker runs in this thread
+        threads = [
+            threading.Thread(target=work, args=(stop, options['poll'], options['once']))
+            for _ in range(options['workers'] - 1)
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            work(stop, options['poll'], options['once'])
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping after the running jobs finish.")
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
@@ -0,0 +1,72 @@
+import random
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.authtoken.models import Token
+from study_tools import response_cache
+from study_tools.models import StudySet, FlashCard
+
+
+USERNAME_PREFIX = 'bench_user_'
+WORDS = (
+    'atom cell energy force galaxy history language matrix number orbit planet quantum '
+    'river society theory value velocity war wave acid battle climate empire equation '
+    'gene market nation poem protein reaction revolution symbol treaty vector volcano'
+).split()
+
+
+class Command(BaseCommand):
+    help = "Seeds users x study sets x flashcards with bulk inserts for benchmarking."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--sets', type=int, default=10, help="Study sets per user")
+        parser.add_argument('--cards', type=int, default=100, help="Flashcards per study set")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed, the same seed always produces the same data")
+        parser.add_argument('--batch-size', type=int, default=5000, help="Rows per INSERT")
+        parser.add_argument('--password', default='benchmark', help="Password of every seeded user")
+        parser.add_argument('--flush', action='store_true', help="Delete previously seeded users first")
+
+    def handle(self, *args, **options):
+        if min(options['users'], options['sets'], options['cards']) < 0 or options['batch_size'] < 1:
+            raise CommandError("Counts must not be negative and --batch-size must be at least 1.")
+        rng = random.Random(options['seed'])
+        batch_size = options['batch_size']
+
+        seeded = User.objects.filter(username__startswith=USERNAME_PREFIX)
+        if options['flush']:
+            seeded.delete()
+        elif seeded.exists():
+            raise CommandError("Seeded users already exist, pass --flush to replace them.")
+
+        # Hashing is deliberately slow, so every user shares one hash
+        password = make_password(options['password'])
+        usernames = ['{}{}'.format(USERNAME_PREFIX, i) for i in range(options['users'])]
+        with transaction.atomic():
+            User.objects.bulk_create([User(username=name, password=password) for name in usernames], batch_size=batch_size)
+            users = list(User.objects.filter(username__in=usernames).order_by('id'))
+            Token.objects.bulk_create([Token(key=Token.generate_key(), user=user) for user in users], batch_size=batch_size)
+
+            StudySet.objects.bulk_create([
+                StudySet(user=user, title='{} {}'.format(rng.choice(WORDS).title(), i), description=self.sentence(rng), card_count=options['cards'])
+                for user in users for i in range(options['sets'])
+            ], batch_size=batch_size)
+            study_set_ids = StudySet.objects.filter(user__in=users).order_by('id').values_list('id', flat=True)
+
+            cards = []
+            for study_set_id in study_set_ids.iterator():
+                for i in range(options['cards']):
+                    cards.append(FlashCard(study_set_id=study_set_id, term='{} {}'.format(rng.choice(WORDS), i), definition=self.sentence(rng)))
+                    if len(cards) >= batch_size:
+                        FlashCard.objects.bulk_create(cards)
+                        cards = []
+            FlashCard.objects.bulk_create(cards)
+        response_cache.invalidate(user_ids=[user.id for user in users])
+
+        self.stdout.write(self.style.SUCCESS("Seeded {} users, {} study sets and {} flashcards.".format(
+            len(users), len(users) * options['sets'], len(users) * options['sets'] * options['cards'],
+        )))
+
+    def sentence(self, rng):
+        return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 12))).capitalize()
@@ -0,0 +1,229 @@
+import gzip
+import json
+import logging
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.dispatch import Signal
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from django.utils.text import compress_sequence
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+logger = logging.getLogger('study_tools.requests')
+
+# Sent after every request with the endpoint name and its measurements
+request_measured = Signal()
+
+
+class QueryCounter:
+    """
+    Database execute wrapper counting the queries of a request and their total time.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+
+
+class EndpointStats:
+    """
+    Per-process totals of the request measurements, by endpoint.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.endpoints = defaultdict(lambda: {'requests': 0, 'queries': 0, 'db_ms': 0.0, 'total_ms': 0.0, 'max_ms': 0.0})
+
+    def record(self, endpoint, queries, db_ms, total_ms):
+        with self.lock:
+            stats = self.endpoints[endpoint]
+            stats['requests'] += 1
+            stats['queries'] += queries
+            stats['db_ms'] += db_ms
+            stats['total_ms'] += total_ms
+            stats['max_ms'] = max(stats['max_ms'], total_ms)
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                endpoint: {
+                    'requests': stats['requests'],
+                    'avg_queries': stats['queries'] / stats['requests'],
+                    'avg_db_ms': round(stats['db_ms'] / stats['requests'], 3),
+                    'avg_ms': round(stats['total_ms'] / stats['requests'], 3),
+                    'max_ms': round(stats['max_ms'], 3),
+                }
+                for endpoint, stats in sorted(self.endpoints.items())
+            }
+
+
+endpoint_stats = EndpointStats()
+
+
+class RequestMetricsMiddleware:
+    """
+    Measures the SQL query count, SQL time and total view time of each request.
+
+    The measurements are returned in a Server-Timing header, logged as a JSON line on the
+    'study_tools.requests' logger (at WARNING for requests slower than REQUEST_SLOW_MS),
+    aggregated per endpoint in endpoint_stats and sent as the request_measured signal.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        counter = QueryCounter()
+        start = time.perf_counter()
+        with self.count_queries(counter):
+            response = self.get_response(request)
+        return self.record(request, response, counter, start)
+
+    async def __acall__(self, request):
+        counter = QueryCounter()
+        start = time.perf_counter()
+        # Database connections belong to the thread that sync_to_async runs ORM calls in,
+        # which is the same thread for the whole request, so the wrappers are installed there
+        stack = await sync_to_async(self.count_queries)(counter)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        return self.record(request, response, counter, start)
+
+    def count_queries(self, counter):
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(counter))
+        return stack
+
+    def record(self, request, response, counter, start):
+        total_ms = (time.perf_counter() - start) * 1000
+        db_ms = counter.duration * 1000
+
+        match = request.resolver_match
+        endpoint = match.view_name if match else 'unresolved'
+        response['Server-Timing'] = 'db;dur={:.2f};desc="{} queries", app;dur={:.2f}'.format(db_ms, counter.count, total_ms)
+        endpoint_stats.record(endpoint, counter.count, db_ms, total_ms)
+        request_measured.send(sender=self.__class__, endpoint=endpoint, request=request, queries=counter.count, db_ms=db_ms, total_ms=total_ms)
+
+        level = logging.WARNING if total_ms > getattr(settings, 'REQUEST_SLOW_MS', 500) else logging.INFO
+        if logger.isEnabledFor(level):
+            logger.log(level, json.dumps({
+                'method': request.method,
+                'path': request.path,
+                'endpoint': endpoint,
+                'status': response.status_code,
+                'queries': counter.count,
+                'db_ms': round(db_ms, 3),
+                'total_ms': round(total_ms, 3),
+            }))
+        return response
+
+
+ACCEPTS_BROTLI = re.compile(r'\bbr\b')
+ACCEPTS_GZIP = re.compile(r'\bgzip\b')
+# Quality 11, brotli's default, is meant for static files and is far too slow per request
+BROTLI_QUALITY = 5
+
+
+def etag_matches(etag, request):
+    """
+    Weak comparison of etag with the request's If-None-Match, so the W/ ETags of
+    responses compressed by CompressionMiddleware still get 304s.
+    """
+    if etag is None:
+        return False
+    candidates = {candidate.removeprefix('W/') for candidate in parse_etags(request.headers.get('If-None-Match', ''))}
+    return etag.removeprefix('W/') in candidates
+
+
+class CompressionMiddleware:
+    """
+    Compresses responses of at least COMPRESSION_MIN_BYTES with brotli, when the client
+    accepts it and the brotli package is installed, or else with gzip. Streamed responses
+    such as exports are gzipped as they are sent.
+
+    As in Django's GZipMiddleware, strong ETags are made weak since the body no longer
+    matches them byte for byte.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.compress(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.compress(request, await self.get_response(request))
+
+    def compress(self, request, response):
+        if response.has_header('Content-Encoding') or not getattr(settings, 'COMPRESSION_ENABLED', True):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        accept_encoding = request.headers.get('Accept-Encoding', '')
+
+        if response.streaming:
+            if response.is_async or not ACCEPTS_GZIP.search(accept_encoding):
+                return response
+            response.streaming_content = compress_sequence(response.streaming_content)
+            del response['Content-Length']
+            return self.encoded(response, 'gzip')
+
+        if len(response.content) < getattr(settings, 'COMPRESSION_MIN_BYTES', 1024):
+            return response
+        if brotli is not None and ACCEPTS_BROTLI.search(accept_encoding):
+            encoding, content = 'br', brotli.compress(response.content, quality=BROTLI_QUALITY)
+        elif ACCEPTS_GZIP.search(accept_encoding):
+            encoding, content = 'gzip', gzip.compress(response.content, compresslevel=6, mtime=0)
+        else:
+            return response
+        if len(content) >= len(response.content):
+            return response
+        response.content = content
+        response['Content-Length'] = str(len(content))
+        return self.encoded(response, encoding)
+
+    def encoded(self, response, encoding):
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
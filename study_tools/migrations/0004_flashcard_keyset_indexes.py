@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("study_tools", "0003_alter_flashcard_options_and_more"),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name="flashcard",
+            options={"ordering": ["-date_of_creation", "-id"]},
+        ),
+        migrations.AddIndex(
+            model_name="flashcard",
+            index=models.Index(
+                fields=["study_set", "date_of_creation", "id"],
+                name="flashcard_set_created_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="studyset",
+            index=models.Index(
+                fields=["user", "date_of_creation", "id"],
+                name="studyset_user_created_idx",
+            ),
+        ),
+    ]
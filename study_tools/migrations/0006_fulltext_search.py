@@ -0,0 +1,75 @@
+from django.db import migrations
+from django.db.utils import OperationalError
+
+
+# (table, full-text index / FTS5 table, indexed columns)
+FULLTEXT_TABLES = [
+    ("study_tools_flashcard", "study_tools_flashcard_fts", ("term", "definition")),
+    ("study_tools_studyset", "study_tools_studyset_fts", ("title", "description")),
+]
+
+
+def create_fulltext_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for table, fts_table, columns in FULLTEXT_TABLES:
+        if vendor == "mysql":
+            schema_editor.execute(
+                "ALTER TABLE {} ADD FULLTEXT INDEX {} ({})".format(table, fts_table, ", ".join(columns))
+            )
+        elif vendor == "sqlite":
+            try:
+                create_fts5_table(schema_editor, table, fts_table, columns)
+            except OperationalError:
+                # SQLite built without FTS5; search falls back to icontains
+                return
+
+
+def create_fts5_table(schema_editor, table, fts_table, columns):
+    names = ", ".join(columns)
+    new_values = ", ".join("new.{}".format(column) for column in columns)
+    old_values = ", ".join("old.{}".format(column) for column in columns)
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE {} USING fts5({}, content='{}', content_rowid='id')".format(fts_table, names, table)
+    )
+    schema_editor.execute(
+        "CREATE TRIGGER {fts}_ai AFTER INSERT ON {table} BEGIN "
+        "INSERT INTO {fts}(rowid, {names}) VALUES (new.id, {new}); END".format(
+            fts=fts_table, table=table, names=names, new=new_values
+        )
+    )
+    schema_editor.execute(
+        "CREATE TRIGGER {fts}_ad AFTER DELETE ON {table} BEGIN "
+        "INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.id, {old}); END".format(
+            fts=fts_table, table=table, names=names, old=old_values
+        )
+    )
+    schema_editor.execute(
+        "CREATE TRIGGER {fts}_au AFTER UPDATE ON {table} BEGIN "
+        "INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.id, {old}); "
+        "INSERT INTO {fts}(rowid, {names}) VALUES (new.id, {new}); END".format(
+            fts=fts_table, table=table, names=names, old=old_values, new=new_values
+        )
+    )
+    schema_editor.execute("INSERT INTO {0}({0}) VALUES ('rebuild')".format(fts_table))
+
+
+def drop_fulltext_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for table, fts_table, columns in FULLTEXT_TABLES:
+        if vendor == "mysql":
+            schema_editor.execute("ALTER TABLE {} DROP INDEX {}".format(table, fts_table))
+        elif vendor == "sqlite":
+            for suffix in ("ai", "ad", "au"):
+                schema_editor.execute("DROP TRIGGER IF EXISTS {}_{}".format(fts_table, suffix))
+            schema_editor.execute("DROP TABLE IF EXISTS {}".format(fts_table))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("study_tools", "0005_cardreview"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fulltext_indexes, drop_fulltext_indexes),
+    ]
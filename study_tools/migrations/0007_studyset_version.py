@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("study_tools", "0006_fulltext_search"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="studyset",
+            name="version",
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:20
+
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+import django.utils.timezone
+
+
+def fill_card_counters(apps, schema_editor):
+    StudySet = apps.get_model("study_tools", "StudySet")
+    FlashCard = apps.get_model("study_tools", "FlashCard")
+    cards = (
+        FlashCard.objects.filter(study_set=OuterRef("pk"))
+        .order_by()
+        .values("study_set")
+    )
+    StudySet.objects.update(
+        card_count=Coalesce(Subquery(cards.annotate(n=Count("id")).values("n")), 0),
+        last_modified=Coalesce(
+            Subquery(cards.annotate(newest=Max("date_of_creation")).values("newest")),
+            "date_of_creation",
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("study_tools", "0007_studyset_version"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="studyset",
+            name="card_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="studyset",
+            name="last_modified",
+            field=models.DateTimeField(
+                default=django.utils.timezone.now, editable=False
+            ),
+        ),
+        migrations.RunPython(fill_card_counters, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="studyset",
+            index=models.Index(
+                fields=["user", "card_count", "id"], name="studyset_user_cards_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="studyset",
+            index=models.Index(
+                fields=["user", "last_modified", "id"],
+                name="studyset_user_modified_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,93 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:23
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+# Existing rows start out as last changed when they were last known to change,
+# rather than all at the time of the migration
+def fill_updated_at(apps, schema_editor):
+    StudySet = apps.get_model("study_tools", "StudySet")
+    FlashCard = apps.get_model("study_tools", "FlashCard")
+    StudySet.objects.update(updated_at=models.F("last_modified"))
+    FlashCard.objects.update(updated_at=models.F("date_of_creation"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("study_tools", "0008_studyset_card_counters"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Tombstone",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "model",
+                    models.CharField(
+                        choices=[("studyset", "Study set"), ("flashcard", "Flashcard")],
+                        max_length=20,
+                    ),
+                ),
+                ("object_id", models.BigIntegerField()),
+                ("deleted_at", models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="flashcard",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name="studyset",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(fill_updated_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="flashcard",
+            index=models.Index(
+                fields=["study_set", "updated_at", "id"],
+                name="flashcard_set_updated_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="studyset",
+            index=models.Index(
+                fields=["user", "updated_at", "id"], name="studyset_user_updated_idx"
+            ),
+        ),
+        migrations.AddField(
+            model_name="tombstone",
+            name="user",
+            field=models.ForeignKey(
+                db_constraint=False,
+                on_delete=django.db.models.deletion.DO_NOTHING,
+                related_name="+",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="tombstone",
+            index=models.Index(
+                fields=["user", "deleted_at", "id"], name="tombstone_user_deleted_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="tombstone",
+            index=models.Index(fields=["deleted_at"], name="tombstone_deleted_idx"),
+        ),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("study_tools", "0009_sync_tombstones"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DetachedCard",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name="studyset",
+            name="is_public",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="studyset",
+            name="source",
+            field=models.ForeignKey(
+                blank=True,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="clones",
+                to="study_tools.studyset",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="studyset",
+            index=models.Index(
+                fields=["is_public", "date_of_creation", "id"],
+                name="studyset_public_created_idx",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="studyset",
+            constraint=models.UniqueConstraint(
+                fields=("user", "source"), name="studyset_one_clone_per_source"
+            ),
+        ),
+        migrations.AddField(
+            model_name="detachedcard",
+            name="flashcard",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="+",
+                to="study_tools.flashcard",
+            ),
+        ),
+        migrations.AddField(
+            model_name="detachedcard",
+            name="study_set",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="detached_cards",
+                to="study_tools.studyset",
+            ),
+        ),
+        migrations.AlterUniqueTogether(
+            name="detachedcard",
+            unique_together={("study_set", "flashcard")},
+        ),
+    ]
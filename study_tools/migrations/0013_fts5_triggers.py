@@ -0,0 +1,26 @@
+from django.db import migrations
+
+
+FTS5_TABLES = ("study_tools_flashcard_fts", "study_tools_studyset_fts")
+
+
+# The SQLite triggers of migration 0006 are installed by study_tools.search.install_fts5
+# after every migrate from now on, since SQLite drops them whenever a table is rebuilt.
+# Those that survived are dropped so it recreates them to fire only when indexed columns change.
+def drop_fts5_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    for fts_table in FTS5_TABLES:
+        for suffix in ("ai", "ad", "au"):
+            schema_editor.execute("DROP TRIGGER IF EXISTS {}_{}".format(fts_table, suffix))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("study_tools", "0012_review_stats"),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_fts5_triggers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 21:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("study_tools", "0013_fts5_triggers"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="studyset",
+            name="pending_deletion",
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
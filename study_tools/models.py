@@ -1,6 +1,108 @@
-from django.db import models
+from django.db import connections, models, router, transaction
+from django.db.models import Case, Count, Exists, F, Max, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce, Greatest
 from django.contrib.auth.models import User
 from django.utils import timezone
+from . import response_cache
+
+
+# StudySet fields maintained by StudySetQuerySet.bump_version()
+COUNTER_FIELDS = ('card_count', 'last_modified')
+TOMBSTONE_STUDY_SET = 'studyset'
+TOMBSTONE_FLASHCARD = 'flashcard'
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_SUCCEEDED = 'succeeded'
+JOB_FAILED = 'failed'
+
+
+class StudySetQuerySet(models.QuerySet):
+
+    # StudySets not waiting for a background job to delete them
+    def live(self):
+        return self.filter(pending_deletion=False)
+
+    # Marks the StudySets' FlashCards as changed so cached representations and ETags are
+    # invalidated, and adds card_delta to their card_count in the same UPDATE. Clones of the
+    # StudySets inherit the change; when cards are being deleted, pass them as deleted_cards
+    # (before deleting them) so clones that had already detached them keep their count.
+    def bump_version(self, card_delta=0, deleted_cards=None):
+        changed = list(self.model.objects.filter(
+            Q(id__in=self.values('id')) | Q(source__in=self.values('id')),
+        ).values_list('id', 'user_id', 'source_id'))
+        changed_ids = {study_set_id for study_set_id, _, _ in changed}
+        clone_ids = [study_set_id for study_set_id, _, source_id in changed if source_id in changed_ids]
+        card_count = F('card_count') + card_delta
+        now = timezone.now()
+        updated = self.update(
+            version=F('version') + 1,
+            card_count=Greatest(card_count, 0) if card_delta < 0 else card_count,
+            last_modified=now,
+            updated_at=now,
+        )
+        if clone_ids:
+            clone_delta = Value(card_delta)
+            if deleted_cards is not None:
+                detached = DetachedCard.objects.filter(study_set=OuterRef('pk'), flashcard__in=deleted_cards)
+                clone_delta += Coalesce(Subquery(detached.values('study_set').annotate(n=Count('id')).values('n')), 0)
+            self.model.objects.filter(id__in=clone_ids).update(
+                version=F('version') + 1, card_count=Greatest(F('card_count') + clone_delta, 0), last_modified=now, updated_at=now,
+            )
+        response_cache.invalidate(
+            user_ids={user_id for _, user_id, _ in changed},
+            study_set_ids=changed_ids,
+        )
+        return updated
+
+    # Recomputes card_count and last_modified from the FlashCards and returns the ids of the
+    # StudySets whose counters had drifted. last_modified never moves back, since edits and
+    # deletions leave no trace in the FlashCards to recompute it from. The card_count of a
+    # clone includes the cards it inherits.
+    def repair_counters(self):
+        cards = FlashCard.objects.filter(study_set=OuterRef('pk')).order_by().values('study_set')
+        inherited = FlashCard.objects.filter(study_set=OuterRef('source')).filter(
+            ~Exists(DetachedCard.objects.filter(study_set=OuterRef(OuterRef('pk')), flashcard=OuterRef('pk'))),
+        ).order_by().values('study_set')
+        actual_count = (
+            Coalesce(Subquery(cards.annotate(n=Count('id')).values('n')), 0)
+            + Coalesce(Subquery(inherited.annotate(n=Count('id')).values('n')), 0)
+        )
+        newest_card = Subquery(cards.annotate(newest=Max('date_of_creation')).values('newest'))
+        drifted = [
+            (study_set_id, user_id) for study_set_id, user_id, count, actual, last_modified, newest
+            in self.annotate(actual_count=actual_count, newest_card=newest_card).values_list(
+                'id', 'user_id', 'card_count', 'actual_count', 'last_modified', 'newest_card',
+            )
+            if count != actual or (newest is not None and newest > last_modified)
+        ]
+        if drifted:
+            self.model.objects.filter(id__in=[study_set_id for study_set_id, _ in drifted]).update(
+                card_count=actual_count,
+                last_modified=Greatest('last_modified', Coalesce(newest_card, 'last_modified')),
+            )
+            response_cache.invalidate(
+                user_ids={user_id for _, user_id in drifted},
+                study_set_ids={study_set_id for study_set_id, _ in drifted},
+            )
+        return [study_set_id for study_set_id, _ in drifted]
+
+    # Runs repair_counters() over the StudySets in keyset batches of batch_size, one short
+    # transaction each, and returns how many were checked and repaired. progress(checked)
+    # is called after every batch.
+    def repair_counters_in_batches(self, batch_size, progress=None):
+        checked, repaired, last_id = 0, 0, 0
+        study_sets = self.order_by('id')
+        while True:
+            ids = list(study_sets.filter(id__gt=last_id).values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            with transaction.atomic():
+                repaired += len(self.model.objects.filter(id__in=ids).repair_counters())
+            checked += len(ids)
+            last_id = ids[-1]
+            if progress is not None:
+                progress(checked)
+        return checked, repaired
 
 
 class StudySet(models.Model):
@@ -8,20 +110,340 @@ class StudySet(models.Model):
     title = models.CharField(max_length=200)
     description = models.TextField(blank=True)
     date_of_creation = models.DateTimeField(auto_now_add=True)
+    # Incremented whenever the StudySet or any of its FlashCards changes
+    version = models.PositiveIntegerField(default=1, editable=False)
+    # Maintained by bump_version() whenever FlashCards are created, changed or deleted
+    card_count = models.PositiveIntegerField(default=0, editable=False)
+    last_modified = models.DateTimeField(default=timezone.now, editable=False)
+    # Changes with the StudySet or its counters, for /api/sync/
+    updated_at = models.DateTimeField(auto_now=True)
+    # Public StudySets can be read and cloned by every user
+    is_public = models.BooleanField(default=False)
+    # A clone inherits the FlashCards of its source, apart from those detached by editing
+    # or deleting them in the clone. Sources are never clones themselves.
+    source = models.ForeignKey('self', related_name='clones', null=True, blank=True, on_delete=models.SET_NULL, editable=False)
+    # Set once a background job is queued to delete the StudySet, which hides it until then
+    pending_deletion = models.BooleanField(default=False, editable=False)
 
+    objects = StudySetQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'date_of_creation', 'id'], name='studyset_user_created_idx'),
+            models.Index(fields=['user', 'card_count', 'id'], name='studyset_user_cards_idx'),
+            models.Index(fields=['user', 'last_modified', 'id'], name='studyset_user_modified_idx'),
+            models.Index(fields=['user', 'updated_at', 'id'], name='studyset_user_updated_idx'),
+            models.Index(fields=['is_public', 'date_of_creation', 'id'], name='studyset_public_created_idx'),
+        ]
+        constraints = [
+            # So every inherited FlashCard belongs to exactly one of the user's StudySets
+            models.UniqueConstraint(fields=['user', 'source'], name='studyset_one_clone_per_source'),
+        ]
 
     def __str__(self):
         return "{}: {}".format(self.user, self.title)
 
+    def save(self, *args, **kwargs):
+        if self.pk is None:
+            return super().save(*args, **kwargs)
+        # Incremented in the database so concurrent FlashCard changes are not lost, and the
+        # card counters are left to bump_version() for the same reason, as pending_deletion
+        # is to the deletion that sets it
+        self.version = F('version') + 1
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'version', 'updated_at'}
+        else:
+            kwargs['update_fields'] = {
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in (*COUNTER_FIELDS, 'pending_deletion')
+            }
+        super().save(*args, **kwargs)
+        # The new version, and the counters when they were not saved, are left deferred so
+        # they are read back only if used, in one query by refresh_from_db()
+        for name in ['version', *(name for name in COUNTER_FIELDS if name not in kwargs['update_fields'])]:
+            self.__dict__.pop(name, None)
+
+    def refresh_from_db(self, using=None, fields=None):
+        if fields is not None and {'version', *COUNTER_FIELDS} & set(fields):
+            fields = {*fields, *({'version', *COUNTER_FIELDS} & self.get_deferred_fields())}
+        super().refresh_from_db(using, fields)
+
+    # The FlashCards of the StudySet, including those a clone inherits. Uses the prefetched
+    # flashcards of other StudySets and, for clones, the cards sharing.prefetch_all_cards()
+    # loaded; a clone without them runs its own query.
+    def all_cards(self):
+        if self.source_id is None:
+            return self.flashcards.all()
+        if hasattr(self, '_all_cards'):
+            return self._all_cards
+        return FlashCard.objects.visible_to(self.user_id, study_set_id=self.id)
+
+
+class FlashCardQuerySet(models.QuerySet):
+
+    # FlashCards of the user's StudySets, or only of study_set_id, including those the user's
+    # clones inherit. Each is annotated with clone_id, the clone it is inherited through, or
+    # None for the user's own cards. StudySets queued for deletion are left out. The user's
+    # clones come from the response cache, so users without any get the same single-set,
+    # index-ordered queries as before sharing existed.
+    def visible_to(self, user, study_set_id=None):
+        user_id = getattr(user, 'pk', user)
+        own = Q(study_set__user=user_id, study_set__pending_deletion=False)
+        clones = response_cache.get_clones(user_id, lambda: dict(
+            StudySet.objects.live().filter(user=user_id, source__isnull=False).values_list('source', 'id'),
+        ))
+        if study_set_id is not None:
+            own &= Q(study_set=study_set_id)
+            clones = {source_id: clone_id for source_id, clone_id in clones.items() if str(clone_id) == str(study_set_id)}
+        if not clones:
+            return self.filter(own).annotate(clone_id=Value(None, output_field=models.BigIntegerField()))
+        detached = DetachedCard.objects.filter(study_set__in=clones.values()).values('flashcard')
+        return self.filter(own | Q(~Q(id__in=detached), study_set__in=clones)).annotate(
+            clone_id=Case(*[When(study_set=source_id, then=Value(clone_id)) for source_id, clone_id in clones.items()]),
+        )
+
+
 class FlashCard(models.Model):
     study_set = models.ForeignKey(StudySet, related_name='flashcards', on_delete=models.CASCADE)
     term = models.CharField(max_length=200)
     definition = models.CharField(max_length=200)
     date_of_creation = models.DateTimeField(auto_now_add=True)
+    # bulk_update() and update() skip auto_now, so they have to set it themselves
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = FlashCardQuerySet.as_manager()
 
     class Meta:
         unique_together = ('study_set', 'term')
-        ordering = ['-date_of_creation']
+        ordering = ['-date_of_creation', '-id']
+        indexes = [
+            models.Index(fields=['study_set', 'date_of_creation', 'id'], name='flashcard_set_created_idx'),
+            models.Index(fields=['study_set', 'updated_at', 'id'], name='flashcard_set_updated_idx'),
+        ]
+
+    def __str__(self):
+        return "{}: {}".format(self.study_set, self.term)
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            StudySet.objects.filter(id=self.study_set_id).bump_version(card_delta=1 if adding else 0)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            StudySet.objects.filter(id=self.study_set_id).bump_version(card_delta=-1, deleted_cards=FlashCard.objects.filter(id=self.id))
+            Tombstone.objects.record_cards(FlashCard.objects.filter(id=self.id))
+            return super().delete(*args, **kwargs)
+
+
+class CardReview(models.Model):
+    """
+    Spaced-repetition state of one FlashCard for one user.
+    """
+    user = models.ForeignKey(User, related_name='card_reviews', on_delete=models.CASCADE)
+    flashcard = models.ForeignKey(FlashCard, related_name='reviews', on_delete=models.CASCADE)
+    ease = models.FloatField(default=2.5)
+    interval = models.PositiveIntegerField(default=0)
+    repetitions = models.PositiveIntegerField(default=0)
+    due_at = models.DateTimeField(default=timezone.now)
+    last_reviewed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('user', 'flashcard')
+        indexes = [
+            models.Index(fields=['user', 'due_at'], name='cardreview_user_due_idx'),
+        ]
+
+    def __str__(self):
+        return "{}: {}".format(self.user, self.flashcard_id)
+
+
+class ReviewEvent(models.Model):
+    """
+    One answer a user gave on a FlashCard, appended by /api/review/events/ and never changed.
+    Rollups fold the events into CardStats and StudySetStats. study_set is the StudySet the
+    card was answered in, the user's clone for inherited cards.
+    """
+    # Without database constraints, so deleting cards, sets or users does not cascade over
+    # the event history; rollups skip the events of deleted rows
+    user = models.ForeignKey(User, related_name='+', on_delete=models.DO_NOTHING, db_constraint=False)
+    flashcard = models.ForeignKey(FlashCard, related_name='+', on_delete=models.DO_NOTHING, db_constraint=False)
+    study_set = models.ForeignKey(StudySet, related_name='+', on_delete=models.DO_NOTHING, db_constraint=False)
+    correct = models.BooleanField()
+    response_ms = models.PositiveIntegerField(null=True, blank=True)
+    answered_at = models.DateTimeField()
+    received_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['received_at'], name='reviewevent_received_idx'),
+        ]
+
+    def __str__(self):
+        return "{}: {} {}".format(self.user_id, self.flashcard_id, 'correct' if self.correct else 'incorrect')
+
+
+class AnswerStats(models.Model):
+    """
+    Answer counts and response times rolled up from ReviewEvents.
+    """
+    answers = models.PositiveIntegerField(default=0)
+    correct = models.PositiveIntegerField(default=0)
+    # Answers sent with a response time, which total_response_ms adds up
+    timed_answers = models.PositiveIntegerField(default=0)
+    total_response_ms = models.PositiveBigIntegerField(default=0)
+    last_answered_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        abstract = True
+
+    @property
+    def accuracy(self):
+        return self.correct / self.answers if self.answers else None
+
+    @property
+    def average_response_ms(self):
+        return self.total_response_ms / self.timed_answers if self.timed_answers else None
+
+
+class CardStats(AnswerStats):
+    user = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    flashcard = models.ForeignKey(FlashCard, related_name='stats', on_delete=models.CASCADE)
+
+    class Meta:
+        unique_together = ('user', 'flashcard')
+
+    def __str__(self):
+        return "{}: {} ({}/{})".format(self.user_id, self.flashcard_id, self.correct, self.answers)
+
+
+class StudySetStats(AnswerStats):
+    user = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    study_set = models.ForeignKey(StudySet, related_name='stats', on_delete=models.CASCADE)
+
+    class Meta:
+        unique_together = ('user', 'study_set')
+
+    def __str__(self):
+        return "{}: {} ({}/{})".format(self.user_id, self.study_set_id, self.correct, self.answers)
+
+
+class RollupState(models.Model):
+    """
+    How far a rollup has got: the last event id it folded in.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    last_event_id = models.BigIntegerField(default=0)
 
     def __str__(self):
-        return "{}: {}".format(self.study_set, self.term)
\ No newline at end of file
+        return "{}: {}".format(self.name, self.last_event_id)
+
+
+class DetachedCard(models.Model):
+    """
+    A FlashCard a clone no longer inherits from its source, because the clone's owner
+    edited it (the clone then holds its own copy) or deleted it.
+    """
+    study_set = models.ForeignKey(StudySet, related_name='detached_cards', on_delete=models.CASCADE)
+    flashcard = models.ForeignKey(FlashCard, related_name='+', on_delete=models.CASCADE)
+
+    class Meta:
+        unique_together = ('study_set', 'flashcard')
+
+    def __str__(self):
+        return "{}: -{}".format(self.study_set_id, self.flashcard_id)
+
+
+class TombstoneQuerySet(models.QuerySet):
+
+    # Records the deletion of the FlashCards, for their owners and for the owners of the clones
+    # inheriting them, with one INSERT ... SELECT however many there are. With owners=False
+    # only the clone owners get tombstones, for cards that leave their StudySet but not their owner.
+    def record_cards(self, flashcards, deleted_at=None, owners=True):
+        cards_sql, params = flashcards.order_by().values('id').query.sql_with_params()
+        connection = connections[router.db_for_write(self.model)]
+        deleted_at = connection.ops.adapt_datetimefield_value(deleted_at or timezone.now())
+        tables = {
+            'flashcard': FlashCard._meta.db_table, 'studyset': StudySet._meta.db_table,
+            'detached': DetachedCard._meta.db_table, 'cards': cards_sql,
+        }
+        selects = [
+            'SELECT k.user_id, %s, c.id, %s FROM {flashcard} c INNER JOIN {studyset} k ON k.source_id = c.study_set_id '
+            'WHERE c.id IN ({cards}) AND NOT EXISTS ('
+            'SELECT 1 FROM {detached} d WHERE d.study_set_id = k.id AND d.flashcard_id = c.id)'.format(**tables),
+        ]
+        if owners:
+            selects.insert(0, 'SELECT s.user_id, %s, c.id, %s FROM {flashcard} c INNER JOIN {studyset} s ON s.id = c.study_set_id '
+                              'WHERE c.id IN ({cards})'.format(**tables))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO {} (user_id, model, object_id, deleted_at) '.format(Tombstone._meta.db_table) + ' UNION ALL '.join(selects),
+                [TOMBSTONE_FLASHCARD, deleted_at, *params] * len(selects),
+            )
+
+
+class Tombstone(models.Model):
+    """
+    Records a deleted StudySet or FlashCard so /api/sync/ can tell clients to drop it.
+    """
+    # Without a database constraint, since tombstones are written while the user's own
+    # cascade deletion is in progress; purge_tombstones removes the orphans
+    user = models.ForeignKey(User, related_name='+', on_delete=models.DO_NOTHING, db_constraint=False)
+    model = models.CharField(max_length=20, choices=[(TOMBSTONE_STUDY_SET, 'Study set'), (TOMBSTONE_FLASHCARD, 'Flashcard')])
+    object_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    objects = TombstoneQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'deleted_at', 'id'], name='tombstone_user_deleted_idx'),
+            models.Index(fields=['deleted_at'], name='tombstone_deleted_idx'),
+        ]
+
+    def __str__(self):
+        return "{} {} deleted at {}".format(self.model, self.object_id, self.deleted_at)
+
+
+class Job(models.Model):
+    """
+    Background work queued in the database and run by `manage.py run_jobs`. Handlers in
+    study_tools.jobs do the work of each kind; file is the uploaded input or the exported
+    output of the job, in JOB_FILES_DIR.
+    """
+    user = models.ForeignKey(User, related_name='jobs', on_delete=models.CASCADE, null=True, blank=True)
+    kind = models.CharField(max_length=50)
+    params = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, default=JOB_QUEUED, choices=[
+        (JOB_QUEUED, 'Queued'), (JOB_RUNNING, 'Running'), (JOB_SUCCEEDED, 'Succeeded'), (JOB_FAILED, 'Failed'),
+    ])
+    progress = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(null=True, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    file = models.CharField(max_length=255, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    date_of_creation = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # Running jobs whose worker has not reported for JOB_LEASE_SECONDS are queued again
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-date_of_creation', '-id']
+        indexes = [
+            models.Index(fields=['status', 'id'], name='job_status_idx'),
+            models.Index(fields=['user', 'date_of_creation', 'id'], name='job_user_created_idx'),
+        ]
+
+    def __str__(self):
+        return "{} {} ({})".format(self.kind, self.id, self.status)
+
+    # Records how far the job has got and that its worker is still alive
+    def report(self, progress, total=None):
+        self.progress = progress
+        if total is not None:
+            self.total = total
+        self.heartbeat_at = timezone.now()
+        Job.objects.filter(id=self.id).update(progress=self.progress, total=self.total, heartbeat_at=self.heartbeat_at)
@@ -0,0 +1,28 @@
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class CreationCursorPagination(CursorPagination):
+    """
+    Keyset pagination over the newest-first ordering shared by StudySet and FlashCard.
+    The id tie-breaker keeps cursors stable when several rows share a creation time.
+    """
+    ordering = ('-date_of_creation', '-id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+    # Orderings picked with ?ordering= get the same id tie-breaker
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if not any(field.lstrip('-') in ('id', 'pk') for field in ordering):
+            ordering += ('-id' if ordering[0].startswith('-') else 'id',)
+        return ordering
+
+
+class SearchPagination(PageNumberPagination):
+    """
+    Page numbers for search results, which are ordered by relevance rather than creation time.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
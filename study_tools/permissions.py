@@ -1,14 +1,33 @@
-from rest_framework.permissions import BasePermission
+from rest_framework.permissions import BasePermission, SAFE_METHODS
 from .models import StudySet, FlashCard
 
 
 class IsOwner(BasePermission):
     """
     Custom permission class. Allows access only to owners of StudySet and FlashCard objects.
+    Public StudySets can also be read by everyone, and FlashCards a user's clone inherits
+    can be changed through the clone, which copies them on write.
     """
     def has_object_permission(self, request, view, obj):
         if isinstance(obj, StudySet):
-            return obj.user == request.user
+            return obj.user_id == request.user.id or (obj.is_public and request.method in SAFE_METHODS)
         elif isinstance(obj, FlashCard):
-            return obj.study_set.user == request.user
-        return False
\ No newline at end of file
+            # FlashCardViewSet annotates owner_id so the StudySet does not have to be loaded
+            owner_id = getattr(obj, 'owner_id', None)
+            if owner_id is None:
+                owner_id = obj.study_set.user_id
+            if owner_id == request.user.id:
+                return True
+            # clone_id comes from FlashCard.objects.visible_to(), which only finds the user's own clones
+            return getattr(obj, 'clone_id', None) is not None
+        return False
+
+
+class IsOwnerOrPublic(IsOwner):
+    """
+    Also allows writes to public StudySets, for actions that only read them, like clone.
+    """
+    def has_object_permission(self, request, view, obj):
+        if isinstance(obj, StudySet) and obj.is_public:
+            return True
+        return super().has_object_permission(request, view, obj)
@@ -0,0 +1,110 @@
+import random
+from django.db import DEFAULT_DB_ALIAS, connections
+from .models import FlashCard, DetachedCard
+
+
+# Points drawn per missing card in each id-range round; extra points make up for
+# points that land on the same card
+OVERSAMPLE = 2
+SAMPLE_ROUNDS = 3
+# Sets whose ids span at most this many values hold at most as many cards, and reading
+# their ids is cheaper than seeking
+SMALL_SPAN = 1000
+MAX_SEED = 2 ** 32 - 1
+
+
+def seek_ids(study_set_id, points, using=DEFAULT_DB_ALIAS):
+    """
+    Resolves each point to the id of the first card of the StudySet at or after it, in one query.
+    The SQL is written out because compiling one ORM subquery per point costs far more than running them.
+    """
+    table = FlashCard._meta.db_table
+    seek = '(SELECT id FROM {} WHERE study_set_id = %s AND id >= %s ORDER BY id LIMIT 1)'.format(table)
+    params = []
+    for point in points:
+        params += [study_set_id, point]
+    with connections[using].cursor() as cursor:
+        # The seeks keep to the set, so the outer lookup is by primary key only
+        cursor.execute('SELECT id FROM {} WHERE id IN ({})'.format(table, ', '.join([seek] * len(points))), params)
+        return {row[0] for row in cursor.fetchall()}
+
+
+def sample_card_ids(study_set, count, rng):
+    """
+    Picks up to count distinct random FlashCard ids of study_set, including those a clone
+    inherits. The inherited and the clone's own cards are sampled separately, each getting
+    a share of count in proportion to their number, capped at their number; the other side
+    makes up what a side is short of.
+    """
+    if study_set.source_id is None:
+        return sample_set_card_ids(study_set.id, count, rng)
+    own = FlashCard.objects.filter(study_set=study_set).count()
+    detached = set(DetachedCard.objects.filter(
+        study_set=study_set, flashcard__study_set=study_set.source_id,
+    ).values_list('flashcard_id', flat=True))
+    inherited = FlashCard.objects.filter(study_set=study_set.source_id).count() - len(detached)
+    if own + inherited == 0:
+        return []
+    own_share = min(own, sum(rng.random() * (own + inherited) < own for _ in range(count)))
+    inherited_share = min(inherited, count - own_share)
+    own_share = min(own, count - inherited_share)
+    ids = sample_set_card_ids(study_set.id, own_share, rng) + sample_set_card_ids(study_set.source_id, inherited_share, rng, detached)
+    rng.shuffle(ids)
+    return ids
+
+
+def sample_set_card_ids(study_set_id, count, rng, excluded=frozenset()):
+    """
+    Picks up to count distinct random FlashCard ids of one StudySet, other than the excluded
+    ones, without sorting or loading the set.
+
+    Each round draws random points between the set's lowest and highest id and resolves
+    every point to the first card at or after it with one indexed seek, all in a single
+    query. Cards that follow a gap in the ids are slightly more likely to be picked.
+    Small sets, and sets too sparse to fill the sample in SAMPLE_ROUNDS rounds, are
+    sampled from their id list instead.
+    """
+    cards = FlashCard.objects.filter(study_set=study_set_id).order_by('id')
+    # Two single-row seeks; one MIN/MAX aggregate would scan the set's index entries on SQLite
+    low = cards.values_list('id', flat=True).first()
+    high = cards.values_list('id', flat=True).last()
+    if low is None or count <= 0:
+        return []
+
+    picked = set()
+    for _ in range(SAMPLE_ROUNDS if high - low >= SMALL_SPAN else 0):
+        missing = count - len(picked)
+        points = sorted(rng.randint(low, high) for _ in range(missing * OVERSAMPLE))
+        found = sorted(seek_ids(study_set_id, points, using=cards.db) - picked - excluded)
+        rng.shuffle(found)
+        picked.update(found[:missing])
+        if len(picked) == count:
+            break
+    else:
+        remaining = sorted(set(cards.values_list('id', flat=True)) - picked - excluded)
+        picked.update(rng.sample(remaining, min(count - len(picked), len(remaining))))
+
+    ids = sorted(picked)
+    rng.shuffle(ids)
+    return ids
+
+
+def build_quiz(study_set, questions, choices, seed):
+    """
+    Builds a multiple choice quiz of up to `questions` random cards of study_set. Each
+    question offers the card's definition among up to `choices` distractor definitions
+    of other cards of the set. The same seed gives the same quiz while the set is unchanged.
+    """
+    rng = random.Random(seed)
+    # Questions and distractors come from one sample; every question can draw on the whole sample
+    ids = sample_card_ids(study_set, questions + choices, rng)
+    cards = FlashCard.objects.in_bulk(ids)
+    sample = [cards[card_id] for card_id in ids if card_id in cards]
+
+    quiz = []
+    for card in sample[:questions]:
+        distractors = sorted({other.definition for other in sample if other.definition != card.definition})
+        options = rng.sample(distractors, min(choices, len(distractors))) + [card.definition]
+        rng.shuffle(options)
+        quiz.append({'id': card.id, 'term': card.term, 'choices': options, 'answer': options.index(card.definition)})
+    return {'study_set': study_set.id, 'seed': seed, 'questions': quiz}
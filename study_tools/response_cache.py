@@ -0,0 +1,217 @@
+import hashlib
+import threading
+import uuid
+from collections import Counter
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.utils.cache import patch_vary_headers
+from rest_framework.response import Response
+from rest_framework.status import HTTP_200_OK, HTTP_304_NOT_MODIFIED
+from .middleware import etag_matches
+
+
+KEY_PREFIX = 'study_tools'
+
+
+def is_shared(cache):
+    """
+    Whether every process of the deployment sees the same entries of cache, which local
+    memory (one copy per process) and dummy caches do not.
+    """
+    return not isinstance(cache, (LocMemCache, DummyCache))
+
+
+def get_cache():
+    return caches[getattr(settings, 'RESPONSE_CACHE_ALIAS', 'default')]
+
+
+def get_timeout():
+    return getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 300)
+
+
+def user_generation(user_id):
+    return '{}:gen:user:{}'.format(KEY_PREFIX, user_id)
+
+
+def study_set_generation(study_set_id):
+    return '{}:gen:studyset:{}'.format(KEY_PREFIX, study_set_id)
+
+
+def primary_pin(user_id):
+    return '{}:primary:user:{}'.format(KEY_PREFIX, user_id)
+
+
+def get_replica_lag():
+    return getattr(settings, 'REPLICA_LAG_SECONDS', 5)
+
+
+class CacheStats:
+    """
+    Per-process hit and miss counters of the response cache, by view.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.hits = Counter()
+            self.misses = Counter()
+
+    def record(self, view, hit):
+        with self.lock:
+            (self.hits if hit else self.misses)[view] += 1
+
+    def hit_rate(self, view=None):
+        hits = self.hits[view] if view else sum(self.hits.values())
+        misses = self.misses[view] if view else sum(self.misses.values())
+        return hits / (hits + misses) if hits + misses else 0.0
+
+    def as_dict(self):
+        with self.lock:
+            views = sorted(set(self.hits) | set(self.misses))
+            return {
+                'hits': sum(self.hits.values()),
+                'misses': sum(self.misses.values()),
+                'hit_rate': self.hit_rate(),
+                'views': {
+                    view: {'hits': self.hits[view], 'misses': self.misses[view], 'hit_rate': self.hit_rate(view)}
+                    for view in views
+                },
+            }
+
+
+stats = CacheStats()
+
+
+def invalidate(user_ids=(), study_set_ids=()):
+    """
+    Gives the users and StudySets new generations, which orphans every cached response
+    built from them. Runs again after the surrounding transaction commits, so a response
+    cached by a concurrent reader before the commit cannot outlive it.
+
+    The users are also pinned to the primary database for REPLICA_LAG_SECONDS, so they
+    read their own writes and no replica lagging behind them fills the new generation.
+    """
+    keys = [user_generation(user_id) for user_id in user_ids]
+    keys += [study_set_generation(study_set_id) for study_set_id in study_set_ids]
+    if not keys:
+        return
+
+    def bump():
+        cache = get_cache()
+        cache.set_many({key: uuid.uuid4().hex for key in keys}, timeout=None)
+        if user_ids:
+            cache.set_many({primary_pin(user_id): True for user_id in user_ids}, timeout=get_replica_lag())
+
+    bump()
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(bump)
+
+
+def pinned_to_primary(user_id):
+    return get_cache().get(primary_pin(user_id), False)
+
+
+def clones_key(user_id):
+    return '{}:clones:{}'.format(KEY_PREFIX, user_id)
+
+
+def get_clones(user_id, load):
+    """
+    Returns the user's clones as {source id: clone id}, calling load() on a cache miss.
+    """
+    cache = get_cache()
+    clones = cache.get(clones_key(user_id))
+    if clones is None:
+        clones = load()
+        cache.add(clones_key(user_id), clones, timeout=None)
+    return clones
+
+
+def set_clones(user_id, clones):
+    get_cache().set(clones_key(user_id), clones, timeout=None)
+
+
+def invalidate_clones(user_ids):
+    """
+    Forgets the cached clones of the users, again after the surrounding transaction commits.
+    """
+    keys = [clones_key(user_id) for user_id in user_ids]
+    if not keys:
+        return
+
+    def forget():
+        get_cache().delete_many(keys)
+
+    forget()
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(forget)
+
+
+def get_generations(keys):
+    cache = get_cache()
+    generations = cache.get_many(keys)
+    for key in keys:
+        if key not in generations:
+            cache.add(key, uuid.uuid4().hex, timeout=None)
+            generations[key] = cache.get(key)
+    return [generations[key] for key in keys]
+
+
+async def aget_generations(keys):
+    cache = get_cache()
+    generations = await cache.aget_many(keys)
+    for key in keys:
+        if key not in generations:
+            await cache.aadd(key, uuid.uuid4().hex, timeout=None)
+            generations[key] = await cache.aget(key)
+    return [generations[key] for key in keys]
+
+
+def response_key(view_name, user_id, full_path, media_type, generations):
+    # The ETag cached with the payload depends on the negotiated media type
+    path = hashlib.md5('{} {}'.format(media_type, full_path).encode()).hexdigest()
+    return '{}:response:{}:{}:{}:{}'.format(KEY_PREFIX, view_name, user_id, path, ':'.join(generations))
+
+
+class CachedResponseMixin:
+    """
+    Caches the serialized list and retrieve payloads per user, together with their ETag.
+
+    Views implement get_cache_generations(), returning the generation keys the response
+    depends on; invalidate() moves those generations forward when the data changes.
+    A cached ETag matching If-None-Match is answered with 304 without touching the database.
+    """
+
+    def cached_response(self, view, request, *args, **kwargs):
+        generations = get_generations(self.get_cache_generations(request))
+        key = response_key(type(self).__name__, request.user.id, request.get_full_path(), request.accepted_media_type, generations)
+        name = '{}.{}'.format(type(self).__name__, self.action)
+        cached = get_cache().get(key)
+        stats.record(name, cached is not None)
+        if cached is not None:
+            data, etag = cached
+            if etag_matches(etag, request):
+                response = Response(status=HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+            else:
+                response = Response(data)
+                if etag is not None:
+                    response['ETag'] = etag
+            patch_vary_headers(response, ('Accept',))
+            return response
+
+        response = view(request, *args, **kwargs)
+        if response.status_code == HTTP_200_OK:
+            get_cache().set(key, (response.data, response.get('ETag')), get_timeout())
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
@@ -0,0 +1,54 @@
+import random
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.permissions import SAFE_METHODS
+from .response_cache import pinned_to_primary
+
+
+# The replica the reads of the current request go to, or None for the primary
+replica_alias = ContextVar('replica_alias', default=None)
+
+
+def get_replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+class ReplicaRouter:
+    """
+    Sends reads to the replica chosen for the current request by ReplicaReadMixin, and
+    everything else to the primary. Objects read from a replica are saved to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        return replica_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *get_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReplicaReadMixin:
+    """
+    Serves the view's safe requests from one randomly chosen replica, unless the user
+    changed their data within the last REPLICA_LAG_SECONDS (see response_cache.invalidate()),
+    so users always read their own writes. Authentication still reads from the primary.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        token = replica_alias.set(None)
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            replica_alias.reset(token)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        replicas = get_replicas()
+        if replicas and request.method in SAFE_METHODS and not pinned_to_primary(request.user.id):
+            replica_alias.set(random.choice(replicas))
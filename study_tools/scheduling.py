@@ -0,0 +1,78 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .models import CardReview, FlashCard
+
+
+DEFAULT_EASE = 2.5
+MIN_EASE = 1.3
+
+
+class SM2:
+    """
+    SuperMemo 2 scheduler. Answers are graded from 0 (blackout) to 5 (perfect);
+    grades below 3 restart the card's repetitions.
+    """
+    min_quality = 0
+    max_quality = 5
+
+    def schedule(self, review, quality, reviewed_at):
+        if quality < 3:
+            review.repetitions = 0
+            review.interval = 1
+        else:
+            review.repetitions += 1
+            if review.repetitions == 1:
+                review.interval = 1
+            elif review.repetitions == 2:
+                review.interval = 6
+            else:
+                review.interval = round(review.interval * review.ease)
+        review.ease = max(MIN_EASE, review.ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+        review.last_reviewed_at = reviewed_at
+        review.due_at = reviewed_at + timedelta(days=review.interval)
+        return review
+
+
+def get_scheduler():
+    """
+    Returns the scheduler named by the REVIEW_SCHEDULER setting, SM-2 by default.
+    """
+    return import_string(getattr(settings, 'REVIEW_SCHEDULER', 'study_tools.scheduling.SM2'))()
+
+
+def record_answers(user, answers, reviewed_at=None):
+    """
+    Schedules a batch of answers for the user's FlashCards in one transaction.
+    Returns the updated CardReviews and a list of per-answer errors.
+
+    Missing CardReviews are inserted first, skipping those a concurrent batch just created,
+    and all of them are then locked, so concurrent first answers to a card are applied one
+    after the other rather than failing on the unique constraint.
+    """
+    reviewed_at = reviewed_at or timezone.now()
+    scheduler = get_scheduler()
+    card_ids = {answer['flashcard'] for answer in answers}
+    owned = set(FlashCard.objects.visible_to(user).filter(id__in=card_ids).values_list('id', flat=True))
+
+    with transaction.atomic():
+        existing = set(CardReview.objects.filter(user=user, flashcard_id__in=owned).values_list('flashcard_id', flat=True))
+        CardReview.objects.bulk_create(
+            [CardReview(user=user, flashcard_id=card_id, ease=DEFAULT_EASE) for card_id in owned - existing],
+            ignore_conflicts=True,
+        )
+        reviews = {
+            review.flashcard_id: review
+            for review in CardReview.objects.select_for_update().filter(user=user, flashcard_id__in=owned)
+        }
+        errors = []
+        for index, answer in enumerate(answers):
+            card_id = answer['flashcard']
+            if card_id not in reviews:
+                errors.append({'index': index, 'errors': {'flashcard': ['Flashcard not found.']}})
+                continue
+            scheduler.schedule(reviews[card_id], answer['quality'], reviewed_at)
+        CardReview.objects.bulk_update(reviews.values(), ['ease', 'interval', 'repetitions', 'due_at', 'last_reviewed_at'])
+    return [reviews[card_id] for card_id in card_ids if card_id in reviews], errors
@@ -0,0 +1,117 @@
+import re
+from django.db import connections
+from django.db.utils import OperationalError
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from .models import StudySet, FlashCard
+
+
+# Full-text indexes keyed by model: (MySQL index or SQLite FTS5 table, indexed columns)
+FULLTEXT_INDEXES = {
+    FlashCard: ('study_tools_flashcard_fts', ('term', 'definition')),
+    StudySet: ('study_tools_studyset_fts', ('title', 'description')),
+}
+_fts5_available = {}
+
+
+def has_fts5(connection):
+    """
+    Whether the SQLite database has the FTS5 tables, which requires SQLite built with FTS5.
+    """
+    if connection.alias not in _fts5_available:
+        tables = connection.introspection.table_names()
+        _fts5_available[connection.alias] = all(table in tables for table, _ in FULLTEXT_INDEXES.values())
+    return _fts5_available[connection.alias]
+
+
+def install_fts5(using, **kwargs):
+    """
+    post_migrate receiver creating the SQLite FTS5 tables and the triggers that keep them
+    in sync. SQLite drops a table's triggers whenever a migration rebuilds it, so missing
+    triggers are recreated and the index rebuilt after every migrate. MySQL uses the
+    FULLTEXT indexes from migration 0006 instead.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+    _fts5_available.pop(using, None)
+    with connection.cursor() as cursor:
+        for model, (fts_table, columns) in FULLTEXT_INDEXES.items():
+            table = model._meta.db_table
+            names = ', '.join(columns)
+            new = ', '.join('new.{}'.format(column) for column in columns)
+            old = ', '.join('old.{}'.format(column) for column in columns)
+            try:
+                cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS {} USING fts5({}, content='{}', content_rowid='id')".format(fts_table, names, table))
+            except OperationalError:
+                # SQLite built without FTS5; search falls back to icontains
+                return
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = %s", [table])
+            if {'{}_ai'.format(fts_table), '{}_ad'.format(fts_table), '{}_au'.format(fts_table)} <= {row[0] for row in cursor.fetchall()}:
+                continue
+            cursor.execute(
+                "CREATE TRIGGER IF NOT EXISTS {0}_ai AFTER INSERT ON {1} BEGIN "
+                "INSERT INTO {0}(rowid, {2}) VALUES (new.id, {3}); END".format(fts_table, table, names, new)
+            )
+            cursor.execute(
+                "CREATE TRIGGER IF NOT EXISTS {0}_ad AFTER DELETE ON {1} BEGIN "
+                "INSERT INTO {0}({0}, rowid, {2}) VALUES ('delete', old.id, {3}); END".format(fts_table, table, names, old)
+            )
+            cursor.execute(
+                "CREATE TRIGGER IF NOT EXISTS {0}_au AFTER UPDATE OF {2} ON {1} BEGIN "
+                "INSERT INTO {0}({0}, rowid, {2}) VALUES ('delete', old.id, {3}); "
+                "INSERT INTO {0}(rowid, {2}) VALUES (new.id, {4}); END".format(fts_table, table, names, old, new)
+            )
+            cursor.execute("INSERT INTO {0}({0}) VALUES ('rebuild')".format(fts_table))
+
+
+def fts5_query(q):
+    """
+    Turns free text into an FTS5 query matching every word, so user input
+    can never be parsed as FTS5 query syntax.
+    """
+    return ' '.join('"{}"'.format(word) for word in re.findall(r'\w+', q))
+
+
+def ranked_search(queryset, q):
+    """
+    Filters queryset to rows matching q and annotates a relevance 'rank', higher is better.
+
+    Uses MySQL FULLTEXT or SQLite FTS5 indexes where available and falls back
+    to an unranked icontains scan on other databases.
+    """
+    model = queryset.model
+    table, columns = FULLTEXT_INDEXES[model]
+    connection = connections[queryset.db]
+    base_table = model._meta.db_table
+
+    if connection.vendor == 'mysql':
+        match = 'MATCH({}) AGAINST (%s IN NATURAL LANGUAGE MODE)'.format(
+            ', '.join('{}.{}'.format(base_table, column) for column in columns)
+        )
+        return queryset.annotate(rank=RawSQL(match, (q,), output_field=FloatField())).filter(rank__gt=0)
+
+    if connection.vendor == 'sqlite' and has_fts5(connection):
+        query = fts5_query(q)
+        if not query:
+            return queryset.none()
+        matches = RawSQL('SELECT rowid FROM {0} WHERE {0} MATCH %s'.format(table), (query,))
+        # FTS5's rank is bm25(), where more negative means more relevant
+        rank = RawSQL(
+            'SELECT -rank FROM {0} WHERE {0} MATCH %s AND rowid = {1}.id'.format(table, base_table),
+            (query,), output_field=FloatField(),
+        )
+        return queryset.filter(id__in=matches).annotate(rank=rank)
+
+    condition = Q()
+    for column in columns:
+        condition |= Q(**{'{}__icontains'.format(column): q})
+    return queryset.filter(condition).annotate(rank=Value(0.0, output_field=FloatField()))
+
+
+def search_flashcards(user, q):
+    return ranked_search(FlashCard.objects.visible_to(user), q).order_by('-rank', '-id')
+
+
+def search_study_sets(user, q):
+    return ranked_search(StudySet.objects.live().filter(user=user), q).order_by('-rank', '-id')
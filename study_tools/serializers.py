@@ -1,5 +1,7 @@
 from rest_framework import serializers
-from .models import StudySet, FlashCard
+from rest_framework.reverse import reverse
+from .models import StudySet, FlashCard, CardReview, CardStats, StudySetStats, Job, Tombstone, JOB_SUCCEEDED
+from .scheduling import get_scheduler
 from django.contrib.auth.models import User
 
 
@@ -8,16 +10,155 @@ class UserSerializer(serializers.ModelSerializer):
         model = User
         fields = ['id', 'username']
 
-class FlashCardSerializer(serializers.ModelSerializer):
+def requested_fields(request):
+    """
+    Returns the field names listed in ?fields= of a GET request, or None to return them all.
+    """
+    if request is None or request.method != 'GET' or not request.query_params.get('fields'):
+        return None
+    return {name.strip() for name in request.query_params['fields'].split(',')}
+
+
+class SparseFieldsMixin:
+    """
+    Drops the fields a GET request left out of ?fields=id,title. Only the top-level
+    serializer is trimmed; nested ones, which get no context at declaration, are whole.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fields = requested_fields(self.context.get('request'))
+        if fields is not None:
+            for name in set(self.fields) - fields:
+                self.fields.pop(name)
+
+
+class FlashCardSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = FlashCard
         fields = ['id', 'term', 'definition', 'date_of_creation']
 
-class StudySetSerializer(serializers.ModelSerializer):
+class StudySetSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
-    # flashcards - all the flashcards related to a specific study set.
-    flashcards = FlashCardSerializer(many=True, read_only=True)
+    # flashcards - all the flashcards related to a specific study set, including those a clone inherits.
+    flashcards = FlashCardSerializer(source='all_cards', many=True, read_only=True)
+
+    class Meta:
+        model = StudySet
+        fields = ['id', 'user', 'title', 'description', 'date_of_creation', 'is_public', 'source', 'flashcards']
+
+
+class StudySetSummarySerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    user = UserSerializer(read_only=True)
+
+    class Meta:
+        model = StudySet
+        fields = ['id', 'user', 'title', 'description', 'date_of_creation', 'is_public', 'source', 'card_count', 'last_modified']
+
+
+class CardReviewSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CardReview
+        fields = ['flashcard', 'ease', 'interval', 'repetitions', 'due_at', 'last_reviewed_at']
+
+
+class DueCardSerializer(CardReviewSerializer):
+    flashcard = FlashCardSerializer(read_only=True)
+
+
+class ReviewAnswerSerializer(serializers.Serializer):
+    flashcard = serializers.IntegerField()
+    quality = serializers.IntegerField()
+
+    def validate_quality(self, value):
+        scheduler = get_scheduler()
+        if not scheduler.min_quality <= value <= scheduler.max_quality:
+            raise serializers.ValidationError(
+                'Must be between {} and {}.'.format(scheduler.min_quality, scheduler.max_quality)
+            )
+        return value
+
+
+class ReviewEventSerializer(serializers.Serializer):
+    flashcard = serializers.IntegerField()
+    correct = serializers.BooleanField()
+    response_ms = serializers.IntegerField(min_value=0, required=False, allow_null=True)
+    # answered_at - when the user answered, if it was recorded offline; defaults to the time it is received
+    answered_at = serializers.DateTimeField(required=False, allow_null=True)
+
+
+class DuplicateMergeSerializer(serializers.Serializer):
+    keep = serializers.IntegerField()
+    remove = serializers.ListField(child=serializers.IntegerField(), min_length=1)
+    # term, definition - replace those of the kept card, e.g. with the best wording in the cluster
+    term = serializers.CharField(max_length=200, required=False)
+    definition = serializers.CharField(max_length=200, required=False)
+
+
+class StudySetStatsSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = StudySetStats
+        fields = ['study_set', 'answers', 'correct', 'accuracy', 'average_response_ms', 'last_answered_at']
+
+
+class CardStatsSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CardStats
+        fields = ['flashcard', 'answers', 'correct', 'accuracy', 'average_response_ms', 'last_answered_at']
+
+
+class CloneStudySetMixin(serializers.Serializer):
+    # Inherited cards, from FlashCard.objects.visible_to(), belong to the user's clone rather than to the source StudySet
+    study_set = serializers.SerializerMethodField()
+
+    def get_study_set(self, obj):
+        return getattr(obj, 'clone_id', None) or obj.study_set_id
+
+
+class FlashCardSearchSerializer(CloneStudySetMixin, serializers.ModelSerializer):
+    rank = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = FlashCard
+        fields = ['id', 'study_set', 'term', 'definition', 'date_of_creation', 'rank']
+
+
+class StudySetSearchSerializer(serializers.ModelSerializer):
+    rank = serializers.FloatField(read_only=True)
 
     class Meta:
         model = StudySet
-        fields = ['id', 'user', 'title', 'description', 'date_of_creation', 'flashcards']
+        fields = ['id', 'title', 'description', 'date_of_creation', 'rank']
+
+
+class SyncStudySetSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = StudySet
+        fields = ['id', 'title', 'description', 'date_of_creation', 'is_public', 'source', 'card_count', 'last_modified', 'updated_at']
+
+
+class SyncFlashCardSerializer(CloneStudySetMixin, serializers.ModelSerializer):
+    class Meta:
+        model = FlashCard
+        fields = ['id', 'study_set', 'term', 'definition', 'date_of_creation', 'updated_at']
+
+
+class TombstoneSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Tombstone
+        fields = ['model', 'object_id', 'deleted_at']
+
+
+class JobSerializer(serializers.ModelSerializer):
+    # download - where finished jobs that produced a file serve it
+    download = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Job
+        fields = ['id', 'kind', 'status', 'progress', 'total', 'result', 'error', 'download',
+                  'date_of_creation', 'started_at', 'finished_at']
+
+    def get_download(self, job):
+        if job.status != JOB_SUCCEEDED or not job.file:
+            return None
+        return reverse('jobs-download', args=[job.id], request=self.context.get('request'))
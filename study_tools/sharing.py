@@ -0,0 +1,152 @@
+from collections import defaultdict
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from . import response_cache
+from .models import StudySet, FlashCard, CardReview, DetachedCard, Tombstone, TOMBSTONE_FLASHCARD
+from .stats import move_card_stats
+
+
+def clone_study_set(study_set, user, title=None):
+    """
+    Creates the user's clone of study_set without copying its FlashCards.
+
+    The clone inherits the cards of the set's source; cloning a clone also copies the
+    cards its owner edited or added and the list of cards they detached, so the cost
+    depends on those changes rather than on the size of the set. Callers check that the
+    source does not belong to the user and that they have not cloned it already.
+    """
+    source_id = study_set.source_id or study_set.id
+    with transaction.atomic():
+        clone = StudySet.objects.create(
+            user=user,
+            title=title or study_set.title,
+            description=study_set.description,
+            source_id=source_id,
+            card_count=study_set.card_count,
+        )
+        if study_set.source_id is not None:
+            FlashCard.objects.bulk_create(
+                FlashCard(study_set=clone, term=term, definition=definition)
+                for term, definition in study_set.flashcards.values_list('term', 'definition')
+            )
+            DetachedCard.objects.bulk_create(
+                DetachedCard(study_set=clone, flashcard_id=flashcard_id)
+                for flashcard_id in study_set.detached_cards.values_list('flashcard_id', flat=True)
+            )
+    return clone
+
+
+def detach_cards(clone, flashcard_ids):
+    """
+    Stops the clone from inheriting the given FlashCards of its source, leaving tombstones
+    so /api/sync/ drops them from the clone owner's devices.
+    """
+    with transaction.atomic():
+        DetachedCard.objects.bulk_create(
+            [DetachedCard(study_set_id=clone.id, flashcard_id=flashcard_id) for flashcard_id in flashcard_ids],
+            ignore_conflicts=True,
+        )
+        Tombstone.objects.bulk_create(
+            Tombstone(user_id=clone.user_id, model=TOMBSTONE_FLASHCARD, object_id=flashcard_id) for flashcard_id in flashcard_ids
+        )
+        StudySet.objects.filter(id=clone.id).bump_version(card_delta=-len(flashcard_ids))
+
+
+def copy_on_write(clone, flashcard, changes):
+    """
+    Applies changes to an inherited FlashCard by giving the clone its own changed copy in
+    place of the source's card, which is left untouched. The clone owner's review history
+    and stats move to the copy, which is returned.
+    """
+    copy = FlashCard(study_set_id=clone.id, term=flashcard.term, definition=flashcard.definition)
+    for field, value in changes.items():
+        setattr(copy, field, value)
+    with transaction.atomic():
+        detach_cards(clone, [flashcard.id])
+        copy.save()
+        CardReview.objects.filter(user_id=clone.user_id, flashcard=flashcard).update(flashcard=copy)
+        move_card_stats(clone.user_id, {flashcard.id: copy.id})
+    return copy
+
+
+def materialize_clones(study_set, progress=None):
+    """
+    Copies the cards the clones of study_set inherit into the clones themselves, so they
+    keep them once study_set is deleted. A clone's own card shadows an inherited card with
+    the same term. Review history and stats move to the copies.
+
+    Works clone by clone in chunks of JOB_CHUNK_SIZE cards, each in its own transaction
+    unless called inside one, like the pre_delete signal of a StudySet deleted directly,
+    when they all commit with the deletion. Each chunk detaches the cards it copied, so
+    between chunks a clone shows every card once, and an interrupted run carries on where
+    it stopped. progress(cards) is called after every chunk with the cards copied so far.
+    """
+    chunk_size = getattr(settings, 'JOB_CHUNK_SIZE', 2000)
+    copied = 0
+    for clone in list(study_set.clones.all()):
+        last_id = 0
+        while True:
+            with transaction.atomic():
+                detached = DetachedCard.objects.filter(study_set=clone).values('flashcard')
+                cards = list(
+                    study_set.flashcards.filter(id__gt=last_id).exclude(id__in=detached)
+                    .order_by('id').values_list('id', 'term', 'definition')[:chunk_size]
+                )
+                if not cards:
+                    break
+                last_id = cards[-1][0]
+                materialize_cards(clone, cards)
+            copied += len(cards)
+            if progress is not None:
+                progress(copied)
+        with transaction.atomic():
+            StudySet.objects.filter(id=clone.id).update(source=None)
+            response_cache.invalidate_clones([clone.user_id])
+            StudySet.objects.filter(id=clone.id).bump_version()
+            StudySet.objects.filter(id=clone.id).repair_counters()
+
+
+def materialize_cards(clone, cards):
+    """
+    Gives the clone its own copies of the inherited cards, as (id, term, definition), and
+    detaches the originals.
+    """
+    terms = {card_id: term for card_id, term, _ in cards}
+    taken = set(clone.flashcards.filter(term__in=terms.values()).values_list('term', flat=True))
+    FlashCard.objects.bulk_create(
+        FlashCard(study_set=clone, term=term, definition=definition)
+        for _, term, definition in cards if term not in taken
+    )
+    copies = dict(clone.flashcards.filter(term__in=terms.values()).values_list('term', 'id'))
+    reviewed = set(CardReview.objects.filter(user_id=clone.user_id, flashcard__in=copies.values()).values_list('flashcard_id', flat=True))
+    reviews = []
+    # Reviews of cards shadowed by an already reviewed card of the clone go with the source
+    for review in CardReview.objects.filter(user_id=clone.user_id, flashcard__in=terms):
+        if copies[terms[review.flashcard_id]] not in reviewed:
+            review.flashcard_id = copies[terms[review.flashcard_id]]
+            reviews.append(review)
+    CardReview.objects.bulk_update(reviews, ['flashcard'])
+    move_card_stats(clone.user_id, {card_id: copies[term] for card_id, term in terms.items()})
+    DetachedCard.objects.bulk_create([DetachedCard(study_set=clone, flashcard_id=card_id) for card_id in terms], ignore_conflicts=True)
+    # The copies replace the detached cards one for one, so only the version changes
+    StudySet.objects.filter(id=clone.id).bump_version()
+
+
+def prefetch_all_cards(study_sets):
+    """
+    Loads the FlashCards of the clones among study_sets, inherited ones included, with one
+    query per clone owner rather than one per clone.
+    """
+    clones = defaultdict(list)
+    for study_set in study_sets:
+        if study_set.source_id is not None:
+            clones[study_set.user_id].append(study_set)
+    for user_id, owned in clones.items():
+        cards = defaultdict(list)
+        for card in FlashCard.objects.visible_to(user_id).filter(
+            Q(study_set__in=[clone.id for clone in owned]) | Q(study_set__in=[clone.source_id for clone in owned]),
+        ):
+            cards[card.clone_id or card.study_set_id].append(card)
+        for clone in owned:
+            clone._all_cards = cards[clone.id]
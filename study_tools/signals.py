@@ -0,0 +1,58 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+from . import response_cache
+from .authentication import invalidate_tokens
+from .jobs import job_files
+from .models import FlashCard, Job, StudySet, Tombstone, TOMBSTONE_STUDY_SET
+from .sharing import materialize_clones
+
+
+# FlashCard changes reach the cache through StudySet.objects.bump_version(), which also
+# covers bulk operations and keeps Django's fast path for cascading FlashCard deletes.
+@receiver(post_save, sender=StudySet)
+@receiver(post_delete, sender=StudySet)
+def invalidate_study_set(sender, instance, **kwargs):
+    response_cache.invalidate(user_ids=[instance.user_id], study_set_ids=[instance.id])
+    if instance.source_id is not None:
+        response_cache.invalidate_clones([instance.user_id])
+
+
+# Deleting a StudySet, directly or with its user, leaves tombstones for it and for its
+# FlashCards, whose cascade deletion sends no signals of its own. Its clones get their
+# own copies of the cards they inherited from it.
+@receiver(pre_delete, sender=StudySet)
+def record_study_set_tombstones(sender, instance, **kwargs):
+    Tombstone.objects.record_cards(FlashCard.objects.filter(study_set=instance))
+    Tombstone.objects.create(user_id=instance.user_id, model=TOMBSTONE_STUDY_SET, object_id=instance.id)
+    materialize_clones(instance)
+
+
+# Database ids can be reused, so a new user never inherits cached responses
+@receiver(post_save, sender=User)
+def invalidate_new_user(sender, instance, created, **kwargs):
+    if created:
+        response_cache.invalidate(user_ids=[instance.id])
+        response_cache.set_clones(instance.id, {})
+
+
+# Saving a user (e.g. a password change or deactivation) refreshes their cached token lookup
+@receiver(post_save, sender=User)
+def invalidate_user_tokens(sender, instance, created, update_fields=None, **kwargs):
+    # Logging in only records last_login, which does not affect authentication
+    if not created and update_fields != frozenset(['last_login']):
+        invalidate_tokens(Token.objects.filter(user=instance).values_list('key', flat=True))
+
+
+# Logging out deletes the token, which must stop authenticating immediately
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    invalidate_tokens([instance.key])
+
+
+# Deleting a Job, directly or with its user, removes the file it left behind
+@receiver(post_delete, sender=Job)
+def delete_job_file(sender, instance, **kwargs):
+    if instance.file:
+        job_files().delete(instance.file)
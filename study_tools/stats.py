@@ -0,0 +1,170 @@
+from datetime import timedelta
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Case, Count, Max, Q, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import FlashCard, StudySet, ReviewEvent, CardStats, StudySetStats, RollupState
+
+
+ROLLUP_NAME = 'review_events'
+STATS_FIELDS = ('answers', 'correct', 'timed_answers', 'total_response_ms', 'last_answered_at')
+
+
+def get_rollup_delay():
+    return timedelta(seconds=getattr(settings, 'REVIEW_ROLLUP_DELAY_SECONDS', 5))
+
+
+def get_event_retention():
+    return timedelta(days=getattr(settings, 'REVIEW_EVENT_RETENTION_DAYS', 90))
+
+
+def record_events(user, events, received_at=None):
+    """
+    Appends a batch of answers on the user's FlashCards to the event log with one INSERT.
+    Returns how many were accepted and a list of per-event errors.
+    """
+    received_at = received_at or timezone.now()
+    card_ids = {event['flashcard'] for event in events}
+    study_sets = {
+        card_id: clone_id or study_set_id
+        for card_id, study_set_id, clone_id
+        in FlashCard.objects.visible_to(user).filter(id__in=card_ids).values_list('id', 'study_set', 'clone_id')
+    }
+    rows, errors = [], []
+    for index, event in enumerate(events):
+        if event['flashcard'] not in study_sets:
+            errors.append({'index': index, 'errors': {'flashcard': ['Flashcard not found.']}})
+            continue
+        rows.append(ReviewEvent(
+            user=user,
+            flashcard_id=event['flashcard'],
+            study_set_id=study_sets[event['flashcard']],
+            correct=event['correct'],
+            response_ms=event.get('response_ms'),
+            answered_at=event.get('answered_at') or received_at,
+            received_at=received_at,
+        ))
+    ReviewEvent.objects.bulk_create(rows)
+    return len(rows), errors
+
+
+def rollup_review_events(batch_size=5000, progress=None):
+    """
+    Folds the ReviewEvents received since the last rollup into CardStats and StudySetStats,
+    batch_size events at a time, each batch in one transaction with the RollupState, so
+    every event is counted exactly once however many rollups run. Events of the last
+    REVIEW_ROLLUP_DELAY_SECONDS are left for the next rollup, so that events with lower ids
+    from transactions still open are not skipped. Returns the number of events folded in.
+    """
+    cutoff = timezone.now() - get_rollup_delay()
+    rolled_up = 0
+    while True:
+        with transaction.atomic():
+            state, _ = RollupState.objects.select_for_update().get_or_create(name=ROLLUP_NAME)
+            ids = list(ReviewEvent.objects.filter(
+                id__gt=state.last_event_id, received_at__lt=cutoff,
+            ).order_by('id').values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            events = ReviewEvent.objects.filter(id__gt=state.last_event_id, id__lte=ids[-1])
+            fold_events(CardStats, 'flashcard', FlashCard, events)
+            fold_events(StudySetStats, 'study_set', StudySet, events)
+            state.last_event_id = ids[-1]
+            state.save(update_fields=['last_event_id'])
+        rolled_up += len(ids)
+        if progress is not None:
+            progress(rolled_up)
+    return rolled_up
+
+
+def fold_events(model, field, target_model, events):
+    """
+    Adds the totals of events, per user and field, to the stats rows of model.
+    """
+    totals = {
+        (row['user'], row[field]): row
+        for row in events.order_by().values('user', field).annotate(
+            answers=Count('id'),
+            correct=Count('id', filter=Q(correct=True)),
+            timed_answers=Count('response_ms'),
+            total_response_ms=Coalesce(Sum('response_ms'), 0),
+            last_answered_at=Max('answered_at'),
+        )
+    }
+    user_ids = {user_id for user_id, _ in totals}
+    target_ids = {target_id for _, target_id in totals}
+    live_users = set(User.objects.filter(id__in=user_ids).values_list('id', flat=True))
+    live_targets = set(target_model.objects.filter(id__in=target_ids).values_list('id', flat=True))
+    stats = {
+        (stat.user_id, getattr(stat, field + '_id')): stat
+        for stat in model.objects.filter(user__in=user_ids, **{field + '__in': target_ids})
+    }
+    created, updated = [], []
+    for key, row in totals.items():
+        if key[0] not in live_users or key[1] not in live_targets:
+            continue
+        stat = stats.get(key)
+        if stat is None:
+            stat = model(user_id=key[0], **{field + '_id': key[1]})
+            created.append(stat)
+        else:
+            updated.append(stat)
+        stat.answers += row['answers']
+        stat.correct += row['correct']
+        stat.timed_answers += row['timed_answers']
+        stat.total_response_ms += row['total_response_ms']
+        stat.last_answered_at = max(filter(None, [stat.last_answered_at, row['last_answered_at']]))
+    model.objects.bulk_create(created)
+    model.objects.bulk_update(updated, STATS_FIELDS)
+
+
+def purge_review_events(batch_size=5000):
+    """
+    Deletes rolled up ReviewEvents older than REVIEW_EVENT_RETENTION_DAYS and returns how many.
+    """
+    state = RollupState.objects.filter(name=ROLLUP_NAME).first()
+    if state is None:
+        return 0
+    expired = ReviewEvent.objects.filter(id__lte=state.last_event_id, received_at__lt=timezone.now() - get_event_retention())
+    deleted = 0
+    while True:
+        ids = list(expired.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += ReviewEvent.objects.filter(id__in=ids).delete()[0]
+
+
+def move_card_stats(user_id, moves):
+    """
+    Gives the FlashCards that replace others, as in moves (old id -> new id), the user's
+    CardStats and review events of the cards they replace. Stats are added to those the
+    new card already has, so several cards can be merged into one.
+    """
+    if not moves:
+        return
+    stats = {stat.flashcard_id: stat for stat in CardStats.objects.filter(user_id=user_id, flashcard__in=[*moves, *moves.values()])}
+    changed, merged = {}, []
+    for old_id, new_id in moves.items():
+        stat = stats.pop(old_id, None)
+        if stat is None:
+            continue
+        target = stats.get(new_id)
+        if target is None:
+            stat.flashcard_id = new_id
+            stats[new_id] = changed[new_id] = stat
+            continue
+        target.answers += stat.answers
+        target.correct += stat.correct
+        target.timed_answers += stat.timed_answers
+        target.total_response_ms += stat.total_response_ms
+        target.last_answered_at = max(filter(None, [target.last_answered_at, stat.last_answered_at]), default=None)
+        changed[new_id] = target
+        merged.append(stat.id)
+    CardStats.objects.filter(id__in=merged).delete()
+    CardStats.objects.bulk_update(changed.values(), ['flashcard', *STATS_FIELDS])
+    # Events not rolled up yet are counted for the new cards
+    ReviewEvent.objects.filter(user_id=user_id, flashcard__in=list(moves)).update(flashcard_id=Case(
+        *[When(flashcard_id=old_id, then=Value(new_id)) for old_id, new_id in moves.items()],
+    ))
@@ -0,0 +1,140 @@
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.core import signing
+from django.db.models import Exists, OuterRef, Q, Subquery
+from django.utils import timezone
+from .models import StudySet, FlashCard, DetachedCard, Tombstone
+from .serializers import SyncStudySetSerializer, SyncFlashCardSerializer, TombstoneSerializer
+
+
+TOKEN_SALT = 'study_tools.sync'
+# Changes are sent in this order, each kind paged by (timestamp, id); 'cloned' comes last
+# so tokens issued before it existed still point at the same kinds
+KINDS = ('studysets', 'flashcards', 'inherited', 'deleted', 'cloned')
+# Inherited cards of clones are sent with the user's own cards
+RESPONSE_KEYS = {'inherited': 'flashcards', 'cloned': 'flashcards'}
+
+
+def get_overlap():
+    return timedelta(seconds=getattr(settings, 'SYNC_OVERLAP_SECONDS', 30))
+
+
+def get_retention():
+    return timedelta(days=getattr(settings, 'SYNC_TOMBSTONE_DAYS', 90))
+
+
+def get_sources(user, since=None):
+    """
+    The (queryset, timestamp field, serializer) of each kind of change after since, or of
+    all the user's data when since is None.
+    """
+    def changed(queryset, field):
+        return queryset if since is None else queryset.filter(**{field + '__gt': since})
+
+    clones = StudySet.objects.live().filter(user=user, source__isnull=False)
+
+    def inherited_from(clones):
+        return FlashCard.objects.filter(study_set__in=clones.values('source')).filter(
+            ~Exists(DetachedCard.objects.filter(flashcard=OuterRef('pk'), study_set__in=clones.values('id'))),
+        ).annotate(clone_id=Subquery(clones.filter(source=OuterRef('study_set')).values('id')[:1]))
+
+    # Inherited cards change with the source card, and all of them appear when the clone is
+    # created; the clones created since then send their whole list, so the changed cards
+    # can be filtered on the (study_set, updated_at, id) index
+    if since is None:
+        cloned = FlashCard.objects.none()
+    else:
+        cloned = inherited_from(clones.filter(date_of_creation__gt=since))
+    return {
+        'studysets': (changed(StudySet.objects.live().filter(user=user), 'updated_at'), 'updated_at', SyncStudySetSerializer),
+        # Filtering by the user's StudySet ids lets each one use the (study_set, updated_at, id) index
+        'flashcards': (changed(FlashCard.objects.filter(study_set__in=StudySet.objects.live().filter(user=user).values('id')), 'updated_at'), 'updated_at', SyncFlashCardSerializer),
+        'inherited': (changed(inherited_from(clones), 'updated_at'), 'updated_at', SyncFlashCardSerializer),
+        'deleted': (changed(Tombstone.objects.filter(user=user), 'deleted_at'), 'deleted_at', TombstoneSerializer),
+        'cloned': (cloned, 'updated_at', SyncFlashCardSerializer),
+    }
+
+
+class SyncState:
+    """
+    Position of a client in the change stream, carried between requests as a signed token.
+
+    since and until bound the changes of the sync in progress; until is fixed when the
+    sync starts, so rows changing while the client pages are left for the next sync.
+    kind and after locate the next page within those changes.
+    """
+
+    def __init__(self, user_id, since=None, until=None, kind=0, after=None):
+        self.user_id = user_id
+        self.since = since
+        self.until = until
+        self.kind = kind
+        self.after = after
+
+    @classmethod
+    def from_token(cls, token, user):
+        """
+        Raises signing.BadSignature for tokens that were altered or issued to another user.
+        """
+        data = signing.loads(token, salt=TOKEN_SALT)
+        if data.get('user') != user.id:
+            raise signing.BadSignature('Sync token belongs to another user.')
+        after = data.get('after')
+        return cls(
+            user.id, parse(data.get('since')), parse(data.get('until')), data.get('kind', 0),
+            (parse(after[0]), after[1]) if after else None,
+        )
+
+    def to_token(self):
+        return signing.dumps({
+            'user': self.user_id,
+            'since': self.since and self.since.isoformat(),
+            'until': self.until and self.until.isoformat(),
+            'kind': self.kind,
+            'after': self.after and [self.after[0].isoformat(), self.after[1]],
+        }, salt=TOKEN_SALT, compress=True)
+
+
+def parse(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+def collect_changes(user, state, limit):
+    """
+    Returns up to limit changes after state, and the token to continue from.
+
+    A token older than the tombstone retention restarts with a full sync and sets 'reset',
+    since deletions from before the retention can no longer be reported. The token of the
+    last page starts the next sync SYNC_OVERLAP_SECONDS before this one ended, so rows
+    written by transactions still open at that point are picked up next time; clients
+    apply changes by id, so seeing a row twice is harmless.
+    """
+    reset = False
+    if state.until is None:
+        state.until = timezone.now()
+        if state.since is not None and state.since < state.until - get_retention():
+            state.since, reset = None, True
+
+    sources = get_sources(user, state.since)
+    changes = {RESPONSE_KEYS.get(kind, kind): [] for kind in KINDS}
+    remaining = limit
+    while state.kind < len(KINDS) and remaining > 0:
+        kind = KINDS[state.kind]
+        queryset, field, serializer_class = sources[kind]
+        rows = queryset.filter(**{field + '__lte': state.until})
+        if state.after is not None:
+            timestamp, row_id = state.after
+            rows = rows.filter(Q(**{field + '__gt': timestamp}) | Q(**{field: timestamp, 'id__gt': row_id}))
+        page = list(rows.order_by(field, 'id')[:remaining + 1])
+        if len(page) > remaining:
+            page = page[:remaining]
+            state.after = (getattr(page[-1], field), page[-1].id)
+        else:
+            state.kind, state.after = state.kind + 1, None
+        changes[RESPONSE_KEYS.get(kind, kind)] += serializer_class(page, many=True).data
+        remaining -= len(page)
+
+    has_more = state.kind < len(KINDS)
+    if not has_more:
+        state = SyncState(user.id, since=state.until - get_overlap())
+    return {**changes, 'has_more': has_more, 'reset': reset, 'token': state.to_token()}
@@ -0,0 +1,19 @@
+from .middleware import request_measured
+
+
+class QueryBudgetMixin:
+    """
+    TestCase mixin failing any request whose endpoint runs more SQL queries than its
+    entry in query_budgets, e.g. {'studysets-list': 2}. Measured by RequestMetricsMiddleware.
+    """
+    query_budgets = {}
+
+    def setUp(self):
+        super().setUp()
+        request_measured.connect(self.check_query_budget)
+        self.addCleanup(request_measured.disconnect, self.check_query_budget)
+
+    def check_query_budget(self, endpoint, request, queries, **kwargs):
+        budget = self.query_budgets.get(endpoint)
+        if budget is not None and queries > budget:
+            self.fail('{} {} ran {} queries, over its budget of {}.'.format(request.method, request.get_full_path(), queries, budget))
@@ -1,9 +1,36 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import os
+import tempfile
+from asgiref.sync import sync_to_async
+from datetime import timedelta
+from unittest import mock, skipIf
+from django.test import AsyncClient, TestCase, TransactionTestCase
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+from django.core.management import call_command
+from django.utils import timezone
 from django.contrib.auth.models import User
-from .models import StudySet, FlashCard
-from django.db import IntegrityError
+from .models import StudySet, FlashCard, CardReview, CardStats, Job, Tombstone
+from . import response_cache
+from .middleware import brotli, endpoint_stats
+from .renderers import msgpack, orjson
+from .jobs import claim_job, enqueue_study_set_delete, run_job
+from .testing import QueryBudgetMixin
+from .authentication import get_token_cache, token_cache_key
+from .checks import check_replica_pin_cache
+from .throttling import KEY_TIMEOUT_PERIODS, get_throttle_cache
+from .sharing import clone_study_set, materialize_cards, materialize_clones
+from .views import DEDUPE_MAX_MERGES, REVIEW_MAX_ANSWERS, REVIEW_MAX_EVENTS
+from django.db import IntegrityError, connection, connections
+from django.db.models import F
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.authtoken.models import Token
 from rest_framework.test import APIClient, APITestCase
-from rest_framework.status import HTTP_404_NOT_FOUND, HTTP_200_OK, HTTP_201_CREATED, HTTP_400_BAD_REQUEST, HTTP_204_NO_CONTENT, HTTP_401_UNAUTHORIZED
+from rest_framework.status import HTTP_404_NOT_FOUND, HTTP_200_OK, HTTP_201_CREATED, HTTP_202_ACCEPTED, HTTP_400_BAD_REQUEST, HTTP_204_NO_CONTENT, HTTP_304_NOT_MODIFIED, HTTP_401_UNAUTHORIZED, HTTP_403_FORBIDDEN, HTTP_429_TOO_MANY_REQUESTS
 
 
 class UserAuthTest(APITestCase):
@@ -39,6 +66,63 @@ class UserAuthTest(APITestCase):
         print(response.status_code, response.content)
         self.assertEqual(response.status_code, HTTP_401_UNAUTHORIZED)
 
+TOKEN_CACHE_DIR = tempfile.mkdtemp()
+
+
+@override_settings(CACHES={
+    **settings.CACHES,
+    'tokens': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': TOKEN_CACHE_DIR},
+})
+class CachedTokenAuthTest(APITestCase):
+
+    def setUp(self):
+        caches['tokens'].clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username="testuser", password="the_Yellow_Brick_Road")
+        response = self.client.post('/auth/token/login/', {'username': 'testuser', 'password': 'the_Yellow_Brick_Road'})
+        self.token = response.data['auth_token']
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token)
+
+    def test_token_lookup_is_cached(self):
+        with CaptureQueriesContext(connection) as uncached:
+            self.assertEqual(self.client.get('/api/review/due/').status_code, HTTP_200_OK)
+        # The cached user saves the token and user query
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get('/api/review/due/').status_code, HTTP_200_OK)
+        self.assertEqual(len(queries), len(uncached) - 1)
+        self.assertFalse(any('auth' in query['sql'] for query in queries))
+        self.assertEqual(caches['tokens'].get(token_cache_key(self.token)), self.user)
+
+    def test_staff_changes_apply_at_once(self):
+        self.assertEqual(self.client.get('/api/cache/stats/').status_code, HTTP_403_FORBIDDEN)
+        self.user.is_staff = True
+        self.user.save()
+        self.assertEqual(self.client.get('/api/cache/stats/').status_code, HTTP_200_OK)
+
+    @override_settings(CACHES=settings.CACHES)
+    def test_not_cached_per_process(self):
+        self.assertIsNone(get_token_cache())
+        self.assertEqual(self.client.get('/api/review/due/').status_code, HTTP_200_OK)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get('/api/review/due/').status_code, HTTP_200_OK)
+        self.assertIn('authtoken', queries[0]['sql'])
+
+    def test_logout_invalidates_cached_token(self):
+        self.assertEqual(self.client.get('/api/studysets/').status_code, HTTP_200_OK)
+        self.assertEqual(self.client.post('/auth/token/logout/').status_code, HTTP_204_NO_CONTENT)
+        self.assertEqual(self.client.get('/api/studysets/').status_code, HTTP_401_UNAUTHORIZED)
+
+    def test_password_change_refreshes_cached_user(self):
+        self.assertEqual(self.client.get('/api/studysets/').status_code, HTTP_200_OK)
+        data = {'current_password': 'the_Yellow_Brick_Road', 'new_password': 'the_Red_Brick_Road'}
+        self.assertEqual(self.client.post('/auth/users/set_password/', data).status_code, HTTP_204_NO_CONTENT)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('the_Red_Brick_Road'))
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/studysets/').status_code, HTTP_401_UNAUTHORIZED)
+
+
 class PermissionTest(APITestCase):
 
     def setUp(self):
@@ -80,12 +164,37 @@ class StudySetViewSetTest(APITestCase):
 
     def test_get(self):
         response = self.client.get(f'/api/studysets/')
-        set_1 = response.data[0]
+        set_1 = response.data['results'][0]
         self.assertEqual(set_1['title'], 'History')
         self.assertEqual(set_1['description'], 'This is the test description')
         self.assertEqual(set_1['user']['username'], 'testuser')
         self.assertEqual(response.status_code, HTTP_200_OK)
 
+    def test_get_summary(self):
+        FlashCard.objects.create(study_set=self.study_set, term="Rome", definition="Empire")
+        FlashCard.objects.create(study_set=self.study_set, term="Greece", definition="City states")
+        response = self.client.get(f'/api/studysets/')
+        set_1 = response.data['results'][0]
+        self.assertEqual(set_1['card_count'], 2)
+        self.assertIsNotNone(set_1['last_modified'])
+        self.assertNotIn('flashcards', set_1)
+
+    def test_get_expand_flashcards(self):
+        FlashCard.objects.create(study_set=self.study_set, term="Rome", definition="Empire")
+        response = self.client.get(f'/api/studysets/', {'expand': 'flashcards'})
+        set_1 = response.data['results'][0]
+        self.assertEqual(set_1['flashcards'][0]['term'], 'Rome')
+
+    def test_list_query_count_is_constant(self):
+        for i in range(10):
+            study_set = StudySet.objects.create(user=self.user, title=f"Set {i}")
+            FlashCard.objects.create(study_set=study_set, term="Term", definition="Definition")
+        # One query for the ETag, one for the page and one more for the prefetch
+        with self.assertNumQueries(2):
+            self.client.get(f'/api/studysets/')
+        with self.assertNumQueries(3):
+            self.client.get(f'/api/studysets/', {'expand': 'flashcards'})
+
     def test_get_nonexistent(self):
         self.study_set.delete()
         response = self.client.get(f'/api/studysets/{self.study_set.id}/')
@@ -144,10 +253,10 @@ class FlashcardViewSetTest(APITestCase):
 
     def test_get(self):
         response = self.client.get(f'/api/flashcards/')
-        flashcard_1 = response.data[0]
+        flashcard_1 = response.data['results'][0]
         self.assertEqual(flashcard_1['term'], 'Test Term')
         self.assertEqual(flashcard_1['definition'], 'Test Definition')
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
         self.assertEqual(response.status_code, 200)
 
     def test_post(self):
@@ -189,6 +298,1648 @@ class FlashcardViewSetTest(APITestCase):
         self.assertFalse(flashcard_exists)
 
 
+class FlashcardBulkTest(APITestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user("testuser","test@email.com","testpassword")
+        self.client.force_authenticate(user=self.user)
+        self.study_set = StudySet.objects.create(user=self.user, title="History", description="This is the test description")
+        self.flashcard = FlashCard.objects.create(study_set=self.study_set, term="Rome", definition="Empire")
+
+    def post_bulk(self, **data):
+        return self.client.post('/api/flashcards/bulk/', {'study_set': self.study_set.id, **data}, format='json')
+
+    def test_create_update_delete(self):
+        other = FlashCard.objects.create(study_set=self.study_set, term="Sparta", definition="City state")
+        response = self.post_bulk(
+            cards=[
+                {'term': 'Athens', 'definition': 'Democracy'},
+                {'term': 'Carthage', 'definition': 'Phoenician city'},
+                {'id': self.flashcard.id, 'definition': 'Republic then empire'},
+            ],
+            delete=[other.id],
+        )
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(len(response.data['created']), 2)
+        self.assertEqual(response.data['updated'][0]['definition'], 'Republic then empire')
+        self.assertEqual(response.data['deleted'], 1)
+        self.assertEqual(response.data['errors'], [])
+        self.assertEqual(
+            sorted(self.study_set.flashcards.values_list('term', flat=True)),
+            ['Athens', 'Carthage', 'Rome'],
+        )
+
+    def test_conflicts_reported_per_item(self):
+        response = self.post_bulk(cards=[
+            {'term': 'Rome', 'definition': 'Duplicate'},
+            {'term': 'Athens', 'definition': 'Democracy'},
+            {'term': 'Athens', 'definition': 'Duplicate in batch'},
+            {'definition': 'Missing term'},
+        ])
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(len(response.data['created']), 1)
+        self.assertEqual([error['index'] for error in response.data['errors']], [3, 0, 2])
+        self.assertEqual(self.study_set.flashcards.count(), 2)
+
+    def test_conflicts_skip(self):
+        response = self.post_bulk(cards=[{'term': 'Rome', 'definition': 'Duplicate'}], on_conflict='skip')
+        self.assertEqual(response.data['skipped'], [0])
+        self.assertEqual(FlashCard.objects.get(id=self.flashcard.id).definition, 'Empire')
+
+    def test_conflicts_upsert(self):
+        response = self.post_bulk(cards=[{'term': 'Rome', 'definition': 'Eternal city'}], on_conflict='upsert')
+        self.assertEqual(response.data['updated'][0]['id'], self.flashcard.id)
+        self.assertEqual(FlashCard.objects.get(id=self.flashcard.id).definition, 'Eternal city')
+
+    def test_other_users_study_set(self):
+        other_user = User.objects.create_user("otheruser","other@email.com","testpassword")
+        self.client.force_authenticate(user=other_user)
+        response = self.post_bulk(cards=[{'term': 'Athens', 'definition': 'Democracy'}])
+        self.assertEqual(response.status_code, HTTP_404_NOT_FOUND)
+
+    def test_invalid_conflict_mode(self):
+        response = self.post_bulk(cards=[], on_conflict='replace')
+        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+
+
+class ImportTest(APITestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user("testuser","test@email.com","testpassword")
+        self.client.force_authenticate(user=self.user)
+        self.study_set = StudySet.objects.create(user=self.user, title="History", description="This is the test description")
+        FlashCard.objects.create(study_set=self.study_set, term="Rome", definition="Empire")
+
+    def test_import_csv_into_titled_sets(self):
+        upload = SimpleUploadedFile("cards.csv", b"study_set,term,definition\nHistory,Athens,Democracy\nBiology,Cell,Unit of life\nBiology,,No term\n")
+        response = self.client.post('/api/studysets/import/', {'file': upload, 'chunk_size': 1})
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(response.data['imported'], 2)
+        self.assertEqual(response.data['errors'][0]['row'], 3)
+        self.assertEqual(response.data['study_sets']['History'], self.study_set.id)
+        self.assertTrue(FlashCard.objects.filter(study_set__title="Biology", term="Cell").exists())
+
+    def test_import_jsonl_reports_conflicts(self):
+        upload = SimpleUploadedFile("cards.jsonl", b'{"term": "Rome", "definition": "Again"}\nnot json\n{"term": "Sparta", "definition": "City"}\n{"term": "Sparta", "definition": "Twice"}\n')
+        response = self.client.post('/api/studysets/import/', {'file': upload, 'study_set': self.study_set.id, 'on_conflict': 'error'})
+        self.assertEqual(response.data['imported'], 1)
+        self.assertEqual([error['row'] for error in response.data['errors']], [2, 1, 4])
+        self.assertEqual(self.study_set.flashcards.count(), 2)
+
+    def test_import_into_clone_respects_inherited_terms(self):
+        other = User.objects.create_user("other", "other@email.com", "testpassword")
+        source = StudySet.objects.create(user=other, title="Shared")
+        inherited = FlashCard.objects.create(study_set=source, term="Athens", definition="Democracy")
+        clone = clone_study_set(source, self.user)
+        CardReview.objects.create(user=self.user, flashcard=inherited)
+        upload = SimpleUploadedFile("cards.csv", b"term,definition\nAthens,City state\n")
+        response = self.client.post('/api/studysets/import/', {'file': upload, 'study_set': clone.id})
+        self.assertEqual(response.data['skipped'], 1)
+        self.assertFalse(clone.flashcards.exists())
+
+        upload = SimpleUploadedFile("cards.csv", b"term,definition\nAthens,City state\n")
+        response = self.client.post('/api/studysets/import/', {'file': upload, 'study_set': clone.id, 'on_conflict': 'upsert'})
+        self.assertEqual(response.data['updated'], 1)
+        inherited.refresh_from_db()
+        self.assertEqual(inherited.definition, "Democracy")
+        copy = clone.flashcards.get(term="Athens")
+        self.assertEqual(copy.definition, "City state")
+        self.assertEqual(CardReview.objects.get(user=self.user).flashcard_id, copy.id)
+        visible = FlashCard.objects.visible_to(self.user, study_set_id=clone.id)
+        self.assertEqual(list(visible.values_list('id', flat=True)), [copy.id])
+
+    def test_unreadable_rows_are_reported(self):
+        upload = SimpleUploadedFile("cards.jsonl", b'{"term": "Athens", "definition": "Democracy", "study_set": 5}\n')
+        response = self.client.post('/api/studysets/import/', {'file': upload})
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(response.data['errors'][0]['errors'], {'study_set': ['Must be the title of a study set.']})
+
+        upload = SimpleUploadedFile("cards.csv", "term,definition\nAthens,Démocratie\n".encode('latin-1'))
+        response = self.client.post('/api/studysets/import/', {'file': upload, 'study_set': self.study_set.id})
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(response.data['errors'][0]['errors'], {'non_field_errors': ['The file is not valid UTF-8.']})
+
+        content = 'term,definition\nAthens,Democracy\nSparta,"{}"\n'.format('x' * 200000).encode()
+        upload = SimpleUploadedFile("cards.csv", content)
+        response = self.client.post('/api/studysets/import/', {'file': upload, 'study_set': self.study_set.id})
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual((response.data['imported'], response.data['errors'][0]['row']), (1, 2))
+        self.assertTrue(response.data['errors'][0]['errors']['non_field_errors'][0].startswith('The file is not valid CSV'))
+
+    def test_import_into_other_users_set(self):
+        other_user = User.objects.create_user("otheruser","other@email.com","testpassword")
+        self.client.force_authenticate(user=other_user)
+        upload = SimpleUploadedFile("cards.csv", b"term,definition\nAthens,Democracy\n")
+        response = self.client.post('/api/studysets/import/', {'file': upload, 'study_set': self.study_set.id})
+        self.assertEqual(response.status_code, HTTP_404_NOT_FOUND)
+
+    def test_import_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write("term,definition\nAthens,Democracy\nRome,Upserted\n")
+        self.addCleanup(os.remove, f.name)
+        call_command('import_cards', f.name, user='testuser', study_set=self.study_set.id, on_conflict='upsert', stdout=io.StringIO())
+        self.assertEqual(self.study_set.flashcards.get(term="Rome").definition, "Upserted")
+        self.assertEqual(self.study_set.flashcards.count(), 2)
+
+
+class ExportTest(APITestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user("testuser","test@email.com","testpassword")
+        self.client.force_authenticate(user=self.user)
+        self.study_set = StudySet.objects.create(user=self.user, title="History", description="This is the test description")
+        FlashCard.objects.create(study_set=self.study_set, term="Rome", definition="Empire, republic")
+        FlashCard.objects.create(study_set=self.study_set, term="Athens", definition="Democracy")
+        other_set = StudySet.objects.create(user=self.user, title="Biology")
+        FlashCard.objects.create(study_set=other_set, term="Cell", definition="Unit of life")
+
+    def test_export_jsonl(self):
+        response = self.client.get(f'/api/studysets/{self.study_set.id}/export/')
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], '{"study_set": "History", "term": "Rome", "definition": "Empire, republic"}')
+        self.assertEqual(len(lines), 2)
+
+    def test_export_csv_round_trips_through_import(self):
+        response = self.client.get(f'/api/studysets/export/', {'type': 'csv'})
+        content = b''.join(response.streaming_content)
+        self.assertEqual(content.decode().splitlines()[1], 'History,Rome,"Empire, republic"')
+        StudySet.objects.all().delete()
+        upload = SimpleUploadedFile("cards.csv", content)
+        response = self.client.post('/api/studysets/import/', {'file': upload})
+        self.assertEqual(response.data['imported'], 3)
+
+    def test_export_other_users_set(self):
+        other_user = User.objects.create_user("otheruser","other@email.com","testpassword")
+        self.client.force_authenticate(user=other_user)
+        response = self.client.get(f'/api/studysets/{self.study_set.id}/export/')
+        self.assertEqual(response.status_code, HTTP_404_NOT_FOUND)
+
+
+class QuizTest(APITestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user("testuser","test@email.com","testpassword")
+        self.client.force_authenticate(user=self.user)
+        self.study_set = StudySet.objects.create(user=self.user, title="History", description="This is the test description")
+        FlashCard.objects.bulk_create(
+            FlashCard(study_set=self.study_set, term=f"Term {i}", definition=f"Definition {i}") for i in range(30)
+        )
+        self.url = f'/api/studysets/{self.study_set.id}/quiz/'
+
+    def test_questions_and_choices(self):
+        response = self.client.get(self.url, {'questions': 5, 'choices': 3, 'seed': 1})
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        questions = response.data['questions']
+        self.assertEqual(len(questions), 5)
+        self.assertEqual(len({question['id'] for question in questions}), 5)
+        for question in questions:
+            self.assertEqual(len(set(question['choices'])), 4)
+            self.assertEqual(question['choices'][question['answer']], question['term'].replace('Term', 'Definition'))
+
+    def test_reproducible_from_seed(self):
+        first = self.client.get(self.url, {'seed': 42}).data
+        self.assertEqual(self.client.get(self.url, {'seed': 42}).data, first)
+        self.assertNotEqual(self.client.get(self.url, {'seed': 43}).data['questions'], first['questions'])
+        random_seed = self.client.get(self.url).data
+        self.assertEqual(self.client.get(self.url, {'seed': random_seed['seed']}).data, random_seed)
+
+    def test_small_set(self):
+        study_set = StudySet.objects.create(user=self.user, title="Tiny")
+        FlashCard.objects.create(study_set=study_set, term="Rome", definition="Empire")
+        FlashCard.objects.create(study_set=study_set, term="Athens", definition="Democracy")
+        response = self.client.get(f'/api/studysets/{study_set.id}/quiz/', {'questions': 10, 'choices': 5})
+        self.assertEqual(sorted(question['term'] for question in response.data['questions']), ['Athens', 'Rome'])
+        self.assertTrue(all(len(question['choices']) == 2 for question in response.data['questions']))
+
+    def test_clone_fills_sample_from_both_sides(self):
+        other = User.objects.create_user("otheruser", "other@email.com", "testpassword")
+        source = StudySet.objects.create(user=other, title="Shared", is_public=True)
+        inherited = [FlashCard.objects.create(study_set=source, term=f"Shared {i}", definition=f"Shared {i}") for i in range(6)]
+        clone_id = self.client.post(f'/api/studysets/{source.id}/clone/').data['id']
+        self.client.delete(f'/api/flashcards/{inherited[0].id}/')
+        for i in range(5):
+            FlashCard.objects.create(study_set_id=clone_id, term=f"Own {i}", definition=f"Own {i}")
+        for seed in range(50):
+            questions = self.client.get(f'/api/studysets/{clone_id}/quiz/', {'questions': 10, 'choices': 0, 'seed': seed}).data['questions']
+            self.assertEqual(len({question['id'] for question in questions}), 10)
+            self.assertNotIn(inherited[0].id, [question['id'] for question in questions])
+
+    def test_sampling_seeks_by_id_range(self):
+        with mock.patch('study_tools.quiz.SMALL_SPAN', 0):
+            # StudySet, lowest and highest card id, one round of seeks, the sampled cards
+            with self.assertNumQueries(5):
+                response = self.client.get(self.url, {'questions': 10, 'choices': 3, 'seed': 5})
+        self.assertEqual(len(response.data['questions']), 10)
+
+    def test_invalid_and_foreign_sets(self):
+        self.assertEqual(self.client.get(self.url, {'questions': 1000}).status_code, HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(self.url, {'seed': 'abc'}).status_code, HTTP_400_BAD_REQUEST)
+        other = User.objects.create_user("otheruser","other@email.com","testpassword")
+        study_set = StudySet.objects.create(user=other, title="Private")
+        self.assertEqual(self.client.get(f'/api/studysets/{study_set.id}/quiz/').status_code, HTTP_404_NOT_FOUND)
+
+
+class ReviewTest(APITestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user("testuser","test@email.com","testpassword")
+        self.client.force_authenticate(user=self.user)
+        self.study_set = StudySet.objects.create(user=self.user, title="History", description="This is the test description")
+        self.rome = FlashCard.objects.create(study_set=self.study_set, term="Rome", definition="Empire")
+        self.athens = FlashCard.objects.create(study_set=self.study_set, term="Athens", definition="Democracy")
+
+    def answer(self, *answers):
+        return self.client.post('/api/review/answers/', {'answers': list(answers)}, format='json')
+
+    def test_new_cards_until_answered(self):
+        response = self.client.get('/api/review/due/', {'new': 10})
+        self.assertEqual(response.data['due'], [])
+        self.assertEqual([card['term'] for card in response.data['new']], ['Rome', 'Athens'])
+        self.answer({'flashcard': self.rome.id, 'quality': 4})
+        response = self.client.get('/api/review/due/', {'new': 10})
+        self.assertEqual([card['term'] for card in response.data['new']], ['Athens'])
+
+    def test_sm2_schedule(self):
+        for expected_interval in (1, 6, 16):
+            response = self.answer({'flashcard': self.rome.id, 'quality': 5})
+            self.assertEqual(response.status_code, HTTP_200_OK)
+            self.assertEqual(response.data['reviews'][0]['interval'], expected_interval)
+        response = self.answer({'flashcard': self.rome.id, 'quality': 1})
+        review = CardReview.objects.get(user=self.user, flashcard=self.rome)
+        self.assertEqual((review.repetitions, review.interval), (0, 1))
+        self.assertAlmostEqual(review.ease, 2.26)
+
+    def test_due_queue_ordered_by_due_date(self):
+        CardReview.objects.create(user=self.user, flashcard=self.rome, due_at=timezone.now() - timedelta(days=1))
+        CardReview.objects.create(user=self.user, flashcard=self.athens, due_at=timezone.now() - timedelta(days=2))
+        response = self.client.get('/api/review/due/', {'limit': 1})
+        self.assertEqual([review['flashcard']['term'] for review in response.data['due']], ['Athens'])
+
+    def test_answers_for_other_users_cards(self):
+        other_user = User.objects.create_user("otheruser","other@email.com","testpassword")
+        self.client.force_authenticate(user=other_user)
+        response = self.answer({'flashcard': self.rome.id, 'quality': 4})
+        self.assertEqual(response.data['errors'][0]['index'], 0)
+        self.assertFalse(CardReview.objects.exists())
+
+    def test_invalid_quality(self):
+        response = self.answer({'flashcard': self.rome.id, 'quality': 6})
+        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+
+    def test_concurrent_first_answers(self):
+        bulk_create = CardReview.objects.bulk_create
+
+        def answered_meanwhile(reviews, **kwargs):
+            # Another request creates the review after this one found none
+            CardReview.objects.create(user=self.user, flashcard=self.rome, repetitions=1, interval=1)
+            return bulk_create(reviews, **kwargs)
+
+        with mock.patch.object(CardReview.objects, 'bulk_create', side_effect=answered_meanwhile):
+            response = self.answer({'flashcard': self.rome.id, 'quality': 5})
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        review = CardReview.objects.get(user=self.user, flashcard=self.rome)
+        self.assertEqual((review.repetitions, review.interval), (2, 6))
+
+    def test_answer_batches_are_capped_before_validation(self):
+        with mock.patch('study_tools.views.ReviewAnswerSerializer') as serializer:
+            response = self.answer(*[{'flashcard': self.rome.id, 'quality': 4}] * (REVIEW_MAX_ANSWERS + 1))
+        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+        serializer.assert_not_called()
+
+
+class SearchTest(APITestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user("testuser","test@email.com","testpassword")
+        self.client.force_authenticate(user=self.user)
+        self.study_set = StudySet.objects.create(user=self.user, title="Ancient history", description="Greece and Rome")
+        self.rome = FlashCard.objects.create(study_set=self.study_set, term="Rome", definition="Empire that conquered Greece")
+        self.athens = FlashCard.objects.create(study_set=self.study_set, term="Athens", definition="Greek city state")
+        other_user = User.objects.create_user("otheruser","other@email.com","testpassword")
+        other_set = StudySet.objects.create(user=other_user, title="Rome", description="Other user's set")
+        FlashCard.objects.create(study_set=other_set, term="Rome", definition="Capital of Italy")
+
+    def test_search_flashcards(self):
+        response = self.client.get('/api/search/', {'q': 'rome'})
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual([card['id'] for card in response.data['results']], [self.rome.id])
+
+    def test_search_ranks_best_match_first(self):
+        response = self.client.get('/api/search/', {'q': 'greece'})
+        self.assertEqual(response.data['results'][0]['id'], self.rome.id)
+        response = self.client.get('/api/search/', {'q': 'city state'})
+        self.assertEqual([card['id'] for card in response.data['results']], [self.athens.id])
+
+    def test_search_follows_updates_and_deletes(self):
+        self.athens.term = "Sparta"
+        self.athens.save()
+        self.assertEqual(self.client.get('/api/search/', {'q': 'athens'}).data['count'], 0)
+        self.assertEqual(self.client.get('/api/search/', {'q': 'sparta'}).data['count'], 1)
+        self.athens.delete()
+        self.assertEqual(self.client.get('/api/search/', {'q': 'sparta'}).data['count'], 0)
+
+    def test_search_study_sets(self):
+        response = self.client.get('/api/search/', {'q': 'rome', 'type': 'studysets'})
+        self.assertEqual([study_set['id'] for study_set in response.data['results']], [self.study_set.id])
+
+    def test_search_requires_query(self):
+        response = self.client.get('/api/search/', {'q': ' '})
+        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+
+
+class ConditionalGetTest(APITestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user("testuser","test@email.com","testpassword")
+        self.client.force_authenticate(user=self.user)
+        self.study_set = StudySet.objects.create(user=self.user, title="History", description="This is the test description")
+        self.flashcard = FlashCard.objects.create(study_set=self.study_set, term="Rome", definition="Empire")
+
+    def assertNotModified(self, url, params=None):
+        etag = self.client.get(url, params)['ETag']
+        # Measure the database path rather than the response cache
+        response_cache.get_cache().clear()
+        with self.assertNumQueries(1):
+            response = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTP_304_NOT_MODIFIED)
+        return etag
+
+    def test_not_modified(self):
+        self.assertNotModified(f'/api/studysets/')
+        self.assertNotModified(f'/api/studysets/{self.study_set.id}/')
+        self.assertNotModified(f'/api/flashcards/')
+        self.assertNotModified(f'/api/flashcards/', {'study_set': self.study_set.id})
+        self.assertNotModified(f'/api/flashcards/{self.flashcard.id}/')
+
+    def test_card_changes_change_etag(self):
+        url = f'/api/studysets/{self.study_set.id}/'
+        etag = self.client.get(url)['ETag']
+        self.client.patch(f'/api/flashcards/{self.flashcard.id}/', {'definition': 'Republic'})
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, HTTP_200_OK)
+        etag = self.client.get(url)['ETag']
+        self.client.post('/api/flashcards/bulk/', {'study_set': self.study_set.id, 'cards': [{'term': 'Athens', 'definition': 'Democracy'}]}, format='json')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, HTTP_200_OK)
+        etag = self.client.get(url)['ETag']
+        self.client.patch(url, {'title': 'Ancient history'})
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, HTTP_200_OK)
+
+    def test_list_etag_changes_on_delete(self):
+        etag = self.client.get(f'/api/studysets/')['ETag']
+        StudySet.objects.create(user=self.user, title="Biology")
+        new_etag = self.client.get(f'/api/studysets/')['ETag']
+        self.assertNotEqual(etag, new_etag)
+        self.client.delete(f'/api/studysets/{self.study_set.id}/')
+        self.assertNotEqual(self.client.get(f'/api/studysets/')['ETag'], new_etag)
+
+    def test_etag_is_per_user(self):
+        etag = self.client.get(f'/api/studysets/{self.study_set.id}/')['ETag']
+        other_user = User.objects.create_user("otheruser","other@email.com","testpassword")
+        self.client.force_authenticate(user=other_user)
+        response = self.client.get(f'/api/studysets/{self.study_set.id}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTP_404_NOT_FOUND)
+
+
+class ResponseCacheTest(APITestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user("testuser","test@email.com","testpassword")
+        self.client.force_authenticate(user=self.user)
+        self.study_set = StudySet.objects.create(user=self.user, title="History", description="This is the test description")
+        self.other_set = StudySet.objects.create(user=self.user, title="Biology")
+        self.flashcard = FlashCard.objects.create(study_set=self.study_set, term="Rome", definition="Empire")
+        response_cache.stats.reset()
+
+    def test_repeated_reads_hit_cache(self):
+        urls = [f'/api/studysets/', f'/api/studysets/{self.study_set.id}/', f'/api/flashcards/', f'/api/flashcards/{self.flashcard.id}/']
+        first = [self.client.get(url).data for url in urls]
+        with self.assertNumQueries(0):
+            for _ in range(3):
+                self.assertEqual([self.client.get(url).data for url in urls], first)
+        self.assertEqual(response_cache.stats.hit_rate(), 0.75)
+        self.assertEqual(response_cache.stats.hits['StudySetViewSet.retrieve'], 3)
+
+    def test_card_change_invalidates_only_its_set(self):
+        detail = f'/api/studysets/{self.study_set.id}/'
+        other_detail = f'/api/studysets/{self.other_set.id}/'
+        self.client.get(detail)
+        self.client.get(other_detail)
+        self.client.patch(f'/api/flashcards/{self.flashcard.id}/', {'definition': 'Republic'})
+        self.assertEqual(self.client.get(detail).data['flashcards'][0]['definition'], 'Republic')
+        self.client.get(other_detail)
+        self.assertEqual(response_cache.stats.hits['StudySetViewSet.retrieve'], 1)
+
+    def test_bulk_and_delete_invalidate(self):
+        url = f'/api/flashcards/?study_set={self.study_set.id}'
+        self.client.get(url)
+        self.client.post('/api/flashcards/bulk/', {'study_set': self.study_set.id, 'cards': [{'term': 'Athens', 'definition': 'Democracy'}]}, format='json')
+        self.assertEqual(len(self.client.get(url).data['results']), 2)
+        self.client.delete(f'/api/studysets/{self.study_set.id}/')
+        self.assertEqual(self.client.get(url).data['results'], [])
+        self.assertEqual(self.client.get(f'/api/studysets/{self.study_set.id}/').status_code, HTTP_404_NOT_FOUND)
+
+    def test_cache_is_per_user(self):
+        self.client.get(f'/api/studysets/')
+        other_user = User.objects.create_user("otheruser","other@email.com","testpassword")
+        self.client.force_authenticate(user=other_user)
+        self.assertEqual(self.client.get(f'/api/studysets/').data['results'], [])
+
+    def test_cached_etag_not_modified(self):
+        etag = self.client.get(f'/api/studysets/')['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(f'/api/studysets/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTP_304_NOT_MODIFIED)
+
+    def test_stats_endpoint_requires_staff(self):
+        self.assertEqual(self.client.get('/api/cache/stats/').status_code, 403)
+        self.user.is_staff = True
+        self.user.save()
+        self.client.get(f'/api/studysets/')
+        self.client.get(f'/api/studysets/')
+        response = self.client.get('/api/cache/stats/')
+        self.assertEqual(response.data['views']['StudySetViewSet.list'], {'hits': 1, 'misses': 1, 'hit_rate': 0.5})
+
+
+class AsyncReadTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user("testuser","test@email.com","testpassword")
+        self.other = User.objects.create_user("otheruser","other@email.com","testpassword")
+        self.token = Token.objects.create(user=self.user)
+        self.study_set = StudySet.objects.create(user=self.user, title="History", description="This is the test description")
+        self.other_set = StudySet.objects.create(user=self.other, title="Private", description="Not yours")
+        FlashCard.objects.create(study_set=self.study_set, term="Rome", definition="Empire")
+        FlashCard.objects.create(study_set=self.other_set, term="Secret", definition="Hidden")
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        self.async_client = AsyncClient()
+
+    async def get(self, url, data=None, **headers):
+        headers['Authorization'] = 'Token ' + self.token.key
+        return await self.async_client.get(url, data, headers=headers)
+
+    async def test_same_payload_as_sync_views(self):
+        for sync_url, async_url in [
+            ('/api/studysets/', '/api/async/studysets/'),
+            (f'/api/studysets/{self.study_set.id}/', f'/api/async/studysets/{self.study_set.id}/'),
+            ('/api/flashcards/', '/api/async/flashcards/'),
+            (f'/api/flashcards/?study_set={self.study_set.id}', f'/api/async/flashcards/?study_set={self.study_set.id}'),
+        ]:
+            expected = await sync_to_async(self.client.get)(sync_url)
+            response = await self.get(async_url)
+            self.assertEqual(response.status_code, HTTP_200_OK)
+            self.assertEqual(response.json(), expected.json())
+
+    async def test_clones_with_empty_cache(self):
+        clone = await sync_to_async(clone_study_set)(self.other_set, self.user)
+        for url in [
+            '/api/async/flashcards/',
+            f'/api/async/flashcards/?study_set={clone.id}',
+            f'/api/async/studysets/{clone.id}/',
+            '/api/async/studysets/?expand=flashcards',
+        ]:
+            # A fresh worker, or an evicted clone map, has to load the user's clones
+            await sync_to_async(response_cache.get_cache().clear)()
+            response = await self.get(url)
+            self.assertEqual(response.status_code, HTTP_200_OK)
+            expected = await sync_to_async(self.client.get)(url.replace('/async', ''))
+            self.assertEqual(response.json(), expected.json())
+        response = await self.get(f'/api/async/studysets/{clone.id}/')
+        self.assertEqual([card['term'] for card in response.json()['flashcards']], ['Secret'])
+
+    async def test_requires_token(self):
+        response = await AsyncClient().get('/api/async/studysets/')
+        self.assertEqual(response.status_code, HTTP_401_UNAUTHORIZED)
+        response = await AsyncClient().get('/api/async/flashcards/', headers={'Authorization': 'Token invalid'})
+        self.assertEqual(response.status_code, HTTP_401_UNAUTHORIZED)
+
+    async def test_other_users_data_is_hidden(self):
+        response = await self.get(f'/api/async/studysets/{self.other_set.id}/')
+        self.assertEqual(response.status_code, HTTP_404_NOT_FOUND)
+        response = await self.get('/api/async/flashcards/', {'study_set': self.other_set.id})
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(response.json()['results'], [])
+        response = await self.get('/api/async/studysets/')
+        self.assertEqual([study_set['id'] for study_set in response.json()['results']], [self.study_set.id])
+
+    async def test_not_modified(self):
+        url = f'/api/async/studysets/{self.study_set.id}/'
+        etag = (await self.get(url))['ETag']
+        response = await self.get(url, **{'If-None-Match': etag})
+        self.assertEqual(response.status_code, HTTP_304_NOT_MODIFIED)
+        await sync_to_async(FlashCard.objects.create)(study_set=self.study_set, term="Athens", definition="Democracy")
+        response = await self.get(url, **{'If-None-Match': etag})
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(len(response.json()['flashcards']), 2)
+
+    async def test_read_only(self):
+        response = await self.async_client.post('/api/async/studysets/', {'title': 'New'}, headers={'Authorization': 'Token ' + self.token.key})
+        self.assertEqual(response.status_code, 405)
+
+
+class QueryBudgetTest(QueryBudgetMixin, APITestCase):
+    query_budgets = {
+        'studysets-list': 2,
+        'studysets-detail': 3,
+        'flashcards-list': 2,
+        'flashcards-detail': 2,
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.user = User.objects.create_user("testuser","test@email.com","testpassword")
+        self.client.force_authenticate(user=self.user)
+        self.study_set = StudySet.objects.create(user=self.user, title="History", description="This is the test description")
+        for i in range(5):
+            self.flashcard = FlashCard.objects.create(study_set=self.study_set, term=f"Term {i}", definition="Definition")
+        endpoint_stats.reset()
+
+    def test_reads_within_budget(self):
+        self.client.get(f'/api/studysets/')
+        self.client.get(f'/api/studysets/{self.study_set.id}/')
+        self.client.get(f'/api/flashcards/', {'study_set': self.study_set.id})
+        self.client.get(f'/api/flashcards/{self.flashcard.id}/')
+        self.assertEqual(endpoint_stats.as_dict()['flashcards-detail']['requests'], 1)
+
+    def test_over_budget_fails(self):
+        self.query_budgets = {'studysets-list': 0}
+        with self.assertRaises(self.failureException):
+            self.client.get(f'/api/studysets/')
+
+    def test_server_timing_header(self):
+        response = self.client.get(f'/api/studysets/')
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="2 queries", app;dur=[\d.]+$')
+
+
+class BenchmarkCommandTest(TestCase):
+
+    def test_seed_is_deterministic(self):
+        call_command('seed_data', users=2, sets=3, cards=4, seed=7, stdout=io.StringIO())
+        self.assertEqual(User.objects.filter(username__startswith='bench_user_').count(), 2)
+        self.assertEqual(StudySet.objects.count(), 6)
+        first = list(FlashCard.objects.order_by('id').values_list('term', 'definition'))
+        self.assertEqual(len(first), 24)
+        call_command('seed_data', users=2, sets=3, cards=4, seed=7, flush=True, stdout=io.StringIO())
+        self.assertEqual(list(FlashCard.objects.order_by('id').values_list('term', 'definition')), first)
+
+    def test_benchmark_writes_results(self):
+        call_command('seed_data', users=2, sets=2, cards=5, stdout=io.StringIO())
+        with tempfile.NamedTemporaryFile('r', suffix='.json') as f:
+            call_command('benchmark', requests=4, users=2, output=f.name, stdout=io.StringIO())
+            results = json.load(f)
+        self.assertEqual(results['flashcards'], 20)
+        self.assertEqual(results['endpoints']['studysets-list']['requests'], 4)
+        self.assertEqual(results['endpoints']['flashcards-delete']['requests'], 4)
+        self.assertEqual(FlashCard.objects.count(), 20)
+
+
+class ConcurrencyBenchmarkTest(TransactionTestCase):
+
+    def test_compares_deployments(self):
+        call_command('seed_data', users=2, sets=2, cards=3, stdout=io.StringIO())
+        with tempfile.NamedTemporaryFile('r', suffix='.json') as f:
+            call_command('benchmark_concurrency', requests=6, concurrency=3, client_delay=1, threads=2, users=2, output=f.name, stdout=io.StringIO())
+            results = json.load(f)
+        self.assertEqual(set(results['modes']), {'wsgi', 'asgi-sync', 'asgi-async'})
+        for stats in results['modes'].values():
+            self.assertEqual(stats['requests'], 6)
+            self.assertEqual(stats['errors'], 0)
+
+
+class CursorPaginationTest(APITestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user("testuser","test@email.com","testpassword")
+        self.client.force_authenticate(user=self.user)
+        self.study_set = StudySet.objects.create(user=self.user, title="History", description="This is the test description")
+        for i in range(5):
+            FlashCard.objects.create(study_set=self.study_set, term=f"Term {i}", definition=f"Definition {i}")
+
+    def test_pages_follow_cursor_in_creation_order(self):
+        response = self.client.get('/api/flashcards/', {'study_set': self.study_set.id, 'page_size': 2})
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertIsNone(response.data['previous'])
+        terms = [card['term'] for card in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            terms += [card['term'] for card in response.data['results']]
+        self.assertEqual(terms, [f"Term {i}" for i in reversed(range(5))])
+
+    def test_previous_cursor_returns_same_page(self):
+        first = self.client.get('/api/flashcards/', {'page_size': 2})
+        second = self.client.get(first.data['next'])
+        back = self.client.get(second.data['previous'])
+        self.assertEqual(back.data['results'], first.data['results'])
+
+
+class SyncTest(APITestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user("testuser","test@email.com","testpassword")
+        self.client.force_authenticate(user=self.user)
+        self.study_set = StudySet.objects.create(user=self.user, title="History", description="This is the test description")
+        self.rome = FlashCard.objects.create(study_set=self.study_set, term="Rome", definition="Empire")
+        self.athens = FlashCard.objects.create(study_set=self.study_set, term="Athens", definition="Democracy")
+
+    def sync(self, token=None, **params):
+        if token:
+            params['since'] = token
+        response = self.client.get('/api/sync/', params)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        return response.data
+
+    # Follows has_more to the end of a sync, collecting every page
+    def sync_all(self, token=None, **params):
+        pages = [self.sync(token, **params)]
+        while pages[-1]['has_more']:
+            pages.append(self.sync(pages[-1]['token'], **params))
+        return pages
+
+    def test_full_then_delta(self):
+        full = self.sync()
+        self.assertFalse(full['has_more'])
+        self.assertEqual([study_set['id'] for study_set in full['studysets']], [self.study_set.id])
+        self.assertEqual({card['id'] for card in full['flashcards']}, {self.rome.id, self.athens.id})
+
+        with override_settings(SYNC_OVERLAP_SECONDS=0):
+            token = self.sync()['token']
+            self.rome.definition = "Republic"
+            self.rome.save()
+            athens_id = self.athens.id
+            self.athens.delete()
+            delta = self.sync(token)
+        self.assertEqual([card['definition'] for card in delta['flashcards']], ['Republic'])
+        self.assertEqual([(tombstone['model'], tombstone['object_id']) for tombstone in delta['deleted']], [('flashcard', athens_id)])
+        self.assertEqual([study_set['card_count'] for study_set in delta['studysets']], [1])
+
+    def test_pages(self):
+        FlashCard.objects.bulk_create(FlashCard(study_set=self.study_set, term=f"Term {i}", definition="Definition") for i in range(5))
+        pages = self.sync_all(limit=2)
+        self.assertTrue(all(len(page['studysets']) + len(page['flashcards']) <= 2 for page in pages))
+        cards = [card['id'] for page in pages for card in page['flashcards']]
+        self.assertEqual(len(cards), 7)
+        self.assertEqual(len(set(cards)), 7)
+
+    def test_cascade_tombstones(self):
+        other = StudySet.objects.create(user=self.user, title="Other")
+        rome_id, athens_id = self.rome.id, self.athens.id
+        with override_settings(SYNC_OVERLAP_SECONDS=0):
+            token = self.sync()['token']
+            self.client.delete(f'/api/studysets/{self.study_set.id}/')
+            deleted = self.sync(token)['deleted']
+        self.assertEqual(
+            sorted((tombstone['model'], tombstone['object_id']) for tombstone in deleted),
+            sorted([('flashcard', rome_id), ('flashcard', athens_id), ('studyset', self.study_set.id)]),
+        )
+        self.assertTrue(StudySet.objects.filter(id=other.id).exists())
+
+    def test_bulk_changes_are_synced(self):
+        with override_settings(SYNC_OVERLAP_SECONDS=0):
+            token = self.sync()['token']
+            self.client.post('/api/flashcards/bulk/', {
+                'study_set': self.study_set.id,
+                'cards': [{'id': self.rome.id, 'definition': 'Republic'}],
+                'delete': [self.athens.id],
+            }, format='json')
+            delta = self.sync(token)
+        self.assertEqual([card['definition'] for card in delta['flashcards']], ['Republic'])
+        self.assertEqual([tombstone['object_id'] for tombstone in delta['deleted']], [self.athens.id])
+
+    def test_expired_token_resets(self):
+        token = self.sync()['token']
+        with override_settings(SYNC_TOMBSTONE_DAYS=0):
+            page = self.sync(token)
+        self.assertTrue(page['reset'])
+        self.assertEqual(len(page['flashcards']), 2)
+
+    def test_other_users_and_invalid_tokens(self):
+        other = User.objects.create_user("otheruser","other@email.com","testpassword")
+        StudySet.objects.create(user=other, title="Private")
+        token = self.sync()['token']
+        self.assertEqual(len(self.sync()['studysets']), 1)
+        self.client.force_authenticate(user=other)
+        self.assertEqual(self.client.get('/api/sync/', {'since': token}).status_code, HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get('/api/sync/', {'since': 'garbage'}).status_code, HTTP_400_BAD_REQUEST)
+
+    def test_purge_tombstones(self):
+        self.athens.delete()
+        Tombstone.objects.create(user_id=12345, model='studyset', object_id=1)
+        call_command('purge_tombstones', stdout=io.StringIO())
+        self.assertEqual(Tombstone.objects.count(), 1)
+        with override_settings(SYNC_TOMBSTONE_DAYS=0):
+            call_command('purge_tombstones', stdout=io.StringIO())
+        self.assertEqual(Tombstone.objects.count(), 0)
+
+
+class CardCounterTest(APITestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user("testuser","test@email.com","testpassword")
+        self.client.force_authenticate(user=self.user)
+        self.study_set = StudySet.objects.create(user=self.user, title="History", description="This is the test description")
+
+    def counters(self, study_set=None):
+        study_set = StudySet.objects.get(id=(study_set or self.study_set).id)
+        return study_set.card_count, study_set.last_modified
+
+    def test_card_changes_update_counters(self):
+        created = self.client.post('/api/flashcards/', {'study_set': self.study_set.id, 'term': 'Rome', 'definition': 'Empire'}).data
+        count, modified = self.counters()
+        self.assertEqual(count, 1)
+        self.client.patch(f"/api/flashcards/{created['id']}/", {'definition': 'Republic'})
+        self.assertEqual(self.counters()[0], 1)
+        self.assertGreater(self.counters()[1], modified)
+        self.client.post('/api/flashcards/bulk/', {
+            'study_set': self.study_set.id,
+            'cards': [{'term': 'Athens', 'definition': 'Democracy'}, {'term': 'Sparta', 'definition': 'Warriors'}],
+            'delete': [created['id']],
+        }, format='json')
+        self.assertEqual(self.counters()[0], 2)
+        upload = SimpleUploadedFile('cards.csv', b'term,definition\nCarthage,Rival\nAthens,Duplicate\n')
+        self.client.post('/api/studysets/import/', {'file': upload, 'study_set': self.study_set.id}, format='multipart')
+        self.assertEqual(self.counters()[0], 3)
+        FlashCard.objects.filter(study_set=self.study_set).first().delete()
+        self.assertEqual(self.counters()[0], 2)
+
+    def test_stale_instances_do_not_lose_updates(self):
+        stale = StudySet.objects.get(id=self.study_set.id)
+        for i in range(3):
+            FlashCard.objects.create(study_set=stale, term=f"Term {i}", definition="Definition")
+        stale.title = "Renamed"
+        stale.save()
+        self.assertEqual(self.counters()[0], 3)
+
+    def test_save_reads_back_version_and_counters_only_when_used(self):
+        study_set = StudySet.objects.get(id=self.study_set.id)
+        version = study_set.version
+        FlashCard.objects.create(study_set=self.study_set, term="Term", definition="Definition")
+        study_set.title = "Renamed"
+        with self.assertNumQueries(1):
+            study_set.save()
+        with self.assertNumQueries(1):
+            self.assertEqual((study_set.version, study_set.card_count), (version + 2, 1))
+
+    def test_list_reads_stored_counters_without_joins(self):
+        small = StudySet.objects.create(user=self.user, title="Small")
+        FlashCard.objects.create(study_set=small, term="Rome", definition="Empire")
+        FlashCard.objects.create(study_set=self.study_set, term="Athens", definition="Democracy")
+        FlashCard.objects.create(study_set=self.study_set, term="Sparta", definition="Warriors")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/studysets/', {'ordering': '-card_count'})
+        self.assertNotIn('study_tools_flashcard', ' '.join(query['sql'] for query in queries))
+        self.assertEqual([study_set['card_count'] for study_set in response.data['results']], [2, 1])
+        response = self.client.get('/api/studysets/', {'ordering': '-last_modified'})
+        self.assertEqual(response.data['results'][0]['id'], self.study_set.id)
+
+    def test_repair_command(self):
+        FlashCard.objects.create(study_set=self.study_set, term="Rome", definition="Empire")
+        count, modified = self.counters()
+        StudySet.objects.filter(id=self.study_set.id).update(card_count=7)
+        untouched = StudySet.objects.create(user=self.user, title="Empty")
+        out = io.StringIO()
+        call_command('repair_card_counters', batch_size=1, stdout=out)
+        self.assertIn('Checked 2 study sets, repaired 1.', out.getvalue())
+        self.assertEqual(self.counters(), (1, modified))
+        self.assertEqual(self.counters(untouched)[0], 0)
+
+
+class SharingTest(APITestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create_user("owner","owner@email.com","testpassword")
+        self.user = User.objects.create_user("testuser","test@email.com","testpassword")
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.source = StudySet.objects.create(user=self.owner, title="Capitals", is_public=True)
+        FlashCard.objects.bulk_create(FlashCard(study_set=self.source, term=f"Country {i}", definition=f"Capital {i}") for i in range(20))
+        StudySet.objects.filter(id=self.source.id).update(card_count=20)
+        self.rome = FlashCard.objects.create(study_set=self.source, term="Italy", definition="Rome")
+
+    def clone(self, study_set=None, **data):
+        response = self.client.post(f'/api/studysets/{(study_set or self.source).id}/clone/', data)
+        self.assertEqual(response.status_code, HTTP_201_CREATED)
+        return StudySet.objects.get(id=response.data['id'])
+
+    def cards(self, study_set):
+        response = self.client.get('/api/flashcards/', {'study_set': study_set.id, 'page_size': 100})
+        return {card['term']: card for card in response.data['results']}
+
+    def test_expanded_list_loads_clone_cards_together(self):
+        def count_queries():
+            self.client.get('/api/flashcards/')
+            with CaptureQueriesContext(connection) as queries:
+                results = self.client.get('/api/studysets/', {'expand': 'flashcards'}).data['results']
+            self.assertTrue(all(study_set['flashcards'] for study_set in results))
+            return len(queries)
+        self.clone()
+        one = count_queries()
+        for i in range(3):
+            source = StudySet.objects.create(user=self.owner, title=f"Shared {i}", is_public=True)
+            FlashCard.objects.create(study_set=source, term="Term", definition="Definition")
+            self.clone(source)
+        self.assertEqual(count_queries(), one)
+
+    def test_copy_on_write_keeps_terms_unique(self):
+        clone = self.clone()
+        own = FlashCard.objects.create(study_set=clone, term="Own", definition="Card")
+        response = self.client.patch(f'/api/flashcards/{self.rome.id}/', {'term': "Own"})
+        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+        self.assertIn('term', response.data)
+        response = self.client.patch(f'/api/flashcards/{own.id}/', {'term': "Italy"})
+        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+        response = self.client.post('/api/flashcards/', {'study_set': clone.id, 'term': "Italy", 'definition': "Naples"})
+        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+        response = self.client.post('/api/flashcards/bulk/', {'study_set': clone.id, 'cards': [
+            {'id': self.rome.id, 'term': "Own"}, {'term': "Country 1", 'definition': "Other"},
+        ]}, format='json')
+        self.assertEqual([error['index'] for error in response.data['errors']], [0, 1])
+        self.assertEqual(self.cards(clone)['Italy']['id'], self.rome.id)
+
+    def test_public_sets_are_read_only(self):
+        private = StudySet.objects.create(user=self.owner, title="Private")
+        self.assertEqual(self.client.get(f'/api/studysets/{self.source.id}/').status_code, HTTP_200_OK)
+        self.assertEqual(self.client.get(f'/api/studysets/{private.id}/').status_code, HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.patch(f'/api/studysets/{self.source.id}/', {'title': 'Mine'}).status_code, HTTP_403_FORBIDDEN)
+        self.assertEqual(self.client.delete(f'/api/studysets/{self.source.id}/').status_code, HTTP_403_FORBIDDEN)
+        self.assertEqual(self.client.patch(f'/api/flashcards/{self.rome.id}/', {'definition': 'Milan'}).status_code, HTTP_404_NOT_FOUND)
+        self.assertEqual([study_set['id'] for study_set in self.client.get('/api/studysets/public/').data['results']], [self.source.id])
+        self.assertEqual(self.client.get('/api/studysets/').data['results'], [])
+
+    def test_clone_references_source_cards(self):
+        with CaptureQueriesContext(connection) as queries:
+            clone = self.clone(title="My capitals")
+        self.assertFalse(any('study_tools_flashcard' in query['sql'] for query in queries))
+        self.assertEqual(FlashCard.objects.count(), 21)
+        self.assertEqual((clone.title, clone.source_id, clone.card_count), ("My capitals", self.source.id, 21))
+        self.assertEqual(len(self.client.get(f'/api/studysets/{clone.id}/').data['flashcards']), 21)
+        self.assertEqual(self.cards(clone)['Italy']['id'], self.rome.id)
+
+        response = self.client.post(f'/api/studysets/{self.source.id}/clone/')
+        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['id'], clone.id)
+        own = StudySet.objects.create(user=self.user, title="Own")
+        self.assertEqual(self.client.post(f'/api/studysets/{own.id}/clone/').status_code, HTTP_400_BAD_REQUEST)
+
+    def test_edits_copy_on_write(self):
+        clone = self.clone()
+        response = self.client.patch(f'/api/flashcards/{self.rome.id}/', {'definition': 'Roma'})
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertNotEqual(response.data['id'], self.rome.id)
+        self.assertEqual(FlashCard.objects.get(id=self.rome.id).definition, "Rome")
+        self.assertEqual(FlashCard.objects.count(), 22)
+        self.assertEqual(self.cards(clone)['Italy'], response.data)
+
+        self.assertEqual(self.client.delete(f"/api/flashcards/{self.cards(clone)['Country 0']['id']}/").status_code, HTTP_204_NO_CONTENT)
+        self.assertNotIn('Country 0', self.cards(clone))
+        self.assertTrue(FlashCard.objects.filter(study_set=self.source, term="Country 0").exists())
+        self.assertEqual(StudySet.objects.get(id=clone.id).card_count, 20)
+        self.assertEqual(StudySet.objects.get(id=self.source.id).card_count, 21)
+
+        # Another user's clone is not affected by this one's changes
+        other = User.objects.create_user("other","other@email.com","testpassword")
+        self.client.force_authenticate(user=other)
+        self.assertEqual(self.cards(self.clone())['Italy']['definition'], "Rome")
+
+    def test_clones_follow_source_changes(self):
+        clone = self.clone()
+        etag = self.client.get(f'/api/studysets/{clone.id}/')['ETag']
+        detached = self.cards(clone)['Country 1']['id']
+        self.client.delete(f'/api/flashcards/{detached}/')
+
+        self.rome.definition = "Roma"
+        self.rome.save()
+        FlashCard.objects.get(id=detached).delete()
+        FlashCard.objects.filter(term="Country 2").get().delete()
+        response = self.client.get(f'/api/studysets/{clone.id}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(len(response.data['flashcards']), 19)
+        self.assertEqual(self.cards(clone)['Italy']['definition'], "Roma")
+        self.assertEqual(StudySet.objects.get(id=clone.id).card_count, 19)
+        self.assertEqual(StudySet.objects.filter(id=clone.id).repair_counters(), [])
+
+    def test_clone_of_clone_keeps_changes(self):
+        clone = self.clone()
+        self.client.patch(f'/api/flashcards/{self.rome.id}/', {'definition': 'Roma'})
+        self.client.post('/api/flashcards/', {'study_set': clone.id, 'term': 'Spain', 'definition': 'Madrid'})
+        StudySet.objects.filter(id=clone.id).update(is_public=True)
+
+        other = User.objects.create_user("other","other@email.com","testpassword")
+        self.client.force_authenticate(user=other)
+        second = self.clone(clone)
+        self.assertEqual(second.source_id, self.source.id)
+        cards = self.cards(second)
+        self.assertEqual((len(cards), cards['Italy']['definition']), (22, "Roma"))
+        self.assertEqual(StudySet.objects.get(id=second.id).card_count, 22)
+
+    def test_deleting_source_keeps_clones(self):
+        clone = self.clone()
+        self.client.patch(f'/api/flashcards/{self.rome.id}/', {'definition': 'Roma'})
+        inherited = self.cards(clone)['Country 3']['id']
+        self.client.post('/api/review/answers/', {'answers': [{'flashcard': inherited, 'quality': 5}]}, format='json')
+
+        self.source.delete()
+        clone = StudySet.objects.get(id=clone.id)
+        cards = self.cards(clone)
+        self.assertEqual((clone.source_id, clone.card_count, len(cards)), (None, 21, 21))
+        self.assertEqual(cards['Italy']['definition'], "Roma")
+        self.assertEqual(CardReview.objects.get(user=self.user).flashcard_id, cards['Country 3']['id'])
+        self.assertTrue(Tombstone.objects.filter(user=self.user, object_id=inherited).exists())
+
+    def test_sets_being_deleted_cannot_be_cloned(self):
+        clone = self.clone()
+        StudySet.objects.filter(id=clone.id).update(is_public=True)
+        enqueue_study_set_delete(self.source)
+        self.client.force_authenticate(user=User.objects.create_user("thirduser", "third@email.com", "testpassword"))
+        self.assertEqual(self.client.post(f'/api/studysets/{self.source.id}/clone/').status_code, HTTP_404_NOT_FOUND)
+        response = self.client.post(f'/api/studysets/{clone.id}/clone/')
+        self.assertEqual((response.status_code, response.data['detail']), (HTTP_400_BAD_REQUEST, 'This study set is being deleted.'))
+
+    @override_settings(JOB_CHUNK_SIZE=5)
+    def test_interrupted_materialize_resumes(self):
+        clone = self.clone()
+        inherited = self.cards(clone)['Country 3']['id']
+        self.client.post('/api/review/answers/', {'answers': [{'flashcard': inherited, 'quality': 5}]}, format='json')
+        chunks = []
+
+        def materialize_once(*args):
+            if chunks:
+                raise RuntimeError('Worker stopped')
+            chunks.append(materialize_cards(*args))
+
+        with mock.patch('study_tools.sharing.materialize_cards', side_effect=materialize_once):
+            with self.assertRaises(RuntimeError):
+                materialize_clones(self.source)
+        # The first chunk was committed, with each card shown once
+        response = self.client.get('/api/flashcards/', {'study_set': clone.id, 'page_size': 100})
+        terms = [card['term'] for card in response.data['results']]
+        self.assertEqual((len(terms), len(set(terms))), (21, 21))
+        self.assertEqual(FlashCard.objects.filter(study_set=clone).count(), 5)
+
+        materialize_clones(self.source)
+        clone = StudySet.objects.get(id=clone.id)
+        self.assertEqual((clone.source_id, clone.card_count, FlashCard.objects.filter(study_set=clone).count()), (None, 21, 21))
+        self.assertEqual(CardReview.objects.get(user=self.user).flashcard.study_set_id, clone.id)
+
+    def test_delta_sync_sends_cards_of_new_clones(self):
+        FlashCard.objects.filter(study_set=self.source).update(updated_at=timezone.now() - timedelta(days=1))
+        token = self.client.get('/api/sync/').data['token']
+        clone = self.clone()
+        cards, params = [], {'since': token, 'limit': 5}
+        while True:
+            synced = self.client.get('/api/sync/', params).data
+            cards += synced['flashcards']
+            if not synced['has_more']:
+                break
+            params['since'] = synced['token']
+        self.assertEqual(len(cards), 21)
+        self.assertEqual({card['study_set'] for card in cards}, {clone.id})
+
+    def test_bulk_and_sync_through_clone(self):
+        clone = self.clone()
+        cards = self.cards(clone)
+        response = self.client.post('/api/flashcards/bulk/', {
+            'study_set': clone.id,
+            'cards': [{'id': cards['Italy']['id'], 'definition': 'Roma'}, {'term': 'Spain', 'definition': 'Madrid'}],
+            'delete': [cards['Country 4']['id']],
+        }, format='json')
+        self.assertEqual((len(response.data['created']), len(response.data['updated']), response.data['errors']), (1, 1, []))
+        self.assertEqual(StudySet.objects.get(id=clone.id).card_count, 21)
+        self.assertEqual(FlashCard.objects.get(id=self.rome.id).definition, "Rome")
+
+        synced = self.client.get('/api/sync/').data
+        self.assertEqual({card['study_set'] for card in synced['flashcards']}, {clone.id})
+        self.assertEqual({card['term']: card['definition'] for card in synced['flashcards']}, {
+            **{f"Country {i}": f"Capital {i}" for i in range(20) if i != 4}, 'Italy': 'Roma', 'Spain': 'Madrid',
+        })
+
+        quiz = self.client.get(f'/api/studysets/{clone.id}/quiz/', {'questions': 30, 'seed': 1}).data
+        self.assertEqual({question['term'] for question in quiz['questions']}, set(self.cards(clone)))
+
+
+class ContentFormatTest(APITestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user("testuser","test@email.com","testpassword")
+        self.client.force_authenticate(user=self.user)
+        self.study_set = StudySet.objects.create(user=self.user, title="Languages", description="Grüße, 日本語")
+        FlashCard.objects.bulk_create(FlashCard(study_set=self.study_set, term=f"Term {i}", definition="Definition " * 5) for i in range(50))
+
+    def test_fast_json_matches_standard_encoder(self):
+        response = self.client.get(f'/api/studysets/{self.study_set.id}/', HTTP_ACCEPT='application/json')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(response.content), json.loads(json.dumps(response.data)))
+        if orjson is not None:
+            self.assertEqual(response.content, orjson.dumps(response.data))
+
+    @skipIf(msgpack is None, 'msgpack is not installed')
+    def test_msgpack_round_trips_same_data(self):
+        url = f'/api/studysets/{self.study_set.id}/'
+        as_json = self.client.get(url, HTTP_ACCEPT='application/json')
+        as_msgpack = self.client.get(url, HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(as_msgpack['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(as_msgpack.content), json.loads(as_json.content))
+        self.assertLess(len(as_msgpack.content), len(as_json.content))
+
+    @skipIf(msgpack is None, 'msgpack is not installed')
+    def test_etags_depend_on_media_type(self):
+        url = f'/api/studysets/{self.study_set.id}/'
+        for _ in range(2):
+            # The second round is answered from the response cache
+            as_json = self.client.get(url, HTTP_ACCEPT='application/json')
+            as_msgpack = self.client.get(url, HTTP_ACCEPT='application/msgpack', HTTP_IF_NONE_MATCH=as_json['ETag'])
+            self.assertEqual(as_msgpack.status_code, HTTP_200_OK)
+            self.assertEqual(as_msgpack['Content-Type'], 'application/msgpack')
+            self.assertNotEqual(as_msgpack['ETag'], as_json['ETag'])
+            self.assertIn('Accept', as_json['Vary'])
+            not_modified = self.client.get(url, HTTP_ACCEPT='application/msgpack', HTTP_IF_NONE_MATCH=as_msgpack['ETag'])
+            self.assertEqual(not_modified.status_code, HTTP_304_NOT_MODIFIED)
+            self.assertIn('Accept', not_modified['Vary'])
+
+    @skipIf(msgpack is None, 'msgpack is not installed')
+    def test_msgpack_request_body(self):
+        body = msgpack.packb({'study_set': self.study_set.id, 'term': 'Straße', 'definition': 'Street'})
+        response = self.client.post('/api/flashcards/', body, content_type='application/msgpack', HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response.status_code, HTTP_201_CREATED)
+        self.assertEqual(msgpack.unpackb(response.content)['term'], 'Straße')
+
+        response = self.client.post('/api/flashcards/', b'\xc1', content_type='application/msgpack')
+        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+
+    def test_gzip(self):
+        url = f'/api/studysets/{self.study_set.id}/'
+        plain = self.client.get(url)
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertEqual(response['ETag'], 'W/' + plain['ETag'])
+
+        # The weakened ETag still gets a 304
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, HTTP_304_NOT_MODIFIED)
+
+    @skipIf(brotli is None, 'brotli is not installed')
+    def test_brotli_preferred(self):
+        url = f'/api/studysets/{self.study_set.id}/'
+        plain = self.client.get(url)
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(response.content), plain.content)
+
+    def test_small_responses_not_compressed(self):
+        study_set = StudySet.objects.create(user=self.user, title="Empty")
+        response = self.client.get(f'/api/studysets/{study_set.id}/', HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+        with override_settings(COMPRESSION_ENABLED=False):
+            response = self.client.get(f'/api/studysets/{self.study_set.id}/', HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+
+class ReplicaRoutingTest(APITestCase):
+    """
+    Stands in an empty second SQLite database for the replica, so reads it serves find nothing.
+    It is added after the test databases are set up and never written to.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.replica_dir = tempfile.TemporaryDirectory()
+        replica = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(cls.replica_dir.name, 'replica.sqlite3')}
+        connections.settings['replica'] = connections.configure_settings({'default': {}, 'replica': replica})['replica']
+        call_command('migrate', database='replica', verbosity=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        connections['replica'].close()
+        del connections['replica']
+        del connections.settings['replica']
+        cls.replica_dir.cleanup()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user("testuser", "test@email.com", "testpassword")
+        self.client.force_authenticate(user=self.user)
+        self.study_set = StudySet.objects.create(user=self.user, title="History", description="This is the test description")
+        FlashCard.objects.create(study_set=self.study_set, term="Rome", definition="Empire")
+        overrider = override_settings(DATABASE_REPLICAS=['replica'])
+        overrider.enable()
+        self.addCleanup(overrider.disable)
+
+    def test_reads_go_to_replica(self):
+        response_cache.get_cache().clear()
+        self.assertEqual(self.client.get('/api/studysets/').data['results'], [])
+        self.assertEqual(self.client.get(f'/api/studysets/{self.study_set.id}/').status_code, HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get('/api/flashcards/').data['results'], [])
+
+    def test_user_reads_own_writes(self):
+        self.assertEqual(len(self.client.get('/api/flashcards/').data['results']), 1)
+        response_cache.get_cache().clear()
+        response = self.client.post('/api/studysets/', {'title': 'Art', 'description': 'Painters'})
+        self.assertEqual(response.status_code, HTTP_201_CREATED)
+        self.assertTrue(StudySet.objects.using('default').filter(id=response.data['id']).exists())
+        self.assertFalse(StudySet.objects.using('replica').exists())
+        self.assertEqual(len(self.client.get('/api/studysets/').data['results']), 2)
+
+    @override_settings(REPLICA_LAG_SECONDS=0)
+    def test_pin_expires(self):
+        self.client.post('/api/studysets/', {'title': 'Art', 'description': 'Painters'})
+        self.assertEqual(self.client.get('/api/studysets/').data['results'], [])
+
+    def test_check_requires_shared_pin_cache(self):
+        self.assertEqual([error.id for error in check_replica_pin_cache(None)], ['study_tools.E001'])
+        with override_settings(RESPONSE_CACHE_ALIAS='tokens', CACHES={
+            **settings.CACHES,
+            'tokens': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': TOKEN_CACHE_DIR},
+        }):
+            self.assertEqual(check_replica_pin_cache(None), [])
+        with override_settings(DATABASE_REPLICAS=[]):
+            self.assertEqual(check_replica_pin_cache(None), [])
+
+
+@override_settings(JOB_DELETE_MIN_CARDS=3, JOB_IMPORT_MIN_BYTES=0, JOB_CHUNK_SIZE=2)
+class JobTest(TransactionTestCase):
+
+    def setUp(self):
+        files = tempfile.TemporaryDirectory()
+        self.addCleanup(files.cleanup)
+        overrider = override_settings(JOB_FILES_DIR=files.name)
+        overrider.enable()
+        self.addCleanup(overrider.disable)
+        self.client = APIClient()
+        self.user = User.objects.create_user("testuser", "test@email.com", "testpassword")
+        self.client.force_authenticate(user=self.user)
+        self.study_set = StudySet.objects.create(user=self.user, title="History", description="This is the test description")
+        for term in ("Rome", "Athens", "Sparta", "Carthage", "Troy"):
+            FlashCard.objects.create(study_set=self.study_set, term=term, definition="City")
+
+    def run_jobs(self):
+        call_command('run_jobs', once=True, workers=1)
+
+    def test_large_delete_runs_in_background(self):
+        response = self.client.delete(f'/api/studysets/{self.study_set.id}/')
+        self.assertEqual(response.status_code, HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['status'], 'queued')
+        self.assertTrue(response['Location'].endswith(f"/api/jobs/{response.data['id']}/"))
+        # The study set is hidden while the job is queued, and can no longer be changed
+        self.assertTrue(StudySet.objects.filter(id=self.study_set.id).exists())
+        self.assertEqual(self.client.get('/api/studysets/').data['results'], [])
+        self.assertEqual(self.client.get('/api/flashcards/').data['results'], [])
+        self.assertEqual(self.client.delete(f'/api/studysets/{self.study_set.id}/').status_code, HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.patch(f'/api/studysets/{self.study_set.id}/', {'title': 'New'}).status_code, HTTP_404_NOT_FOUND)
+        response_create = self.client.post('/api/flashcards/', {'study_set': self.study_set.id, 'term': 'Delphi', 'definition': 'City'})
+        self.assertEqual(response_create.status_code, HTTP_404_NOT_FOUND)
+
+        self.run_jobs()
+        job = self.client.get(f"/api/jobs/{response.data['id']}/").data
+        self.assertEqual((job['status'], job['progress'], job['total']), ('succeeded', 5, 5))
+        self.assertEqual(job['result'], {'deleted': 5})
+        self.assertFalse(StudySet.objects.filter(id=self.study_set.id).exists())
+        self.assertEqual(Tombstone.objects.filter(user=self.user, model='flashcard').count(), 5)
+
+    def test_import_runs_in_background(self):
+        upload = SimpleUploadedFile('cards.csv', b'term,definition,study_set\nMars,Planet,Space\nVenus,Planet,Space\n')
+        response = self.client.post('/api/studysets/import/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, HTTP_202_ACCEPTED)
+        self.run_jobs()
+        job = Job.objects.get(id=response.data['id'])
+        self.assertEqual((job.status, job.result['imported'], job.progress, job.file), ('succeeded', 2, 2, ''))
+        self.assertEqual(StudySet.objects.get(user=self.user, title='Space').card_count, 2)
+
+    def test_export_download(self):
+        response = self.client.post(f'/api/studysets/{self.study_set.id}/export/?type=csv')
+        self.assertEqual(response.status_code, HTTP_202_ACCEPTED)
+        self.assertIsNone(response.data['download'])
+        self.run_jobs()
+        job = self.client.get(f"/api/jobs/{response.data['id']}/").data
+        self.assertEqual(job['status'], 'succeeded')
+        download = self.client.get(job['download'])
+        self.assertEqual(download['Content-Disposition'], f'attachment; filename="study-set-{self.study_set.id}.csv"')
+        lines = b''.join(download.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 6)
+
+        other = User.objects.create_user("otheruser", "other@email.com", "testpassword")
+        self.client.force_authenticate(user=other)
+        self.assertEqual(self.client.get(job['download']).status_code, HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get('/api/jobs/').data['results'], [])
+
+    def test_stale_jobs_are_retried(self):
+        job = Job.objects.create(kind='repair_counters', status='running', attempts=1, heartbeat_at=timezone.now() - timedelta(hours=1))
+        exhausted = Job.objects.create(kind='repair_counters', status='running', attempts=3, heartbeat_at=timezone.now() - timedelta(hours=1))
+        StudySet.objects.filter(id=self.study_set.id).update(card_count=0)
+        self.run_jobs()
+        job.refresh_from_db()
+        exhausted.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.result), ('succeeded', 2, {'checked': 1, 'repaired': 1}))
+        self.assertEqual(exhausted.status, 'failed')
+        self.assertEqual(StudySet.objects.get(id=self.study_set.id).card_count, 5)
+
+
+    def test_requeued_job_keeps_its_new_status(self):
+        enqueue_study_set_delete(self.study_set)
+        job = claim_job()
+        # The job looked stale and another worker claimed it meanwhile
+        Job.objects.filter(id=job.id).update(attempts=F('attempts') + 1)
+        run_job(job)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.finished_at), ('running', 2, None))
+
+    @override_settings(JOB_CHUNK_SIZE=2)
+    def test_materializing_clones_reports_progress(self):
+        other = User.objects.create_user("otheruser", "other@email.com", "testpassword")
+        clone = clone_study_set(self.study_set, other)
+        enqueue_study_set_delete(self.study_set)
+        with mock.patch.object(Job, 'report', autospec=True, side_effect=Job.report) as report:
+            run_job(claim_job())
+        self.assertEqual([call.args[1:] for call in report.call_args_list][:4], [(2,), (4,), (5,), (0, 5)])
+        self.assertEqual(FlashCard.objects.filter(study_set=clone).count(), 5)
+
+
+@override_settings(REVIEW_ROLLUP_DELAY_SECONDS=0)
+class ReviewStatsTest(APITestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user("testuser", "test@email.com", "testpassword")
+        self.client.force_authenticate(user=self.user)
+        self.study_set = StudySet.objects.create(user=self.user, title="History", description="This is the test description")
+        self.rome = FlashCard.objects.create(study_set=self.study_set, term="Rome", definition="Empire")
+        self.athens = FlashCard.objects.create(study_set=self.study_set, term="Athens", definition="Democracy")
+
+    def send(self, *events):
+        return self.client.post('/api/review/events/', {'events': list(events)}, format='json')
+
+    def test_events_are_rolled_up(self):
+        response = self.send(
+            {'flashcard': self.rome.id, 'correct': True, 'response_ms': 1000},
+            {'flashcard': self.rome.id, 'correct': False, 'response_ms': 3000},
+            {'flashcard': self.athens.id, 'correct': True},
+        )
+        self.assertEqual(response.status_code, HTTP_202_ACCEPTED)
+        self.assertEqual(response.data, {'accepted': 3, 'errors': []})
+        self.assertTrue(Job.objects.filter(kind='rollup_reviews', status='queued').exists())
+        # Nothing is counted before the rollup
+        self.assertEqual(self.client.get('/api/review/stats/').data, [])
+
+        call_command('rollup_review_events', stdout=io.StringIO())
+        self.send({'flashcard': self.athens.id, 'correct': False})
+        call_command('rollup_review_events', stdout=io.StringIO())
+        call_command('rollup_review_events', stdout=io.StringIO())
+
+        data = self.client.get('/api/review/stats/', {'study_set': self.study_set.id}).data
+        self.assertEqual((data['study_set']['answers'], data['study_set']['correct'], data['study_set']['accuracy']), (4, 2, 0.5))
+        cards = {card['flashcard']: card for card in data['cards']}
+        self.assertEqual((cards[self.rome.id]['accuracy'], cards[self.rome.id]['average_response_ms']), (0.5, 2000))
+        self.assertEqual((cards[self.athens.id]['answers'], cards[self.athens.id]['average_response_ms']), (2, None))
+        self.assertEqual([stats['study_set'] for stats in self.client.get('/api/review/stats/').data], [self.study_set.id])
+
+    def test_only_visible_cards_are_accepted(self):
+        other = User.objects.create_user("otheruser", "other@email.com", "testpassword")
+        other_card = FlashCard.objects.create(
+            study_set=StudySet.objects.create(user=other, title="Art"), term="Monet", definition="Painter",
+        )
+        response = self.send({'flashcard': other_card.id, 'correct': True}, {'flashcard': self.rome.id, 'correct': True})
+        self.assertEqual(response.data['accepted'], 1)
+        self.assertEqual(response.data['errors'][0]['index'], 0)
+
+    def test_inherited_cards_count_for_the_clone(self):
+        other = User.objects.create_user("otheruser", "other@email.com", "testpassword")
+        self.study_set.is_public = True
+        self.study_set.save()
+        self.client.force_authenticate(user=other)
+        clone_id = self.client.post(f'/api/studysets/{self.study_set.id}/clone/').data['id']
+        self.send({'flashcard': self.rome.id, 'correct': True})
+        call_command('rollup_review_events', stdout=io.StringIO())
+        data = self.client.get('/api/review/stats/', {'study_set': clone_id}).data
+        self.assertEqual((data['study_set']['study_set'], data['study_set']['answers']), (clone_id, 1))
+        self.assertEqual([card['flashcard'] for card in data['cards']], [self.rome.id])
+
+    def test_stats_move_with_edited_inherited_cards(self):
+        other = User.objects.create_user("otheruser", "other@email.com", "testpassword")
+        self.study_set.is_public = True
+        self.study_set.save()
+        self.client.force_authenticate(user=other)
+        clone_id = self.client.post(f'/api/studysets/{self.study_set.id}/clone/').data['id']
+        self.send({'flashcard': self.rome.id, 'correct': True}, {'flashcard': self.athens.id, 'correct': False})
+        call_command('rollup_review_events', stdout=io.StringIO())
+        # One answer is still in the event log when the card is copied
+        self.send({'flashcard': self.rome.id, 'correct': False})
+        copy_id = self.client.patch(f'/api/flashcards/{self.rome.id}/', {'definition': 'Republic'}).data['id']
+        call_command('rollup_review_events', stdout=io.StringIO())
+        cards = {card['flashcard']: card for card in self.client.get('/api/review/stats/', {'study_set': clone_id}).data['cards']}
+        self.assertEqual(set(cards), {copy_id, self.athens.id})
+        self.assertEqual((cards[copy_id]['answers'], cards[copy_id]['correct']), (2, 1))
+
+    def test_event_batches_are_capped_before_validation(self):
+        with mock.patch('study_tools.views.ReviewEventSerializer') as serializer:
+            response = self.send(*[{'flashcard': self.rome.id, 'correct': True}] * (REVIEW_MAX_EVENTS + 1))
+        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+        serializer.assert_not_called()
+
+
+class AdminTest(TestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser("admin", "admin@email.com", "adminpassword")
+        self.client.force_login(self.admin)
+        self.user = User.objects.create_user("testuser", "test@email.com", "testpassword")
+        self.other = User.objects.create_user("otheruser", "other@email.com", "testpassword")
+        self.history = StudySet.objects.create(user=self.user, title="History")
+        self.art = StudySet.objects.create(user=self.other, title="Art")
+        self.rome = FlashCard.objects.create(study_set=self.history, term="Rome", definition="Empire")
+        self.athens = FlashCard.objects.create(study_set=self.history, term="Athens", definition="Democracy")
+        FlashCard.objects.create(study_set=self.art, term="Athens", definition="Parthenon")
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, HTTP_200_OK)
+        return len(queries)
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        urls = ['/admin/study_tools/flashcard/', '/admin/study_tools/studyset/', f'/admin/study_tools/flashcard/?study_set__id__exact={self.history.id}']
+        before = [self.count_queries(url) for url in urls]
+        for index in range(20):
+            study_set = StudySet.objects.create(user=self.user if index % 2 else self.other, title=f"Set {index}")
+            FlashCard.objects.create(study_set=study_set, term=f"Term {index}", definition="Definition")
+        self.assertEqual([self.count_queries(url) for url in urls], before)
+
+    def test_search_by_id_and_text(self):
+        response = self.client.get('/admin/study_tools/flashcard/', {'q': str(self.rome.id)})
+        self.assertEqual(list(response.context['cl'].result_list), [self.rome])
+        response = self.client.get('/admin/study_tools/flashcard/', {'q': 'democracy'})
+        self.assertEqual(list(response.context['cl'].result_list), [self.athens])
+
+    def test_move_cards(self):
+        data = {'action': 'move_to_study_set', '_selected_action': [self.rome.id, self.athens.id]}
+        response = self.client.post('/admin/study_tools/flashcard/', data)
+        self.assertTemplateUsed(response, 'admin/study_tools/flashcard/move_to_study_set.html')
+
+        response = self.client.post('/admin/study_tools/flashcard/', {**data, 'apply': 'Move', 'target': self.art.id})
+        self.assertEqual(response.status_code, 302)
+        # Athens clashes with the term already in Art
+        self.assertEqual(FlashCard.objects.get(id=self.rome.id).study_set_id, self.art.id)
+        self.assertEqual(FlashCard.objects.get(id=self.athens.id).study_set_id, self.history.id)
+        self.assertEqual(StudySet.objects.get(id=self.history.id).card_count, 1)
+        self.assertEqual(StudySet.objects.get(id=self.art.id).card_count, 2)
+        self.assertTrue(Tombstone.objects.filter(user=self.user, model='flashcard', object_id=self.rome.id).exists())
+
+    def test_move_cards_into_clone_skips_inherited_terms(self):
+        clone = clone_study_set(self.history, self.other)
+        parthenon = FlashCard.objects.get(study_set=self.art)
+        data = {'action': 'move_to_study_set', '_selected_action': [parthenon.id], 'apply': 'Move', 'target': clone.id}
+        self.client.post('/admin/study_tools/flashcard/', data)
+        self.assertEqual(FlashCard.objects.get(id=parthenon.id).study_set_id, self.art.id)
+        self.assertEqual(StudySet.objects.get(id=clone.id).card_count, 0)
+
+    @override_settings(JOB_DELETE_MIN_CARDS=2)
+    def test_large_study_set_delete_is_queued(self):
+        response = self.client.post(f'/admin/study_tools/studyset/{self.history.id}/delete/', {'post': 'yes'})
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(StudySet.objects.filter(id=self.history.id).exists())
+        job = Job.objects.get(kind='delete_study_set')
+        self.assertEqual((job.user, job.params), (self.user, {'study_set': self.history.id}))
+        self.client.post(f'/admin/study_tools/studyset/{self.art.id}/delete/', {'post': 'yes'})
+        self.assertFalse(StudySet.objects.filter(id=self.art.id).exists())
+
+    def test_delete_keeps_counters(self):
+        data = {'action': 'delete_selected', '_selected_action': [self.rome.id], 'post': 'yes'}
+        self.client.post('/admin/study_tools/flashcard/', data)
+        self.assertFalse(FlashCard.objects.filter(id=self.rome.id).exists())
+        self.assertEqual(StudySet.objects.get(id=self.history.id).card_count, 1)
+        self.assertTrue(Tombstone.objects.filter(user=self.user, model='flashcard', object_id=self.rome.id).exists())
+
+
+class DuplicatesTest(APITestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user("testuser", "test@email.com", "testpassword")
+        self.client.force_authenticate(user=self.user)
+        biology = StudySet.objects.create(user=self.user, title="Biology")
+        revision = StudySet.objects.create(user=self.user, title="Revision")
+        self.first = FlashCard.objects.create(study_set=biology, term="Photosynthesis", definition="Plants make food from light")
+        self.exact = FlashCard.objects.create(study_set=revision, term="photosynthesis.", definition="Plants make food from LIGHT!")
+        self.near = FlashCard.objects.create(study_set=revision, term="Photosynthesis", definition="Plants make food from sunlight")
+        self.other = FlashCard.objects.create(study_set=biology, term="Mitosis", definition="Cell division")
+
+    def analyse(self):
+        response = self.client.post('/api/flashcards/duplicates/')
+        self.assertEqual(response.status_code, HTTP_202_ACCEPTED)
+        run_job(claim_job())
+        return self.client.get('/api/flashcards/duplicates/').data
+
+    def test_near_duplicates_are_clustered(self):
+        self.assertEqual(self.client.get('/api/flashcards/duplicates/').status_code, HTTP_404_NOT_FOUND)
+        data = self.analyse()
+        self.assertEqual(data['job']['status'], 'succeeded')
+        self.assertEqual(len(data['clusters']), 1)
+        cluster = data['clusters'][0]
+        self.assertEqual([card['id'] for card in cluster['cards']], [self.first.id, self.exact.id, self.near.id])
+        self.assertEqual((cluster['keep'], cluster['exact']), (self.first.id, False))
+
+    def test_merge(self):
+        CardReview.objects.create(user=self.user, flashcard=self.near, repetitions=3)
+        CardStats.objects.create(user=self.user, flashcard=self.near, answers=4, correct=3)
+        CardStats.objects.create(user=self.user, flashcard=self.first, answers=1, correct=1)
+        response = self.client.post('/api/flashcards/duplicates/merge/', {'merges': [
+            {'keep': self.first.id, 'remove': [self.exact.id, self.near.id], 'definition': "Plants make food from sunlight"},
+            {'keep': self.other.id, 'remove': [self.first.id]},
+        ]}, format='json')
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(response.data['removed'], 2)
+        self.assertEqual(response.data['errors'][0]['index'], 1)
+        self.assertEqual(list(FlashCard.objects.order_by('id').values_list('id', flat=True)), [self.first.id, self.other.id])
+        self.assertEqual(FlashCard.objects.get(id=self.first.id).definition, "Plants make food from sunlight")
+        self.assertEqual(CardReview.objects.get(user=self.user).flashcard_id, self.first.id)
+        stats = CardStats.objects.get(user=self.user)
+        self.assertEqual((stats.flashcard_id, stats.answers, stats.correct), (self.first.id, 5, 4))
+        self.assertEqual(StudySet.objects.get(title="Revision").card_count, 0)
+        # The merged cards drop out of the last analysis
+        self.assertEqual(self.analyse()['clusters'], [])
+
+    def test_merges_cannot_claim_the_same_term(self):
+        first = FlashCard.objects.create(study_set=self.exact.study_set, term="Light", definition="Energy")
+        second = FlashCard.objects.create(study_set=self.exact.study_set, term="Sunlight", definition="Energy")
+        merges = [
+            {'keep': self.exact.id, 'remove': [first.id], 'term': "Photo"},
+            {'keep': self.near.id, 'remove': [second.id], 'term': "Photo"},
+        ]
+        response = self.client.post('/api/flashcards/duplicates/merge/', {'merges': merges}, format='json')
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(response.data['removed'], 1)
+        self.assertEqual([(error['index'], list(error['errors'])) for error in response.data['errors']], [(1, ['term'])])
+        self.assertEqual(FlashCard.objects.get(id=self.exact.id).term, "Photo")
+
+        # A term taken by a concurrent write fails only that change
+        merges = [{'keep': self.near.id, 'remove': [second.id], 'term': "Photo"}]
+        with mock.patch('study_tools.dedupe.term_taken', return_value=False):
+            response = self.client.post('/api/flashcards/duplicates/merge/', {'merges': merges}, format='json')
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(response.data['removed'], 1)
+        self.assertEqual(response.data['errors'][0]['index'], 0)
+        self.assertEqual(FlashCard.objects.get(id=self.near.id).term, "Photosynthesis")
+
+    def test_merge_batches_are_capped_before_validation(self):
+        merges = [{'keep': self.first.id, 'remove': [self.exact.id]}] * (DEDUPE_MAX_MERGES + 1)
+        with mock.patch('study_tools.views.DuplicateMergeSerializer') as serializer:
+            response = self.client.post('/api/flashcards/duplicates/merge/', {'merges': merges}, format='json')
+        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+        serializer.assert_not_called()
+
+    def test_inherited_duplicates_are_detached(self):
+        other = User.objects.create_user("otheruser", "other@email.com", "testpassword")
+        shared = StudySet.objects.create(user=other, title="Shared", is_public=True)
+        inherited = FlashCard.objects.create(study_set=shared, term="Mitosis", definition="Cell division.")
+        clone_id = self.client.post(f'/api/studysets/{shared.id}/clone/').data['id']
+        cluster = self.analyse()['clusters'][1]
+        self.assertEqual((cluster['keep'], cluster['exact']), (self.other.id, True))
+        self.assertEqual(cluster['cards'][1]['study_set'], clone_id)
+        response = self.client.post('/api/flashcards/duplicates/merge/', {'merges': [{'keep': self.other.id, 'remove': [inherited.id]}]}, format='json')
+        self.assertEqual(response.data, {'removed': 1, 'errors': []})
+        self.assertTrue(FlashCard.objects.filter(id=inherited.id).exists())
+        self.assertEqual(self.client.get('/api/flashcards/', {'study_set': clone_id}).data['results'], [])
+
+
+class MultiGetTest(APITestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user("testuser", "test@email.com", "testpassword")
+        self.client.force_authenticate(user=self.user)
+        self.study_sets = [StudySet.objects.create(user=self.user, title=f"Set {i}") for i in range(6)]
+        self.cards = [FlashCard.objects.create(study_set=self.study_sets[i % 2], term=f"Term {i}", definition="Definition") for i in range(6)]
+
+    def test_study_sets_in_requested_order(self):
+        other = User.objects.create_user("otheruser", "other@email.com", "testpassword")
+        foreign = StudySet.objects.create(user=other, title="Foreign")
+        ids = [self.study_sets[2].id, foreign.id, self.study_sets[0].id, 0]
+        response = self.client.get('/api/studysets/', {'ids': ','.join(map(str, ids))})
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual([study_set['id'] for study_set in response.data], [self.study_sets[2].id, self.study_sets[0].id])
+        self.assertIn('ETag', response)
+
+    def test_constant_queries(self):
+        def count(ids, **params):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/api/flashcards/', {'ids': ','.join(str(obj.id) for obj in ids), **params})
+            self.assertEqual(len(response.data), len(ids))
+            return len(queries)
+        self.assertEqual(count(self.cards[:2]), count(self.cards))
+
+        shared = StudySet.objects.create(user=User.objects.create_user("otheruser", "other@email.com", "testpassword"), title="Shared", is_public=True)
+        FlashCard.objects.create(study_set=shared, term="Inherited", definition="Definition")
+        clone_id = self.client.post(f'/api/studysets/{shared.id}/clone/').data['id']
+        # Loads the user's clones into the cache
+        self.client.get('/api/flashcards/')
+        with CaptureQueriesContext(connection) as few:
+            self.client.get('/api/studysets/', {'ids': f'{clone_id},{self.study_sets[0].id}', 'expand': 'flashcards'})
+        with CaptureQueriesContext(connection) as many:
+            data = self.client.get('/api/studysets/', {'ids': ','.join(str(study_set.id) for study_set in self.study_sets) + f',{clone_id}', 'expand': 'flashcards'}).data
+        self.assertEqual(len(few), len(many))
+        self.assertEqual([card['term'] for card in data[-1]['flashcards']], ["Inherited"])
+
+    def test_sparse_fields(self):
+        response = self.client.get('/api/flashcards/', {'ids': self.cards[0].id, 'fields': 'id,term'})
+        self.assertEqual(response.data, [{'id': self.cards[0].id, 'term': "Term 0"}])
+        response = self.client.get(f'/api/studysets/{self.study_sets[0].id}/', {'fields': 'id,title'})
+        self.assertEqual(response.data, {'id': self.study_sets[0].id, 'title': "Set 0"})
+        data = self.client.get('/api/studysets/', {'fields': 'id'}).data
+        self.assertEqual(data['results'][0], {'id': self.study_sets[-1].id})
+
+    def test_invalid_ids(self):
+        self.assertEqual(self.client.get('/api/flashcards/', {'ids': '1,x'}).status_code, HTTP_400_BAD_REQUEST)
+        too_many = ','.join(map(str, range(1, 502)))
+        self.assertEqual(self.client.get('/api/studysets/', {'ids': too_many}).status_code, HTTP_400_BAD_REQUEST)
+
+
+@override_settings(REST_FRAMEWORK={
+    **settings.REST_FRAMEWORK,
+    'DEFAULT_THROTTLE_RATES': {'read': '2/min', 'write': '', 'auth': '1/min'},
+})
+class ThrottleTest(APITestCase):
+
+    def setUp(self):
+        get_throttle_cache().clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user("testuser", "test@email.com", "testpassword")
+        self.client.force_authenticate(user=self.user)
+
+    def test_reads_are_throttled_per_user(self):
+        with mock.patch('study_tools.throttling.time.time', return_value=1000.0) as now:
+            self.assertEqual(self.client.get('/api/studysets/').status_code, HTTP_200_OK)
+            self.assertEqual(self.client.get('/api/studysets/').status_code, HTTP_200_OK)
+            response = self.client.get('/api/flashcards/')
+            self.assertEqual(response.status_code, HTTP_429_TOO_MANY_REQUESTS)
+            # The rejected request used a token too
+            self.assertEqual(response['Retry-After'], '60')
+            # Writes have no rate, and other users their own buckets
+            self.assertEqual(self.client.post('/api/studysets/', {'title': "New"}).status_code, HTTP_201_CREATED)
+            self.client.force_authenticate(user=User.objects.create_user("otheruser", "other@email.com", "testpassword"))
+            self.assertEqual(self.client.get('/api/studysets/').status_code, HTTP_200_OK)
+            self.client.force_authenticate(user=self.user)
+
+            now.return_value = 1059.0
+            self.assertEqual(self.client.get('/api/studysets/').status_code, HTTP_429_TOO_MANY_REQUESTS)
+            now.return_value = 1150.0
+            self.assertEqual(self.client.get('/api/studysets/').status_code, HTTP_200_OK)
+
+    def test_login_is_throttled_per_ip(self):
+        client = APIClient()
+        credentials = {'username': "testuser", 'password': "testpassword"}
+        self.assertEqual(client.post('/auth/token/login/', credentials).status_code, HTTP_200_OK)
+        response = client.post('/auth/token/login/', credentials)
+        self.assertEqual(response.status_code, HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', response)
+        # Other djoser endpoints are reads and writes like the rest
+        for _ in range(2):
+            self.assertEqual(self.client.get('/auth/users/me/').status_code, HTTP_200_OK)
+
+    def test_steady_clients_do_not_get_a_full_bucket_back(self):
+        allowed = 0
+        with mock.patch('study_tools.throttling.time.time', return_value=1000.0) as now:
+            # A read every 10 seconds, three times the 2/min rate, for longer than an idle
+            # bucket is kept
+            for _ in range((KEY_TIMEOUT_PERIODS + 2) * 6):
+                now.return_value += 10
+                allowed += self.client.get('/api/studysets/').status_code == HTTP_200_OK
+        self.assertEqual(allowed, 2)
+
+    def test_redis_buckets_are_advanced_in_one_step(self):
+        cache = RedisCache('redis://localhost:6379', {})
+        with mock.patch('study_tools.throttling.get_throttle_cache', return_value=cache), \
+                mock.patch('study_tools.throttling.TokenBucketThrottle.advance', side_effect=[(5000, 5000), (65000, 5000)]) as advance:
+            self.assertEqual(self.client.get('/api/studysets/').status_code, HTTP_200_OK)
+            self.assertEqual(self.client.get('/api/studysets/').status_code, HTTP_429_TOO_MANY_REQUESTS)
+        key = 'study_tools:throttle:read:user:{}'.format(self.user.pk)
+        advance.assert_called_with(cache, key, 30000, 60000)
+
+    async def test_async_reads_are_throttled(self):
+        token = await sync_to_async(Token.objects.create)(user=self.user)
+        client, headers = AsyncClient(), {'Authorization': 'Token ' + token.key}
+        with mock.patch('study_tools.throttling.time.time', return_value=1000.0):
+            self.assertEqual((await client.get('/api/async/studysets/', headers=headers)).status_code, HTTP_200_OK)
+            self.assertEqual((await client.get('/api/async/flashcards/', headers=headers)).status_code, HTTP_200_OK)
+            response = await client.get('/api/async/studysets/', headers=headers)
+        self.assertEqual(response.status_code, HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '60')
+
+
 class StudySetModelTest(TestCase):
 
     def setUp(self):
@@ -0,0 +1,157 @@
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+# Buckets idle this many periods are forgotten, which also bounds how long a client
+# that keeps sending over its rate can be held off
+KEY_TIMEOUT_PERIODS = 10
+# Advances a bucket by ARGV[1] ms and returns its previous full time, or Redis' time when it
+# was full, along with that time. The key expires ARGV[2] ms after the bucket next refills.
+GCRA_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local full_at = tonumber(redis.call('GET', KEYS[1]))
+if full_at == nil or full_at < now then
+    full_at = now
+end
+redis.call('SET', KEYS[1], full_at + ARGV[1], 'PX', full_at + ARGV[1] - now + ARGV[2])
+return {full_at, now}
+"""
+
+
+def get_throttle_cache():
+    return caches[getattr(settings, 'THROTTLE_CACHE_ALIAS', 'default')]
+
+
+def parse_rate(rate):
+    """
+    Parses a DRF rate like '100/min' into (requests, seconds), or None when rate is empty.
+    """
+    if not rate:
+        return None
+    requests, period = rate.split('/')
+    return int(requests), PERIODS[period[0]]
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Per-user (or per-IP for anonymous requests) token buckets, one for each scope of
+    DEFAULT_THROTTLE_RATES: 'auth' for logging in and signing up, 'read' for safe methods
+    and 'write' for the rest. Views can name another scope with throttle_scope. A rate of
+    '100/min' is a bucket of 100 requests refilled at 100 a minute.
+
+    The bucket is kept as the time it will next be full (the generic cell rate algorithm),
+    stored in THROTTLE_CACHE_ALIAS. On Redis, GCRA_SCRIPT reads, advances and expires it in
+    one atomic step on Redis' clock. Other caches fall back to incr(), with a set() starting
+    the bucket over when it is new or had refilled and a touch() keeping it alive once per
+    rate's worth of requests; concurrent requests can both find a bucket refilled there and
+    get a token each, so the fallback is only exact within a single process. Requests over
+    the limit use a token too, so clients have to wait for Retry-After rather than retry
+    at once.
+    """
+
+    def get_scope(self, request, view):
+        scope = getattr(view, 'throttle_scope', None)
+        if scope is not None:
+            return scope
+        # Imported here since djoser's views import rest_framework.views, which loads this throttle
+        from djoser.views import TokenCreateView, UserViewSet
+        if isinstance(view, TokenCreateView) or (isinstance(view, UserViewSet) and view.action == 'create'):
+            return 'auth'
+        return 'read' if request.method in SAFE_METHODS else 'write'
+
+    def get_cache_key(self, request, scope):
+        if request.user and request.user.is_authenticated:
+            return 'study_tools:throttle:{}:user:{}'.format(scope, request.user.pk)
+        return 'study_tools:throttle:{}:ip:{}'.format(scope, self.get_ident(request))
+
+    def get_bucket(self, request, view):
+        """
+        Returns the cache key and, in milliseconds, the time one token takes to refill, how
+        far ahead of now the bucket's full time can be while it still holds a token, and the
+        rate's period; or None when the scope is not throttled.
+        """
+        scope = self.get_scope(request, view)
+        rate = parse_rate(api_settings.DEFAULT_THROTTLE_RATES.get(scope))
+        if rate is None:
+            return None
+        requests, period = rate
+        interval = max(1, period * 1000 // requests)
+        return self.get_cache_key(request, scope), interval, interval * (requests - 1), period * 1000
+
+    def allow_request(self, request, view):
+        bucket = self.get_bucket(request, view)
+        if bucket is None:
+            return True
+        key, interval, tolerance, period = bucket
+        cache = get_throttle_cache()
+        if isinstance(cache, RedisCache):
+            full_at, now = self.advance(cache, key, interval, period)
+            return self.check(full_at, now, interval, tolerance)
+        now = int(time.time() * 1000)
+        try:
+            full_at = cache.incr(key, interval) - interval
+        except ValueError:
+            full_at = None
+        if full_at is None or full_at < now:
+            cache.set(key, now + interval, period * KEY_TIMEOUT_PERIODS // 1000)
+            return True
+        if full_at // period != (full_at + interval) // period:
+            cache.touch(key, self.get_timeout(full_at, now, interval, period))
+        return self.check(full_at, now, interval, tolerance)
+
+    async def aallow_request(self, request, view):
+        """
+        Async version of allow_request().
+        """
+        bucket = self.get_bucket(request, view)
+        if bucket is None:
+            return True
+        key, interval, tolerance, period = bucket
+        cache = get_throttle_cache()
+        if isinstance(cache, RedisCache):
+            full_at, now = await sync_to_async(self.advance)(cache, key, interval, period)
+            return self.check(full_at, now, interval, tolerance)
+        now = int(time.time() * 1000)
+        try:
+            full_at = await cache.aincr(key, interval) - interval
+        except ValueError:
+            full_at = None
+        if full_at is None or full_at < now:
+            await cache.aset(key, now + interval, period * KEY_TIMEOUT_PERIODS // 1000)
+            return True
+        if full_at // period != (full_at + interval) // period:
+            await cache.atouch(key, self.get_timeout(full_at, now, interval, period))
+        return self.check(full_at, now, interval, tolerance)
+
+    def advance(self, cache, key, interval, period):
+        """
+        Runs GCRA_SCRIPT on the Redis server holding the key and returns the bucket's
+        previous full time and the current time, in milliseconds.
+        """
+        # Django's RedisCache has no public access to its client, unlike django-redis'
+        # get_redis_connection(); the key is stored as cache.get() would look it up
+        key = cache.make_and_validate_key(key)
+        client = cache._cache.get_client(key, write=True)
+        full_at, now = client.register_script(GCRA_SCRIPT)(keys=[key], args=[interval, period * KEY_TIMEOUT_PERIODS])
+        return full_at, now
+
+    def get_timeout(self, full_at, now, interval, period):
+        # Long enough for the bucket to refill, and then to be idle KEY_TIMEOUT_PERIODS
+        return (full_at + interval - now) // 1000 + 1 + period * KEY_TIMEOUT_PERIODS // 1000
+
+    def check(self, full_at, now, interval, tolerance):
+        if full_at - now <= tolerance:
+            return True
+        self.retry_after = (full_at + interval - tolerance - now) / 1000
+        return False
+
+    def wait(self):
+        return getattr(self, 'retry_after', None)
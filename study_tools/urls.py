@@ -1,11 +1,22 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import StudySetViewSet, FlashCardViewSet
+from . import async_views
+from .views import StudySetViewSet, FlashCardViewSet, ReviewViewSet, SearchViewSet, SyncViewSet, JobViewSet, CacheStatsViewSet, RequestMetricsViewSet
 
 router = DefaultRouter()
 router.register('studysets', StudySetViewSet, basename='studysets')
 router.register('flashcards', FlashCardViewSet, basename='flashcards')
+router.register('review', ReviewViewSet, basename='review')
+router.register('search', SearchViewSet, basename='search')
+router.register('sync', SyncViewSet, basename='sync')
+router.register('jobs', JobViewSet, basename='jobs')
+router.register('cache/stats', CacheStatsViewSet, basename='cache-stats')
+router.register('metrics', RequestMetricsViewSet, basename='metrics')
 
 urlpatterns = [
     path('', include(router.urls)),
+    # Async versions of the hot read endpoints for ASGI deployments
+    path('async/studysets/', async_views.study_set_list, name='async-studysets-list'),
+    path('async/studysets/<int:pk>/', async_views.study_set_detail, name='async-studysets-detail'),
+    path('async/flashcards/', async_views.flashcard_list, name='async-flashcards-list'),
 ]
\ No newline at end of file
@@ -1,42 +1,559 @@
+import random
+from contextlib import contextmanager
 from rest_framework import viewsets
-from .models import StudySet, FlashCard
-from .serializers import StudySetSerializer, FlashCardSerializer
-from .permissions import IsOwner
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from rest_framework.reverse import reverse
+from rest_framework.status import HTTP_201_CREATED, HTTP_202_ACCEPTED, HTTP_204_NO_CONTENT, HTTP_400_BAD_REQUEST
+from rest_framework.parsers import MultiPartParser
+from .models import StudySet, FlashCard, CardReview, CardStats, StudySetStats, Job, JOB_QUEUED, JOB_RUNNING, JOB_SUCCEEDED
+from .serializers import (
+    StudySetSerializer, StudySetSummarySerializer, FlashCardSerializer,
+    CardReviewSerializer, DueCardSerializer, ReviewAnswerSerializer,
+    FlashCardSearchSerializer, StudySetSearchSerializer, JobSerializer,
+    ReviewEventSerializer, StudySetStatsSerializer, CardStatsSerializer,
+    DuplicateMergeSerializer, requested_fields,
+)
+from .permissions import IsOwner, IsOwnerOrPublic
 from rest_framework.permissions import IsAuthenticated
 from django.shortcuts import get_object_or_404
+from django.http import FileResponse, Http404, StreamingHttpResponse
 from rest_framework.exceptions import ValidationError
+from django.db import IntegrityError
+from django.db.models import F, Q
+from rest_framework.filters import OrderingFilter
+from .bulk import apply_bulk_cards, CONFLICT_ERROR, CONFLICT_MODES, CONFLICT_SKIP, TERM_CONFLICT
+from .importers import CardImporter, DEFAULT_CHUNK_SIZE, IMPORT_FORMATS, detect_format, iter_rows
+from .exporters import CONTENT_TYPES, EXPORT_FORMATS, export_rows
+from .scheduling import record_answers
+from .quiz import MAX_SEED, build_quiz
+from .sync import SyncState, collect_changes
+from .sharing import clone_study_set, copy_on_write, detach_cards, prefetch_all_cards
+from .jobs import (
+    JOB_EXPORT_CARDS, JOB_FIND_DUPLICATES, JOB_IMPORT_CARDS, JOB_ROLLUP_REVIEWS,
+    enqueue, enqueue_once, enqueue_study_set_delete, job_files,
+)
+from .dedupe import merge_cards
+from .stats import record_events
+from django.conf import settings
+from django.core import signing
+from .search import search_flashcards, search_study_sets
+from .pagination import SearchPagination
+from .conditional import ConditionalGetMixin, first_value, study_sets_state
+from .response_cache import CachedResponseMixin, stats, study_set_generation, user_generation
+from .routers import ReplicaReadMixin
+from .middleware import endpoint_stats
+from rest_framework.permissions import IsAdminUser
+from django.utils import timezone
 
+BULK_MAX_CARDS = 1000
+IMPORT_MAX_CHUNK_SIZE = 5000
+QUIZ_MAX_QUESTIONS = 100
+QUIZ_MAX_CHOICES = 9
+# Actions whose response nests the flashcards of each StudySet
+NESTED_CARD_ACTIONS = ('list', 'retrieve', 'update', 'partial_update')
+REVIEW_MAX_CARDS = 200
+REVIEW_MAX_ANSWERS = 500
+REVIEW_MAX_EVENTS = 1000
+DEDUPE_MAX_MERGES = 500
+SYNC_MAX_CHANGES = 2000
+SEARCH_TYPES = ('flashcards', 'studysets')
+MULTI_GET_MAX_IDS = 500
 
-class StudySetViewSet(viewsets.ModelViewSet):
+
+# Reports a ('study_set', 'term') conflict that a concurrent request won as a 400
+@contextmanager
+def term_conflict():
+    try:
+        yield
+    except IntegrityError:
+        raise ValidationError({'term': [TERM_CONFLICT]})
+
+
+# 202 Accepted response pointing at the status of a queued Job
+def job_accepted(request, job):
+    data = JobSerializer(job, context={'request': request}).data
+    return Response(data, status=HTTP_202_ACCEPTED, headers={'Location': reverse('jobs-detail', args=[job.id], request=request)})
+
+
+# Reads a non-negative integer query parameter, capped at maximum
+def get_int_param(request, name, default, maximum):
+    try:
+        value = int(request.query_params.get(name, default))
+    except ValueError:
+        raise ValidationError({name: 'A valid integer is required.'})
+    if not 0 <= value <= maximum:
+        raise ValidationError({name: 'Must be between 0 and {}.'.format(maximum)})
+    return value
+
+
+def get_batch(request, name, maximum, items):
+    """
+    Returns the list sent as name, refusing more than maximum items before any is validated.
+    """
+    data = request.data.get(name)
+    if isinstance(data, list) and len(data) > maximum:
+        raise ValidationError({name: 'At most {} {} can be sent at once.'.format(maximum, items)})
+    return data
+
+
+class MultiGetMixin:
+    """
+    Lets lists return the objects with the ids given in ?ids=1,2,3 instead of a page, in
+    that order and without those that do not exist or are not the user's. The objects are
+    loaded with the list's queryset in one query, so the cost does not grow with their number.
+    """
+
+    def get_ids(self):
+        value = self.request.query_params.get('ids')
+        if value is None:
+            return None
+        try:
+            ids = list(dict.fromkeys(int(part) for part in value.split(',')))
+        except ValueError:
+            raise ValidationError({'ids': 'Expected a comma-separated list of ids.'})
+        if len(ids) > MULTI_GET_MAX_IDS:
+            raise ValidationError({'ids': 'At most {} ids can be requested at once.'.format(MULTI_GET_MAX_IDS)})
+        return ids
+
+    def list(self, request, *args, **kwargs):
+        ids = self.get_ids()
+        if ids is None:
+            return super().list(request, *args, **kwargs)
+        found = {obj.id: obj for obj in self.get_queryset().filter(id__in=ids)}
+        objects = [found[obj_id] for obj_id in ids if obj_id in found]
+        self.prefetch_objects(objects)
+        return Response(self.get_serializer(objects, many=True).data)
+
+    def prefetch_objects(self, objects):
+        pass
+
+
+class StudySetViewSet(ReplicaReadMixin, CachedResponseMixin, ConditionalGetMixin, MultiGetMixin, viewsets.ModelViewSet):
     serializer_class = StudySetSerializer
     permission_classes = [IsAuthenticated, IsOwner]
+    # Lists can be sorted by size or recency with ?ordering=-card_count or ?ordering=-last_modified
+    filter_backends = [OrderingFilter]
+    ordering_fields = ['date_of_creation', 'card_count', 'last_modified']
 
-    # Filters StudySets to those owned by the authenticated user
+    # Filters StudySets to those owned by the authenticated user; single StudySets can also
+    # be public ones, which IsOwner only lets other users read and clone
     def get_queryset(self):
-        return StudySet.objects.filter(user=self.request.user)
+        if self.action == 'list':
+            queryset = StudySet.objects.live().filter(user=self.request.user)
+        elif self.action == 'public':
+            queryset = StudySet.objects.live().filter(is_public=True)
+        else:
+            queryset = StudySet.objects.live().filter(Q(user=self.request.user) | Q(is_public=True))
+        queryset = queryset.select_related('user')
+        # Summaries read the stored card_count and last_modified, so they need no FlashCards
+        if self.action in ('list', 'public') and not self.expand_flashcards():
+            return queryset
+        fields = requested_fields(self.request)
+        if self.action in NESTED_CARD_ACTIONS and (fields is None or 'flashcards' in fields):
+            return queryset.prefetch_related('flashcards')
+        return queryset
+
+    # Lists return a summary unless the nested cards are requested with ?expand=flashcards
+    def get_serializer_class(self):
+        if self.action in ('list', 'public') and not self.expand_flashcards():
+            return StudySetSummarySerializer
+        return StudySetSerializer
+
+    # The inherited cards of expanded clones are loaded together rather than clone by clone,
+    # in pages of lists as well as in ?ids= lookups
+    def prefetch_objects(self, objects):
+        fields = requested_fields(self.request)
+        if self.expand_flashcards() and (fields is None or 'flashcards' in fields):
+            prefetch_all_cards(objects)
+
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        if page is not None:
+            self.prefetch_objects(page)
+        return page
+
+    def expand_flashcards(self):
+        expand = self.request.query_params.get('expand', '')
+        return 'flashcards' in expand.split(',')
+
+    # ETags follow the version of the requested StudySet, or of all the user's StudySets for lists
+    def get_etag_state(self, request):
+        if self.action == 'list':
+            return study_sets_state(request.user)
+        return first_value(StudySet.objects.live().filter(Q(user=request.user) | Q(is_public=True)), 'version', id=self.kwargs['pk'])
+
+    # Cached lists depend on all the user's StudySets, details only on the requested one
+    def get_cache_generations(self, request):
+        if self.action == 'list':
+            return [user_generation(request.user.id)]
+        return [study_set_generation(self.kwargs['pk'])]
     
     # Sets current user as the owner of the StudySet
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
+    # StudySets of JOB_DELETE_MIN_CARDS cards or more are deleted in chunks by a background Job
+    def destroy(self, request, *args, **kwargs):
+        study_set = self.get_object()
+        if study_set.card_count < settings.JOB_DELETE_MIN_CARDS:
+            self.perform_destroy(study_set)
+            return Response(status=HTTP_204_NO_CONTENT)
+        return job_accepted(request, enqueue_study_set_delete(study_set))
+
+    # Lists the public StudySets of all users
+    @action(detail=False, methods=['get'])
+    def public(self, request):
+        page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        return self.get_paginated_response(self.get_serializer(page, many=True).data)
+
+    # Creates the user's own copy of a public StudySet, which shares the FlashCards of the
+    # original until the user changes them; ?title= renames the copy
+    @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated, IsOwnerOrPublic])
+    def clone(self, request, pk=None):
+        study_set = self.get_object()
+        source = study_set.source or study_set
+        if source.user_id == request.user.id:
+            raise ValidationError({'detail': 'You cannot clone your own study set.'})
+        if source.pending_deletion:
+            raise ValidationError({'detail': 'This study set is being deleted.'})
+        existing = StudySet.objects.filter(user=request.user, source=source).values_list('id', flat=True).first()
+        if existing is not None:
+            return Response({'detail': 'You already have a clone of this study set.', 'id': existing}, status=HTTP_400_BAD_REQUEST)
+        try:
+            clone = clone_study_set(study_set, request.user, title=request.data.get('title'))
+        except IntegrityError:
+            raise ValidationError({'detail': 'You already have a clone of this study set.'})
+        return Response(StudySetSummarySerializer(clone).data, status=HTTP_201_CREATED)
+
+    # Streams flashcards from an uploaded CSV or JSON-lines file into the user's StudySets
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[MultiPartParser])
+    def import_cards(self, request):
+        upload = request.data.get('file')
+        if upload is None:
+            raise ValidationError({'file': 'This field is required!'})
+        fmt = request.data.get('format') or detect_format(upload.name)
+        if fmt not in IMPORT_FORMATS:
+            raise ValidationError({'format': 'Must be one of: {}.'.format(', '.join(IMPORT_FORMATS))})
+        on_conflict = request.data.get('on_conflict', CONFLICT_SKIP)
+        if on_conflict not in CONFLICT_MODES:
+            raise ValidationError({'on_conflict': 'Must be one of: {}.'.format(', '.join(CONFLICT_MODES))})
+        try:
+            chunk_size = int(request.data.get('chunk_size', DEFAULT_CHUNK_SIZE))
+        except ValueError:
+            raise ValidationError({'chunk_size': 'A valid integer is required.'})
+        if not 1 <= chunk_size <= IMPORT_MAX_CHUNK_SIZE:
+            raise ValidationError({'chunk_size': 'Must be between 1 and {}.'.format(IMPORT_MAX_CHUNK_SIZE)})
+        study_set = None
+        if request.data.get('study_set'):
+            study_set = get_object_or_404(StudySet, id=request.data['study_set'], user=request.user)
+
+        # Files over JOB_IMPORT_MIN_BYTES are imported by a background Job
+        if upload.size >= settings.JOB_IMPORT_MIN_BYTES:
+            params = {'study_set': study_set and study_set.id, 'format': fmt, 'chunk_size': chunk_size, 'on_conflict': on_conflict}
+            job = enqueue(JOB_IMPORT_CARDS, request.user, params, file=job_files().save('import.{}'.format(fmt), upload))
+            return job_accepted(request, job)
+        importer = CardImporter(request.user, study_set, chunk_size, on_conflict)
+        return Response(importer.run(iter_rows(upload, fmt)))
+
+    # Streams the flashcards of one StudySet as CSV or JSON-lines, or with POST writes
+    # them to a file for download by a background Job
+    @action(detail=True, methods=['get', 'post'], url_path='export')
+    def export(self, request, pk=None):
+        study_set = self.get_object()
+        if request.method == 'POST':
+            return self.queue_export(study_set.id, 'study-set-{}'.format(study_set.id))
+        cards = FlashCard.objects.visible_to(study_set.user_id, study_set_id=study_set.id)
+        return self.stream_export(cards, 'study-set-{}'.format(study_set.id))
+
+    # Streams the flashcards of all the user's StudySets as a single file, or queues it with POST
+    @action(detail=False, methods=['get', 'post'], url_path='export')
+    def export_all(self, request):
+        if request.method == 'POST':
+            return self.queue_export(None, 'study-sets')
+        return self.stream_export(FlashCard.objects.visible_to(request.user), 'study-sets')
+
+    # Returns ?questions= random cards of one StudySet, each with ?choices= distractor definitions
+    @action(detail=True, methods=['get'])
+    def quiz(self, request, pk=None):
+        study_set = self.get_object()
+        questions = get_int_param(request, 'questions', 10, QUIZ_MAX_QUESTIONS)
+        choices = get_int_param(request, 'choices', 3, QUIZ_MAX_CHOICES)
+        # Without ?seed= a new one is drawn; it is returned so the quiz can be requested again
+        if 'seed' in request.query_params:
+            seed = get_int_param(request, 'seed', 0, MAX_SEED)
+        else:
+            seed = random.randint(0, MAX_SEED)
+        return Response(build_quiz(study_set, questions, choices, seed))
+
+    def export_format(self):
+        # ?format is reserved by DRF for renderer selection, so the file format is ?type
+        fmt = self.request.query_params.get('type', 'jsonl')
+        if fmt not in EXPORT_FORMATS:
+            raise ValidationError({'type': 'Must be one of: {}.'.format(', '.join(EXPORT_FORMATS))})
+        return fmt
+
+    def queue_export(self, study_set_id, filename):
+        fmt = self.export_format()
+        params = {'study_set': study_set_id, 'type': fmt, 'filename': '{}.{}'.format(filename, fmt)}
+        return job_accepted(self.request, enqueue(JOB_EXPORT_CARDS, self.request.user, params))
+
+    def stream_export(self, flashcards, filename):
+        fmt = self.export_format()
+        response = StreamingHttpResponse(export_rows(flashcards, fmt), content_type=CONTENT_TYPES[fmt])
+        response['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(filename, fmt)
+        return response
+
 
-class FlashCardViewSet(viewsets.ModelViewSet):
+class FlashCardViewSet(ReplicaReadMixin, CachedResponseMixin, ConditionalGetMixin, MultiGetMixin, viewsets.ModelViewSet):
     serializer_class = FlashCardSerializer
     permission_classes = [IsAuthenticated, IsOwner]
 
-    # Filters Flashcards by Study Set if the id of the study set is included in URL
+    # Filters Flashcards by Study Set if the id of the study set is included in URL. The
+    # cards of clones include those they inherit.
     def get_queryset(self):
-        study_set_id = self.request.query_params.get('study_set')
-        if study_set_id:
-            return FlashCard.objects.filter(study_set__user=self.request.user, study_set__id=study_set_id)
-        else:
-            return FlashCard.objects.filter(study_set__user=self.request.user)
+        study_set_id = self.request.query_params.get('study_set') or None
+        # owner_id spares IsOwner loading the StudySet
+        return FlashCard.objects.visible_to(self.request.user, study_set_id=study_set_id).annotate(owner_id=F('study_set__user'))
     
+    # ETags follow the version of the StudySet the FlashCards belong to
+    def get_etag_state(self, request):
+        if self.action == 'retrieve':
+            version = first_value(FlashCard.objects, 'study_set__version', id=self.kwargs['pk'], study_set__user=request.user, study_set__pending_deletion=False)
+            if version is None:
+                # Inherited cards follow their source, whose changes also bump the clone
+                version = first_value(FlashCard.objects.visible_to(request.user), 'study_set__version', id=self.kwargs['pk'])
+            return version
+        study_set_id = request.query_params.get('study_set')
+        if study_set_id:
+            return first_value(StudySet.objects.live(), 'version', id=study_set_id, user=request.user)
+        return study_sets_state(request.user)
+
+    # Cached ?study_set= lists depend on that StudySet, other reads on all the user's StudySets
+    def get_cache_generations(self, request):
+        study_set_id = request.query_params.get('study_set')
+        if self.action == 'list' and study_set_id:
+            return [study_set_generation(study_set_id)]
+        return [user_generation(request.user.id)]
+
     # Links new FlashCards to the specified StudySet
     def perform_create(self, serializer):
+        study_set = self.get_study_set()
+        self.check_term(study_set.id, serializer.validated_data.get('term'))
+        with term_conflict():
+            serializer.save(study_set=study_set)
+
+    # Inherited FlashCards are copied into the clone rather than changed for every clone
+    def perform_update(self, serializer):
+        flashcard = serializer.instance
+        self.check_term(flashcard.clone_id or flashcard.study_set_id, serializer.validated_data.get('term'), flashcard.id)
+        with term_conflict():
+            if flashcard.clone_id is None:
+                return serializer.save()
+            clone = StudySet.objects.get(id=flashcard.clone_id)
+            serializer.instance = copy_on_write(clone, flashcard, serializer.validated_data)
+
+    # Terms are unique among the cards a StudySet shows, inherited ones included
+    def check_term(self, study_set_id, term, flashcard_id=None):
+        if term is None:
+            return
+        cards = FlashCard.objects.visible_to(self.request.user, study_set_id=study_set_id).filter(term=term)
+        if cards.exclude(id=flashcard_id).exists():
+            raise ValidationError({'term': [TERM_CONFLICT]})
+
+    # Deleting an inherited FlashCard only removes it from the clone
+    def perform_destroy(self, instance):
+        if instance.clone_id is None:
+            return instance.delete()
+        detach_cards(StudySet.objects.get(id=instance.clone_id), [instance.id])
+
+    # Looks up the authenticated user's StudySet named in the request body
+    def get_study_set(self):
         study_set_id = self.request.data.get('study_set')
         if not study_set_id:
             raise ValidationError({'study_set':'This field is required!'})
+        return get_object_or_404(StudySet.objects.live(), id=study_set_id, user=self.request.user)
+
+    # Creates, updates and deletes many FlashCards of one StudySet in a single request
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        study_set = self.get_study_set()
+        cards = request.data.get('cards', [])
+        delete_ids = request.data.get('delete', [])
+        on_conflict = request.data.get('on_conflict', CONFLICT_ERROR)
+        if not isinstance(cards, list) or not all(isinstance(card, dict) for card in cards):
+            raise ValidationError({'cards': 'Expected a list of flashcards.'})
+        if not isinstance(delete_ids, list) or not all(isinstance(card_id, int) for card_id in delete_ids):
+            raise ValidationError({'delete': 'Expected a list of flashcard ids.'})
+        if len(cards) + len(delete_ids) > BULK_MAX_CARDS:
+            raise ValidationError({'cards': 'At most {} flashcards can be changed at once.'.format(BULK_MAX_CARDS)})
+        if on_conflict not in CONFLICT_MODES:
+            raise ValidationError({'on_conflict': 'Must be one of: {}.'.format(', '.join(CONFLICT_MODES))})
+        return Response(apply_bulk_cards(study_set, cards, delete_ids, on_conflict))
+
+    # Queues a near-duplicate analysis of all the user's flashcards with POST, unless one is
+    # already waiting; GET returns the latest analysis, without the cards deleted since
+    @action(detail=False, methods=['get', 'post'])
+    def duplicates(self, request):
+        pending = Job.objects.filter(user=request.user, kind=JOB_FIND_DUPLICATES, status__in=[JOB_QUEUED, JOB_RUNNING])
+        if request.method == 'POST':
+            return job_accepted(request, pending.first() or enqueue(JOB_FIND_DUPLICATES, request.user))
+        job = Job.objects.filter(user=request.user, kind=JOB_FIND_DUPLICATES).order_by('-id').first()
+        if job is None:
+            raise Http404
+        clusters = []
+        if job.status == JOB_SUCCEEDED:
+            card_ids = [card['id'] for cluster in job.result['clusters'] for card in cluster['cards']]
+            live = set(FlashCard.objects.visible_to(request.user).filter(id__in=card_ids).values_list('id', flat=True))
+            for cluster in job.result['clusters']:
+                cards = [card for card in cluster['cards'] if card['id'] in live]
+                if len(cards) > 1:
+                    keep = cluster['keep'] if cluster['keep'] in live else cards[0]['id']
+                    clusters.append({**cluster, 'keep': keep, 'cards': cards})
+        return Response({'job': JobSerializer(job, context={'request': request}).data | {'result': None}, 'clusters': clusters})
+
+    # Merges each cluster of duplicates into the card it keeps, removing the others
+    @action(detail=False, methods=['post'], url_path='duplicates/merge')
+    def merge_duplicates(self, request):
+        serializer = DuplicateMergeSerializer(data=get_batch(request, 'merges', DEDUPE_MAX_MERGES, 'merges'), many=True)
+        serializer.is_valid(raise_exception=True)
+        removed, errors = merge_cards(request.user, serializer.validated_data)
+        return Response({'removed': removed, 'errors': errors})
+
+
+class ReviewViewSet(viewsets.GenericViewSet):
+    permission_classes = [IsAuthenticated]
+
+    # Returns the next ?limit= cards due for review, plus up to ?new= never reviewed cards
+    @action(detail=False, methods=['get'])
+    def due(self, request):
+        limit = get_int_param(request, 'limit', 20, REVIEW_MAX_CARDS)
+        new = get_int_param(request, 'new', 0, REVIEW_MAX_CARDS)
+        due = CardReview.objects.filter(
+            user=request.user, due_at__lte=timezone.now(),
+        ).select_related('flashcard').order_by('due_at')[:limit]
+        new_cards = FlashCard.objects.visible_to(request.user).exclude(reviews__user=request.user).order_by('date_of_creation', 'id')[:new] if new else []
+        return Response({
+            'due': DueCardSerializer(due, many=True).data,
+            'new': FlashCardSerializer(new_cards, many=True).data,
+        })
+
+    # Records a batch of answers and reschedules the answered cards
+    @action(detail=False, methods=['post'])
+    def answers(self, request):
+        serializer = ReviewAnswerSerializer(data=get_batch(request, 'answers', REVIEW_MAX_ANSWERS, 'answers'), many=True)
+        serializer.is_valid(raise_exception=True)
+        reviews, errors = record_answers(request.user, serializer.validated_data)
+        return Response({'reviews': CardReviewSerializer(reviews, many=True).data, 'errors': errors})
+
+    # Appends a batch of answers to the review event log; the stats include them once a
+    # background rollup has run
+    @action(detail=False, methods=['post'])
+    def events(self, request):
+        serializer = ReviewEventSerializer(data=get_batch(request, 'events', REVIEW_MAX_EVENTS, 'events'), many=True)
+        serializer.is_valid(raise_exception=True)
+        accepted, errors = record_events(request.user, serializer.validated_data)
+        if accepted:
+            enqueue_once(JOB_ROLLUP_REVIEWS)
+        return Response({'accepted': accepted, 'errors': errors}, status=HTTP_202_ACCEPTED)
+
+    # Accuracy of the user's StudySets, or of one StudySet and its cards with ?study_set=,
+    # read from the rolled up stats
+    @action(detail=False, methods=['get'])
+    def stats(self, request):
+        study_set_id = request.query_params.get('study_set')
+        if not study_set_id:
+            study_sets = StudySetStats.objects.filter(user=request.user).order_by('study_set')
+            return Response(StudySetStatsSerializer(study_sets, many=True).data)
+        study_set = get_object_or_404(StudySet, id=study_set_id, user=request.user)
+        totals = StudySetStats.objects.filter(user=request.user, study_set=study_set).first()
+        cards = CardStats.objects.filter(
+            user=request.user,
+            flashcard__in=FlashCard.objects.visible_to(request.user, study_set_id=study_set.id).values('id'),
+        ).order_by('flashcard')
+        return Response({
+            'study_set': StudySetStatsSerializer(totals or StudySetStats(user=request.user, study_set=study_set)).data,
+            'cards': CardStatsSerializer(cards, many=True).data,
+        })
+
+
+class SearchViewSet(viewsets.GenericViewSet):
+    permission_classes = [IsAuthenticated]
+    pagination_class = SearchPagination
+
+    # Ranks the user's flashcards, or StudySets with ?type=studysets, against ?q=
+    def get_queryset(self):
+        q = self.request.query_params.get('q', '').strip()
+        if not q:
+            raise ValidationError({'q': 'This field is required!'})
+        if self.search_type() == 'studysets':
+            return search_study_sets(self.request.user, q)
+        return search_flashcards(self.request.user, q)
+
+    def get_serializer_class(self):
+        if self.search_type() == 'studysets':
+            return StudySetSearchSerializer
+        return FlashCardSearchSerializer
+
+    def search_type(self):
+        search_type = self.request.query_params.get('type', 'flashcards')
+        if search_type not in SEARCH_TYPES:
+            raise ValidationError({'type': 'Must be one of: {}.'.format(', '.join(SEARCH_TYPES))})
+        return search_type
+
+    def list(self, request):
+        page = self.paginate_queryset(self.get_queryset())
+        return self.get_paginated_response(self.get_serializer(page, many=True).data)
+
+
+class SyncViewSet(viewsets.ViewSet):
+    permission_classes = [IsAuthenticated]
+
+    # Returns up to ?limit= study sets, flashcards and deletions changed since the ?since= token
+    def list(self, request):
+        limit = get_int_param(request, 'limit', 500, SYNC_MAX_CHANGES)
+        if limit < 1:
+            raise ValidationError({'limit': 'Must be between 1 and {}.'.format(SYNC_MAX_CHANGES)})
+        token = request.query_params.get('since')
+        if token:
+            try:
+                state = SyncState.from_token(token, request.user)
+            except (signing.BadSignature, ValueError, TypeError, KeyError, IndexError):
+                raise ValidationError({'since': 'Invalid sync token.'})
         else:
-            study_set = get_object_or_404(StudySet, id=study_set_id, user=self.request.user)
-            serializer.save(study_set=study_set)
\ No newline at end of file
+            state = SyncState(request.user.id)
+        return Response(collect_changes(request.user, state, limit))
+
+
+class JobViewSet(viewsets.ReadOnlyModelViewSet):
+    serializer_class = JobSerializer
+    permission_classes = [IsAuthenticated]
+
+    # Lists the user's background Jobs, with their status and progress
+    def get_queryset(self):
+        return Job.objects.filter(user=self.request.user)
+
+    # Serves the file a finished export Job wrote
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        job = self.get_object()
+        if job.status != JOB_SUCCEEDED or not job.file:
+            raise Http404
+        content_type = CONTENT_TYPES.get(job.params.get('type'), 'application/octet-stream')
+        return FileResponse(job_files().open(job.file, 'rb'), as_attachment=True, filename=job.result['filename'], content_type=content_type)
+
+
+class CacheStatsViewSet(viewsets.ViewSet):
+    permission_classes = [IsAdminUser]
+
+    # Hit and miss counters of this process's response cache
+    def list(self, request):
+        return Response(stats.as_dict())
+
+
+class RequestMetricsViewSet(viewsets.ViewSet):
+    permission_classes = [IsAdminUser]
+
+    # Query count and latency averages of this process, by endpoint
+    def list(self, request):
+        return Response(endpoint_stats.as_dict())
\ No newline at end of file